@@ -0,0 +1,74 @@
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.client.Run;
+import com.github.gumtreediff.gen.TreeGenerators;
+import com.github.gumtreediff.io.ActionsIoUtils;
+import com.github.gumtreediff.io.TreeIoUtils;
+import com.github.gumtreediff.matchers.GumtreeProperties;
+import com.github.gumtreediff.tree.TreeContext;
+
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintWriter;
+import java.io.StringWriter;
+import java.nio.charset.StandardCharsets;
+
+/*
+ * A long-lived GumTree worker.
+ *
+ * Reads one request per line from stdin:
+ *   parse<TAB>GENERATOR<TAB>PATH
+ *   textdiff<TAB>MATCHER<TAB>GENERATOR<TAB>PATH0<TAB>PATH1
+ * where GENERATOR is "-" for the default one.
+ *
+ * Writes "OK <nbytes>\n" or "ERR <nbytes>\n" followed by <nbytes> of
+ * UTF-8 encoded payload (JSON or error message) for each request.
+ * Exits on EOF.
+ */
+public class GtServer {
+
+    static String opt(String s) {
+        return s.equals("-") ? null : s;
+    }
+
+    static String handle(String[] req) throws Exception {
+        if (req[0].equals("parse") && req.length == 3) {
+            TreeContext ctx = TreeGenerators.getInstance().getTree(req[2], opt(req[1]));
+            return TreeIoUtils.toJson(ctx).toString();
+        } else if (req[0].equals("textdiff") && req.length == 5) {
+            Diff diff = Diff.compute(req[3], req[4], opt(req[2]), opt(req[1]),
+                                     new GumtreeProperties());
+            return ActionsIoUtils.toJson(diff.src, diff.editScript, diff.mappings).toString();
+        }
+        throw new IllegalArgumentException("invalid request: " + String.join(" ", req));
+    }
+
+    static void reply(OutputStream out, String status, String payload) throws Exception {
+        byte[] b = payload.getBytes(StandardCharsets.UTF_8);
+        out.write((status + " " + b.length + "\n").getBytes(StandardCharsets.US_ASCII));
+        out.write(b);
+        out.flush();
+    }
+
+    public static void main(String[] args) throws Exception {
+        Run.initGenerators();
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in,
+                                                                     StandardCharsets.UTF_8));
+        // keep stray prints of tree generators away from the replies
+        OutputStream out = System.out;
+        System.setOut(System.err);
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty())
+                continue;
+            try {
+                reply(out, "OK", handle(line.split("\t", -1)));
+            } catch (Throwable e) {
+                StringWriter sw = new StringWriter();
+                e.printStackTrace(new PrintWriter(sw));
+                reply(out, "ERR", sw.toString());
+            }
+        }
+    }
+}
@@ -0,0 +1,3 @@
+#!/bin/sh
+HERE=$(dirname $0)
+exec java -cp "${HERE}/gumtree-3.1.0-SNAPSHOT/lib/*" ${HERE}/GtServer.java
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+# An asyncio executor for tasks that mostly wait on external differencing tools
+
+import os
+import asyncio
+import functools
+import threading
+import subprocess
+import multiprocessing as mp
+from asyncio.subprocess import PIPE, DEVNULL
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import common
+from common import GUMTREE_SERVER_CMD, GUMTREE_SERVER_TIMEOUT, GUMTREE_MATCHER
+from common import get_gumtree_generator, gumtree_session_safe
+
+logger = mp.get_logger()
+
+NPOSTS = 2
+
+
+async def read_pipe(f):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+    return await reader.read()
+
+
+async def wait4(pid):
+    # the child is reaped here rather than by the asyncio child watcher so that its
+    # rusage is available; wait for it to exit on a pidfd where the platform has one
+    loop = asyncio.get_running_loop()
+    if not hasattr(os, 'pidfd_open'):
+        return await loop.run_in_executor(None, os.wait4, pid, 0)
+    fd = os.pidfd_open(pid)
+    try:
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(fd)
+    finally:
+        os.close(fd)
+    return os.wait4(pid, 0)
+
+
+async def timed(spans, phase, aw):
+    st_time = common.get_time()
+    try:
+        return await aw
+    finally:
+        common.add_span(phase, common.get_time() - st_time, spans)
+
+
+async def run_cmd(cmd, usage=None):
+    p = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    try:
+        out, err = await asyncio.gather(read_pipe(p.stdout), read_pipe(p.stderr))
+        _, status, ru = await wait4(p.pid)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    except BaseException:
+        p.kill()
+        p.wait()
+        raise
+    common.add_rusage(usage, ru)
+    return p.returncode, out, err
+
+
+class AsyncGumtreeSession(object):
+    def __init__(self, cmd=GUMTREE_SERVER_CMD, timeout=GUMTREE_SERVER_TIMEOUT):
+        self.cmd = cmd
+        self.timeout = timeout
+        self._proc = None
+
+    async def start(self):
+        logger.debug(f'starting {self.cmd}')
+        self._proc = await asyncio.create_subprocess_exec(self.cmd, stdin=PIPE, stdout=PIPE,
+                                                          stderr=DEVNULL)
+
+    async def close(self):
+        if self._proc is not None:
+            proc = self._proc
+            self._proc = None
+            try:
+                proc.stdin.close()
+                await asyncio.wait_for(proc.wait(), timeout=10)
+            except Exception:
+                proc.kill()
+                await proc.wait()
+
+    async def kill(self):
+        if self._proc is not None:
+            proc = self._proc
+            self._proc = None
+            proc.kill()
+            await proc.wait()
+
+    def alive(self):
+        return self._proc is not None and self._proc.returncode is None
+
+    async def recv(self):
+        head = await self._proc.stdout.readline()
+        status, n = head.split()
+        data = await self._proc.stdout.readexactly(int(n))
+        return status, data
+
+    async def request(self, *fields, usage=None):
+        if not gumtree_session_safe(*fields):
+            raise ValueError(f'tab or newline in request: {fields}')
+        if not self.alive():
+            await self.start()
+        pid = self._proc.pid
+        before = common.get_proc_usage(pid) if usage is not None else None
+        line = '\t'.join(fields) + '\n'
+        try:
+            self._proc.stdin.write(line.encode('utf-8'))
+            await self._proc.stdin.drain()
+            status, data = await asyncio.wait_for(self.recv(), self.timeout)
+        except asyncio.TimeoutError:
+            await self.kill()
+            raise RuntimeError(f'gumtree server failed: no reply within {self.timeout}s')
+        except Exception as e:
+            await self.kill()
+            raise RuntimeError(f'gumtree server failed: {e}')
+        common.add_proc_usage(usage, pid, before)
+        if status != b'OK':
+            raise RuntimeError(data.decode('utf-8', errors='replace'))
+        return data
+
+    async def parse(self, path, usage=None):
+        gen = get_gumtree_generator(path) or '-'
+        return await self.request('parse', gen, path, usage=usage)
+
+    async def diff(self, path0, path1, matcher=GUMTREE_MATCHER, usage=None):
+        gen = get_gumtree_generator(path0) or '-'
+        return await self.request('textdiff', matcher, gen, path0, path1, usage=usage)
+
+
+class AsyncDriver(object):
+    # nslots external tool invocations are in flight at a time and each slot owns
+    # its gumtree server and diffast local cache; JSON decoding and analysis run
+    # in a pool of nposts processes, and file I/O that updates the state of this
+    # process (caches, locators) runs on a single thread
+    def __init__(self, nslots=1, nposts=NPOSTS, use_gumtree_session=True):
+        self.nslots = nslots
+        self.nposts = nposts
+        self.use_gumtree_session = use_gumtree_session
+        self._free_slots = None
+        self._session_tbl = {}
+        self._executor = None
+        self._io_executor = None
+        self._it_lock = None
+
+    async def acquire(self):
+        return await self._free_slots.get()
+
+    def release(self, slot):
+        self._free_slots.put_nowait(slot)
+
+    async def post(self, f, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, f, *args)
+
+    async def io(self, f, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_executor, functools.partial(f, *args, **kwargs))
+
+    def get_session(self, slot):
+        session = self._session_tbl.get(slot, None)
+        if session is None:
+            session = self._session_tbl[slot] = AsyncGumtreeSession()
+        return session
+
+    async def gumtree_parse(self, slot, path, usage=None):
+        if common.replaying():
+            raise RuntimeError(f'{path}: not found in tool archive')
+        if self.use_gumtree_session and gumtree_session_safe(path):
+            return await self.get_session(slot).parse(path, usage=usage)
+        cmd = common.gumtree_parse_cmd(path)
+        rc, out, err = await run_cmd(cmd, usage=usage)
+        return out if rc == 0 else None
+
+    async def gumtree_diff(self, slot, path0, path1, matcher=GUMTREE_MATCHER, usage=None):
+        if common.replaying():
+            raise RuntimeError(f'{path0} {path1}: not found in tool archive')
+        if self.use_gumtree_session and gumtree_session_safe(path0, path1):
+            return await self.get_session(slot).diff(path0, path1, matcher=matcher, usage=usage)
+        cmd = common.gumtree_diff_cmd(path0, path1, matcher=matcher)
+        rc, out, err = await run_cmd(cmd, usage=usage)
+        return out if rc == 0 else None
+
+    async def text_gumtree_sim(self, path0, path1, matcher=GUMTREE_MATCHER):
+        t0 = await self.io(common.gumtree_cached_parse, path0)
+        t1 = await self.io(common.gumtree_cached_parse, path1)
+        d = await self.io(common.gumtree_cached_diff, path0, path1, matcher=matcher)
+        stores = []
+        usage = common.new_usage()
+        spans = {}
+        if t0 is None or t1 is None or d is None:
+            slot = await timed(spans, 'wait_slot', self.acquire())
+            try:
+                if t0 is None:
+                    t0 = await timed(spans, 'ext_parse',
+                                     self.gumtree_parse(slot, path0, usage=usage))
+                    stores.append((common.gumtree_store_parse, path0, t0))
+                if t1 is None:
+                    t1 = await timed(spans, 'ext_parse',
+                                     self.gumtree_parse(slot, path1, usage=usage))
+                    stores.append((common.gumtree_store_parse, path1, t1))
+                if d is None:
+                    d = await timed(spans, 'ext_diff',
+                                    self.gumtree_diff(slot, path0, path1, matcher=matcher,
+                                                      usage=usage))
+                    stores.append((common.gumtree_store_diff, path0, path1, matcher, d))
+            except Exception as e:
+                logger.error(f'{path0} {path1}: {e}')
+            finally:
+                self.release(slot)
+        r = await self.post(common.traced, common.gumtree_result, path0, path1, t0, t1, d)
+        for f, *args in stores:
+            await self.post(f, *args)
+        r.update(usage)
+        return common.merge_spans(r, spans)
+
+    async def text_diffast_sim(self, path0, path1,
+                               keep_going=False,
+                               scan_huge_arrays=False,
+                               no_rr=False,
+                               weak=False,
+                               use_cache=True, cache_dir=None):
+        opts = common.diffast_archive_opts(keep_going=keep_going,
+                                           scan_huge_arrays=scan_huge_arrays,
+                                           no_rr=no_rr, weak=weak)
+        if common.replaying():
+            return await self.post(common.traced, common.replay_diffast, path0, path1, opts)
+        usage = common.new_usage()
+        spans = {}
+        slot = await timed(spans, 'wait_slot', self.acquire())
+        try:
+            local_cache_name = f'slot-{slot}'
+            hit = await self.io(common.diffast_cached, path0, path1, cache_dir, local_cache_name,
+                                use_cache)
+            cmd0 = common.diffast_cmd(path0, path1,
+                                      keep_going=keep_going,
+                                      scan_huge_arrays=scan_huge_arrays,
+                                      no_rr=no_rr,
+                                      weak=weak,
+                                      use_cache=use_cache, cache_dir=cache_dir,
+                                      local_cache_name=local_cache_name)
+            rc, out, err = await timed(spans, 'ext_diff', run_cmd(cmd0, usage=usage))
+
+            if out.decode('utf-8', errors='replace').strip() == '1.0':
+                await self.post(common.archive_diffast, path0, path1, opts, cmd0, out, rc)
+                return common.merge_spans(dict(similarity=1.0, colored=0, cost=0, **usage), spans)
+
+            locator = common.get_diffast_cache_locator(cache_dir=cache_dir)
+            cache_path = await self.io(locator.lookup, path0, path1,
+                                       local_cache_name=local_cache_name)
+            if cache_path is None:
+                cmd1 = common.diffast_getcache_cmd(path0, path1, cache_dir=cache_dir,
+                                                   local_cache_name=local_cache_name)
+                _, out, _ = await timed(spans, 'ext_locate', run_cmd(cmd1, usage=usage))
+                cache_path = out.decode('utf-8', errors='replace').strip()
+                await self.io(locator.learn, path0, path1, cache_path,
+                              local_cache_name=local_cache_name)
+            if rc == 0 and cache_path and not hit:
+                await self.io(common.mark_complete, cache_path)
+            await self.io(common.record_diffast_access, cache_dir, cache_path, hit)
+        finally:
+            self.release(slot)
+        await self.post(common.archive_diffast, path0, path1, opts, cmd0, out, rc, cache_path)
+        r = await self.post(common.traced, common.diffast_result, path0, path1, cache_path, cmd0,
+                            hit)
+        r.update(usage)
+        return common.merge_spans(r, spans)
+
+    async def next_task(self, it):
+        # taking a task may wait for staged files to be released, so the iterator
+        # is advanced on a thread rather than on the event loop
+        loop = asyncio.get_running_loop()
+        async with self._it_lock:
+            taken = loop.create_future()
+
+            def take():
+                try:
+                    x = next(it, None)
+                    loop.call_soon_threadsafe(lambda: taken.done() or taken.set_result(x))
+                except Exception as e:
+                    loop.call_soon_threadsafe(lambda e=e: taken.done() or taken.set_exception(e))
+
+            threading.Thread(target=take, daemon=True).start()
+            return await taken
+
+    async def _worker(self, it, run_task, on_result, on_error):
+        while True:
+            task = await self.next_task(it)
+            if task is None:
+                break
+            try:
+                r = await run_task(self, task)
+            except Exception as e:
+                logger.error(f'{task}: {e}')
+                if on_error is not None:
+                    on_error(task, e)
+                continue
+            on_result(r)
+
+    async def run(self, tasks, run_task, on_result, on_error=None):
+        # on_error(task, exc) is called instead of on_result for a task that raised
+        self._free_slots = asyncio.Queue()
+        self._it_lock = asyncio.Lock()
+        for slot in range(self.nslots):
+            self._free_slots.put_nowait(slot)
+        self._executor = ProcessPoolExecutor(self.nposts, mp_context=mp.get_context('fork'))
+        self._io_executor = ThreadPoolExecutor(1)
+        # fork the pool before any gumtree server starts so that the servers' pipes
+        # are not inherited and they see EOF on close
+        await self.post(os.getpid)
+        # workers beyond nslots keep the post-processing pool busy while slots are taken
+        it = iter(tasks)
+        nworkers = self.nslots + self.nposts
+        try:
+            await asyncio.gather(*[self._worker(it, run_task, on_result, on_error)
+                                   for _ in range(nworkers)])
+        finally:
+            for session in self._session_tbl.values():
+                await session.close()
+            self._session_tbl.clear()
+            self._executor.shutdown()
+            self._executor = None
+            self._io_executor.shutdown()
+            self._io_executor = None
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+# Benchmarks the Python analysis layer of common.py (GtHandler and
+# read_diff_json) on recorded GumTree and Diff/AST outputs, so that it can be
+# measured and checked for regressions without the tools installed
+
+import os
+import gc
+import json
+import time
+import shutil
+import hashlib
+import logging
+import multiprocessing as mp
+
+import common
+import samples
+import shootout
+from common import GtHandler, get_time, get_token_regions, read_diff_json, read_stat_json
+from gt_cache import GUMTREE_CACHE_NAME
+from memo import file_digest
+
+logger = logging.getLogger()
+
+FIXTURES_DIR = 'fixtures-analysis'
+BASELINE_FILE = 'bench-analysis.json'
+
+META_FILE = 'meta.json'
+
+GT_FILES = ('parse0.json', 'parse1.json', 'diff.json')
+DA_FILES = ('stat.json', 'diff.json')
+
+NPAIRS = 20
+REPEAT = 5
+NWARMUPS = 1
+THRESHOLD = 0.2
+
+
+class Fixture(object):
+    def __init__(self, d):
+        self.name = os.path.basename(d)
+        with open(os.path.join(d, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.path0 = os.path.join(d, '0', self.meta['old'])
+        self.path1 = os.path.join(d, '1', self.meta['new'])
+        self.align0 = get_token_regions(self.path0)
+        self.align1 = get_token_regions(self.path1)
+        self.tree0 = self.tree1 = self.diff = None
+        gt_dir = os.path.join(d, 'gumtree')
+        if all(os.path.exists(os.path.join(gt_dir, fn)) for fn in GT_FILES):
+            self.tree0, self.tree1, self.diff = [common.load_json(os.path.join(gt_dir, fn))
+                                                 for fn in GT_FILES]
+        self.da_stat = self.da_diff = None
+        da_dir = os.path.join(d, 'diffast')
+        if all(os.path.exists(os.path.join(da_dir, fn)) for fn in DA_FILES):
+            self.da_stat, self.da_diff = [os.path.join(da_dir, fn) for fn in DA_FILES]
+
+    def has(self, tool):
+        if tool == 'gumtree':
+            return self.diff is not None
+        return self.da_diff is not None
+
+
+# a GtHandler is created per pair as in gumtree_result so that tree indexes are
+# built within the measured time
+BENCHES = [
+    ('similarity', 'gumtree',
+     lambda x: GtHandler(x.path0).similarity(x.tree0, x.tree1, x.diff)),
+    ('delta', 'gumtree',
+     lambda x: GtHandler(x.path0).delta(x.tree0, x.tree1, x.diff)),
+    ('text_similarity', 'gumtree',
+     lambda x: GtHandler(x.path0).text_similarity(x.tree0, x.tree1, x.diff,
+                                                  x.align0, x.align1)),
+    ('get_region_mapping', 'gumtree',
+     lambda x: GtHandler(x.path0).get_region_mapping(x.diff)),
+    ('analyze', 'gumtree',
+     lambda x: GtHandler(x.path0).analyze(x.tree0, x.tree1, x.diff, x.align0, x.align1)),
+    ('read_diff_json', 'diffast',
+     lambda x: read_diff_json(x.da_diff, x.align0, x.align1)),
+    ('read_stat_json', 'diffast',
+     lambda x: read_stat_json(x.da_stat)),
+]
+
+BENCH_NAMES = [name for name, _, _ in BENCHES]
+
+
+def record_gumtree(path0, path1, d, session=None):
+    outs = [common.gumtree_cached_parse(path0) or common.gumtree_parse_raw(path0, session),
+            common.gumtree_cached_parse(path1) or common.gumtree_parse_raw(path1, session),
+            (common.gumtree_cached_diff(path0, path1) or
+             common.gumtree_diff_raw(path0, path1, session=session))]
+    if not all(outs):
+        logger.warning(f'failed to get gumtree outputs: {path0} {path1}')
+        return False
+    os.makedirs(d, exist_ok=True)
+    for fn, data in zip(GT_FILES, outs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(os.path.join(d, fn), 'wb') as f:
+            f.write(data)
+    return True
+
+
+def record_diffast(path0, path1, d, cache_dir='CACHE'):
+    common.text_diffast_sim(path0, path1, keep_going=True, weak=True, use_cache=True,
+                            cache_dir=cache_dir)
+    locator = common.get_diffast_cache_locator(cache_dir=cache_dir)
+    cache_path = locator.locate(path0, path1, local_cache_name=mp.current_process().name)
+    if not cache_path or not all(os.path.exists(os.path.join(cache_path, fn))
+                                 for fn in DA_FILES):
+        logger.warning(f'no diffast outputs (identical?): {path0} {path1}')
+        return False
+    os.makedirs(d, exist_ok=True)
+    for fn in DA_FILES:
+        shutil.copyfile(os.path.join(cache_path, fn), os.path.join(d, fn))
+    return True
+
+
+def record(samples_dir, projs, fixtures_dir=FIXTURES_DIR, npairs=NPAIRS,
+           tools=('gumtree', 'diffast'), cache_dir='CACHE', gumtree_cache_dir=GUMTREE_CACHE_NAME,
+           use_gumtree_session=True):
+    common.set_gumtree_cache(gumtree_cache_dir)
+    session = None
+    if 'gumtree' in tools and use_gumtree_session:
+        session = common.GumtreeSession()
+    store = samples.get_store(samples_dir)
+    count = 0
+    try:
+        for proj in projs:
+            tasks = shootout.get_tasks(samples_dir, proj)[:npairs]
+            for i, task in enumerate(store.staged(tasks)):
+                d = os.path.join(fixtures_dir, f'{proj}-{i:04d}')
+                old = os.path.basename(task['old'])
+                new = os.path.basename(task['new'])
+                for side, fn, path in (('0', old, task['path0']), ('1', new, task['path1'])):
+                    os.makedirs(os.path.join(d, side), exist_ok=True)
+                    shutil.copyfile(path, os.path.join(d, side, fn))
+                meta = {'proj': proj, 'commit': task['commit'], 'path': task['path'],
+                        'old': old, 'new': new}
+                with open(os.path.join(d, META_FILE), 'w') as f:
+                    json.dump(meta, f, indent=2)
+                ok = False
+                if 'gumtree' in tools:
+                    ok |= record_gumtree(task['path0'], task['path1'],
+                                         os.path.join(d, 'gumtree'), session=session)
+                if 'diffast' in tools:
+                    ok |= record_diffast(task['path0'], task['path1'],
+                                         os.path.join(d, 'diffast'), cache_dir=cache_dir)
+                if ok:
+                    count += 1
+                else:
+                    shutil.rmtree(d, ignore_errors=True)
+                store.release(samples.get_task_paths(task))
+    finally:
+        if session is not None:
+            session.close()
+    print(f'{count} fixtures recorded in {fixtures_dir}')
+    return count
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    fixtures = []
+    if not os.path.isdir(fixtures_dir):
+        return fixtures
+    for name in sorted(os.listdir(fixtures_dir)):
+        d = os.path.join(fixtures_dir, name)
+        if os.path.exists(os.path.join(d, META_FILE)):
+            fixtures.append(Fixture(d))
+    return fixtures
+
+
+def get_corpus_digest(fixtures_dir=FIXTURES_DIR):
+    h = hashlib.sha1()
+    for dpath, dns, fns in os.walk(fixtures_dir):
+        dns.sort()
+        for fn in sorted(fns):
+            path = os.path.join(dpath, fn)
+            h.update(f'{os.path.relpath(path, fixtures_dir)}\0{file_digest(path)}\n'.encode())
+    return h.hexdigest()[:12]
+
+
+def measure(f, xs, repeat=REPEAT, nwarmups=NWARMUPS):
+    # as in timeit, collections are kept out of the measured passes
+    for _ in range(nwarmups):
+        for x in xs:
+            f(x)
+    times = []
+    rs = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            st_time = get_time()
+            rs = [f(x) for x in xs]
+            times.append(get_time() - st_time)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return rs, times
+
+
+def bench(fixtures, names=BENCH_NAMES, repeat=REPEAT, nwarmups=NWARMUPS):
+    tbl = {}
+    for name, tool, f in BENCHES:
+        if name not in names:
+            continue
+        xs = [x for x in fixtures if x.has(tool)]
+        if not xs:
+            logger.warning(f'no {tool} fixtures for {name}')
+            continue
+        rs, times = measure(f, xs, repeat=repeat, nwarmups=nwarmups)
+        t = min(times)
+        tbl[name] = {'npairs': len(xs), 'time': t,
+                     'median': sorted(times)[len(times) // 2],
+                     'throughput': len(xs) / t if t > 0 else float('inf'),
+                     'digest': hashlib.sha1(repr(rs).encode()).hexdigest()[:12]}
+    return tbl
+
+
+def compare(tbl, baseline, threshold=THRESHOLD):
+    # a bench fails if its throughput drops by more than threshold or its results change
+    failures = []
+    base_tbl = baseline['results']
+    for name, r in tbl.items():
+        b = base_tbl.get(name, None)
+        if b is None:
+            continue
+        ratio = r['throughput'] / b['throughput']
+        r['change'] = ratio - 1
+        if ratio < 1 - threshold:
+            failures.append(f'{name}: throughput {b["throughput"]:.1f} -> {r["throughput"]:.1f}'
+                            f' pairs/s ({(ratio - 1)*100:+.1f}%)')
+        if r['digest'] != b['digest']:
+            failures.append(f'{name}: results changed ({b["digest"]} -> {r["digest"]})')
+    return failures
+
+
+def report(tbl):
+    lines = [f'{"bench":<20} {"pairs":>6} {"best":>10} {"median":>10} {"pairs/s":>10}'
+             f' {"change":>8}']
+    for name, r in tbl.items():
+        change = f'{r["change"]*100:+.1f}%' if 'change' in r else ''
+        lines.append(f'{name:<20} {r["npairs"]:>6} {r["time"]*1000:>8.1f}ms'
+                     f' {r["median"]*1000:>8.1f}ms {r["throughput"]:>10.1f} {change:>8}')
+    return '\n'.join(lines)
+
+
+def load_baseline(path=BASELINE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(tbl, corpus, repeat, path=BASELINE_FILE):
+    baseline = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'corpus': corpus,
+                'repeat': repeat, 'results': tbl}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    print(f'baseline dumped into {path}')
+
+
+if __name__ == '__main__':
+    import sys
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='benchmark the analysis of GumTree and Diff/AST outputs'
+                            ' on recorded fixtures',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('command', choices=['record', 'run'],
+                        help='record fixtures from the samples (requires the tools or their'
+                        ' caches), or run the benchmarks on them')
+
+    parser.add_argument('-f', '--fixtures', dest='fixtures_dir', metavar='DIR',
+                        default=FIXTURES_DIR, help='specify fixtures dir')
+
+    parser.add_argument('-s', '--samples-dir', dest='samples_dir', metavar='DIR',
+                        default='samples', help='specify samples dir to record from')
+
+    parser.add_argument('--proj', dest='projs', metavar='PROJ', nargs='*', default=None,
+                        help='specify project(s) to record from')
+
+    parser.add_argument('-n', '--npairs', dest='npairs', metavar='N', type=int, default=NPAIRS,
+                        help='specify number of pairs recorded per project')
+
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', metavar='DIR', default='CACHE',
+                        help='specify diffast cache dir to record from')
+
+    parser.add_argument('--gumtree-cache-dir', dest='gumtree_cache_dir', metavar='DIR',
+                        default=GUMTREE_CACHE_NAME, help='specify gumtree cache dir to record from')
+
+    parser.add_argument('--no-gumtree-session', dest='use_gumtree_session',
+                        action='store_false', help='launch gumtree for each parse/diff')
+
+    parser.add_argument('-b', '--bench', dest='benches', metavar='NAME', nargs='*',
+                        choices=BENCH_NAMES, default=BENCH_NAMES,
+                        help='specify benchmark(s) to run')
+
+    parser.add_argument('-r', '--repeat', dest='repeat', metavar='N', type=int, default=REPEAT,
+                        help='specify number of measured passes over the fixtures')
+
+    parser.add_argument('-w', '--nwarmups', dest='nwarmups', metavar='N', type=int,
+                        default=NWARMUPS, help='specify number of passes discarded first')
+
+    parser.add_argument('--baseline', dest='baseline', metavar='FILE', default=BASELINE_FILE,
+                        help='specify baseline file to compare against')
+
+    parser.add_argument('--save', dest='save', action='store_true',
+                        help='save the results as the baseline')
+
+    parser.add_argument('-t', '--threshold', dest='threshold', type=float, default=THRESHOLD,
+                        help='specify tolerated drop in throughput relative to the baseline')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == 'record':
+        projs = args.projs or shootout.get_projects(args.samples_dir)
+        record(args.samples_dir, projs, fixtures_dir=args.fixtures_dir, npairs=args.npairs,
+               cache_dir=args.cache_dir, gumtree_cache_dir=args.gumtree_cache_dir,
+               use_gumtree_session=args.use_gumtree_session)
+        sys.exit(0)
+
+    fixtures = load_fixtures(args.fixtures_dir)
+    if not fixtures:
+        print(f'no fixtures found in {args.fixtures_dir}')
+        sys.exit(1)
+    corpus = get_corpus_digest(args.fixtures_dir)
+
+    tbl = bench(fixtures, names=args.benches, repeat=args.repeat, nwarmups=args.nwarmups)
+
+    failures = []
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and not args.save:
+        if baseline['corpus'] != corpus:
+            failures.append(f'baseline was taken on another corpus ({baseline["corpus"]})')
+        else:
+            failures = compare(tbl, baseline, threshold=args.threshold)
+
+    print(f'{len(fixtures)} fixtures (corpus {corpus})')
+    print(report(tbl))
+
+    if args.save:
+        save_baseline(tbl, corpus, args.repeat, path=args.baseline)
+
+    for x in failures:
+        print(f'! {x}')
+
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# Runs shootout.py on synthetic pairs of increasing size and plots time and
+# memory of each tool and of the Python analysis layer against SLOC
+
+import os
+import csv
+import logging
+import tracemalloc
+
+from matplotlib import pyplot as plt
+
+import shootout
+import trace_report
+from gen_synth import generate, parse_list, SIZES, EDIT_RATIOS
+
+logger = logging.getLogger()
+
+TOOLS = ['gumtree', 'diffast']
+
+# phases run by common.py itself rather than by the external tools
+PY_PHASES = ('json_load', 'analysis', 'token_scan', 'intersect')
+
+HEADER = ['proj', 'old', 'new', 'sloc', 'edit_ratio', 'tool',
+          'time', 'cpu_time', 'maxrss', 'py_time', 'py_peak']
+
+PREFIX_TBL = {'gumtree': 'gt', 'diffast': 'da'}
+
+LABEL_TBL = {'gumtree': 'GumTree', 'diffast': 'Diff/AST'}
+
+
+def read_csv(path):
+    try:
+        with open(path, newline='') as f:
+            return list(csv.DictReader(f))
+    except FileNotFoundError:
+        logger.warning(f'not found: {path}')
+        return []
+
+
+def to_float(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_outfiles(proj):
+    # a single process runs both tools into one file
+    outfile = f'out-{proj}.csv'
+    if os.path.exists(outfile):
+        return [outfile]
+    return [shootout.OUTFILE_FMT_TBL[tool].format(proj) for tool in TOOLS]
+
+
+def collect(samples_dir, projs):
+    rows = []
+    for proj in projs:
+        idx_tbl = {}
+        for row in read_csv(os.path.join(samples_dir, proj, 'index.csv')):
+            idx_tbl[(row['old'], row['new'])] = row
+        for outfile in get_outfiles(proj):
+            trace_tbl = {}
+            for rec in trace_report.load_traces([trace_report.get_trace_path(outfile)]):
+                trace_tbl[(rec['old'], rec['new'], rec['tool'])] = rec
+            for row in read_csv(outfile):
+                idx = idx_tbl.get((row['old'], row['new']), {})
+                for tool in TOOLS:
+                    p = PREFIX_TBL[tool]
+                    if f'{p}_time' not in row:
+                        continue
+                    rec = trace_tbl.get((row['old'], row['new'], tool), {})
+                    utime = to_float(row.get(f'{p}_utime'))
+                    stime = to_float(row.get(f'{p}_stime'))
+                    py_time = None
+                    if 'spans' in rec:
+                        py_time = sum(rec['spans'].get(ph, .0) for ph in PY_PHASES)
+                    rows.append({'proj': proj, 'old': row['old'], 'new': row['new'],
+                                 'sloc': to_float(idx.get('sloc')),
+                                 'edit_ratio': to_float(idx.get('edit_ratio')),
+                                 'tool': tool,
+                                 'time': to_float(row[f'{p}_time']),
+                                 'cpu_time': (utime + stime) if utime is not None else None,
+                                 'maxrss': to_float(row.get(f'{p}_maxrss')),
+                                 'py_time': py_time,
+                                 'py_peak': rec.get('py_peak', None)})
+    return rows
+
+
+def get_series(rows, tool, key):
+    tbl = {}
+    for row in rows:
+        if row['tool'] == tool and row['sloc'] is not None and row[key] is not None:
+            tbl.setdefault(row['sloc'], []).append(row[key])
+    xs = sorted(tbl.keys())
+    return xs, [sorted(tbl[x])[len(tbl[x]) // 2] for x in xs]
+
+
+def plot(rows, out_file):
+    f, (ax0, ax1) = plt.subplots(1, 2, figsize=(12, 5))
+
+    for tool in TOOLS:
+        label = LABEL_TBL[tool]
+        xs, ys = get_series(rows, tool, 'time')
+        if xs:
+            ax0.plot(xs, ys, marker='o', label=f'{label}')
+        xs, ys = get_series(rows, tool, 'py_time')
+        if xs:
+            ax0.plot(xs, ys, marker='x', linestyle='--', label=f'{label} (Python)')
+        xs, ys = get_series(rows, tool, 'maxrss')
+        if xs:
+            ax1.plot(xs, [y / 1024 for y in ys], marker='o', label=f'{label}')
+        xs, ys = get_series(rows, tool, 'py_peak')
+        if xs:
+            ax1.plot(xs, [y / (1 << 20) for y in ys], marker='x', linestyle='--',
+                     label=f'{label} (Python)')
+
+    for ax in (ax0, ax1):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('SLOC')
+        ax.legend()
+
+    ax0.set_ylabel('Time (s)')
+    ax1.set_ylabel('Peak memory (MiB)')
+
+    f.tight_layout()
+    f.savefig(out_file)
+    print(f'saved: {out_file}')
+
+
+def dump(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=HEADER)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    print(f'{len(rows)} rows dumped into {path}')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='benchmark scaling of the differencing tools'
+                            ' on synthetic pairs',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-d', '--samples-dir', dest='samples_dir', metavar='DIR',
+                        default='synth', help='specify samples dir (generated if missing)')
+
+    parser.add_argument('-w', '--workdir', dest='workdir', metavar='DIR',
+                        default='bench-scaling', help='specify dir for results')
+
+    parser.add_argument('-s', '--sizes', dest='sizes', metavar='N,...', type=parse_list(int),
+                        default=SIZES, help='specify approximate SLOC of generated pairs')
+
+    parser.add_argument('-e', '--edit-ratios', dest='edit_ratios', metavar='R,...',
+                        type=parse_list(float), default=EDIT_RATIOS,
+                        help='specify edit ratios of generated pairs')
+
+    parser.add_argument('-n', '--npairs', dest='npairs', metavar='N', type=int, default=3,
+                        help='specify number of generated pairs for each size and edit ratio')
+
+    parser.add_argument('-p', '--nprocs', dest='nprocs', type=int, default=1,
+                        help='specify number of processes')
+
+    parser.add_argument('--py-memory', dest='py_memory', action='store_true',
+                        help='measure peak Python allocations with tracemalloc'
+                        ' (slows down the Python layer)')
+
+    parser.add_argument('--plot-only', dest='plot_only', action='store_true',
+                        help='plot results already in the workdir')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    samples_dir = os.path.abspath(args.samples_dir)
+
+    if not os.path.exists(samples_dir):
+        generate(samples_dir, sizes=args.sizes, edit_ratios=args.edit_ratios,
+                 npairs=args.npairs)
+
+    projs = shootout.get_projects(samples_dir)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+
+    if not args.plot_only:
+        if args.py_memory:
+            tracemalloc.start()
+        shootout.main(projs, samples_dir=samples_dir, nprocs=args.nprocs, use_cache=False,
+                      cache_dir='CACHE', run_sloccount=False, memo_dir=None,
+                      gumtree_cache_dir=None, trace=True)
+
+    rows = collect(samples_dir, projs)
+    dump(rows, 'bench-scaling.csv')
+    plot(rows, 'bench-scaling.png')
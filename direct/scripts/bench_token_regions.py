@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import os
+
+from common import get_time, get_lang, get_token_regions, get_token_regions0
+
+
+def iter_sources(root, projs=None):
+    if projs is None:
+        projs = sorted(os.listdir(root))
+    for proj in projs:
+        for side in ('0', '1'):
+            d = os.path.join(root, proj, side)
+            if not os.path.isdir(d):
+                continue
+            for dpath, dns, fns in os.walk(d):
+                for fn in sorted(fns):
+                    if get_lang(fn) != '?':
+                        yield proj, os.path.join(dpath, fn)
+
+
+def measure(f, path, repeat=1):
+    r = None
+    st_time = get_time()
+    for i in range(repeat):
+        r = f(path)
+    t = (get_time() - st_time) / repeat
+    return r, t
+
+
+def bench(root, projs=None, repeat=1):
+    tbl = {}
+    mismatches = []
+
+    for proj, path in iter_sources(root, projs):
+        r0, t0 = measure(get_token_regions0, path, repeat=repeat)
+        r1, t1 = measure(get_token_regions, path, repeat=repeat)
+        if r0 != r1:
+            mismatches.append(path)
+            print(f'! {path}: {len(r0)} != {len(r1)}')
+        d = tbl.setdefault(proj, {'nfiles': 0, 't0': .0, 't1': .0})
+        d['nfiles'] += 1
+        d['t0'] += t0
+        d['t1'] += t1
+
+    nfiles = 0
+    total0 = .0
+    total1 = .0
+    for proj, d in tbl.items():
+        nfiles += d['nfiles']
+        total0 += d['t0']
+        total1 += d['t1']
+        speedup = d['t0'] / d['t1'] if d['t1'] > 0 else float('nan')
+        print(f'{proj}: {d["nfiles"]} files, state machine: {d["t0"]:.2f}s,'
+              f' regex scanner: {d["t1"]:.2f}s (x{speedup:.1f})')
+
+    if nfiles > 0:
+        speedup = total0 / total1 if total1 > 0 else float('nan')
+        print(f'total: {nfiles} files, state machine: {total0:.2f}s,'
+              f' regex scanner: {total1:.2f}s (x{speedup:.1f})')
+        print(f'{len(mismatches)} mismatches')
+
+    return mismatches
+
+
+if __name__ == '__main__':
+    import sys
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='compare token region scanners',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-s', '--samples-dir', dest='samples_dir', metavar='DIR',
+                        default='samples', help='specify samples dir')
+
+    parser.add_argument('--proj', dest='projs', metavar='PROJ', nargs='*',
+                        default=None, help='specify project(s)')
+
+    parser.add_argument('-n', '--repeat', dest='repeat', type=int, default=1,
+                        help='specify number of runs per file')
+
+    args = parser.parse_args()
+
+    mismatches = bench(args.samples_dir, projs=args.projs, repeat=args.repeat)
+
+    if mismatches:
+        sys.exit(1)
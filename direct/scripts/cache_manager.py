@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+# Size accounting, LRU eviction and compaction of the Diff/AST cache
+
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import logging
+
+logger = logging.getLogger()
+
+ACCESS_LOG = 'access.log'
+
+# the cache path template learned by DiffastCacheLocator, relative to the cache dir
+LAYOUT_FILE = 'layout.json'
+
+NAME_FIELD = '{name}'
+
+ENTRY_FILES = ('stat.json', 'map.json.gz', '.complete')
+
+EVICT_INTERVAL = 500
+
+SIZE_PAT = re.compile(r'^(?P<num>[0-9]+(\.[0-9]*)?)\s*(?P<unit>[KMGT]?)i?B?$', flags=re.I)
+
+UNIT_TBL = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(s):
+    m = SIZE_PAT.match(s.strip())
+    if not m:
+        raise ValueError(f'invalid size: {s}')
+    return int(float(m.group('num')) * UNIT_TBL[m.group('unit').upper()])
+
+
+def fmt_size(n):
+    for unit in ('', 'K', 'M', 'G'):
+        if n < 1024:
+            return f'{n:.1f}{unit}B' if unit else f'{n}B'
+        n /= 1024
+    return f'{n:.1f}TB'
+
+
+class Entry(object):
+    def __init__(self, path, key, size, atime):
+        self.path = path
+        self.key = key
+        self.size = size
+        self.atime = atime
+
+    def __repr__(self):
+        return f'Entry({self.key}, {self.size}, {self.atime})'
+
+
+def parse_log_line(line):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 3:
+        return None
+    try:
+        t = float(fields[0])
+    except ValueError:
+        return None
+    return (t, fields[1], fields[2])
+
+
+class CacheManager(object):
+    # Entries are the dirs holding the results of a pair. An entry is keyed by its
+    # path without the local cache name, which is the same for every worker. Where
+    # the local cache name is in the path is taken from the layout learned by the
+    # locator; until it is known, entries are keyed by their whole paths.
+    # The cache is scanned once; afterwards the entries and their total size are
+    # kept up to date from the lines appended to the access log.
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.log_path = os.path.join(cache_dir, ACCESS_LOG)
+        self.layout_path = os.path.join(cache_dir, LAYOUT_FILE)
+        self.total = 0
+        self.name_index = None
+        self._layout = None
+        self._entries = None
+        self._log_pos = 0
+        self.load_layout()
+
+    def _set_layout(self, layout):
+        self._layout = layout
+        comps = layout.split(os.sep) if layout else []
+        self.name_index = comps.index(NAME_FIELD) if NAME_FIELD in comps else None
+        for rel, e in (self._entries or {}).items():
+            e.key = self.get_key(rel)
+
+    def load_layout(self):
+        try:
+            with open(self.layout_path) as f:
+                layout = json.load(f)['template']
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f'failed to load {self.layout_path}: {e}')
+            return
+        if layout != self._layout:
+            self._set_layout(layout)
+
+    def set_layout(self, template):
+        # template: a cache path template with the local cache name as {name}
+        layout = os.path.relpath(template, self.cache_dir)
+        if layout.startswith(os.pardir) or NAME_FIELD not in layout.split(os.sep):
+            return
+        self.load_layout()
+        if layout == self._layout:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'template': layout}, f)
+            os.replace(tmp, self.layout_path)
+        except OSError as e:
+            logger.warning(f'failed to dump {self.layout_path}: {e}')
+        self._set_layout(layout)
+
+    def get_local_name(self, rel):
+        comps = rel.split(os.sep)
+        if self.name_index is None or len(comps) <= self.name_index:
+            return None
+        return comps[self.name_index]
+
+    def get_key(self, rel):
+        comps = rel.split(os.sep)
+        if self.name_index is None or len(comps) <= self.name_index:
+            return rel
+        return os.sep.join(comps[:self.name_index] + comps[self.name_index+1:])
+
+    def record(self, cache_path, hit):
+        rel = os.path.relpath(cache_path, self.cache_dir)
+        if rel.startswith(os.pardir):
+            return
+        line = f'{time.time():.3f}\t{"hit" if hit else "miss"}\t{rel}\n'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f'failed to record access to {cache_path}: {e}')
+
+    def read_log(self, since=None):
+        records = []
+        try:
+            with open(self.log_path, encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    rec = parse_log_line(line)
+                    if rec is not None and (since is None or rec[0] >= since):
+                        records.append(rec)
+        except FileNotFoundError:
+            pass
+        return records
+
+    def scan(self):
+        atime_tbl = {}
+        for t, _, rel in self.read_log():
+            atime_tbl[rel] = max(t, atime_tbl.get(rel, 0))
+
+        entries = []
+        for dpath, dns, fns in os.walk(self.cache_dir):
+            if not any(fn in ENTRY_FILES for fn in fns):
+                continue
+            dns.clear()
+            rel = os.path.relpath(dpath, self.cache_dir)
+            entries.append(self._get_entry(rel, atime_tbl.get(rel, 0)))
+        return entries
+
+    def _get_entry(self, rel, atime=0):
+        dpath = os.path.join(self.cache_dir, rel)
+        size = 0
+        mtime = 0
+        for d, _, fl in os.walk(dpath):
+            for fn in fl:
+                try:
+                    st = os.stat(os.path.join(d, fn))
+                except OSError:
+                    continue
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime)
+        return Entry(dpath, self.get_key(rel), size, max(mtime, atime))
+
+    def _get_log_size(self):
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+
+    def _set_entries(self, entries, log_pos):
+        self._entries = dict([(os.path.relpath(e.path, self.cache_dir), e) for e in entries])
+        self.total = sum(e.size for e in entries)
+        self._log_pos = log_pos
+
+    def load(self):
+        # lines appended during the scan are read again by refresh, which is harmless
+        log_pos = self._get_log_size()
+        self._set_entries(self.scan(), log_pos)
+
+    def refresh(self):
+        if self._entries is None or self._get_log_size() < self._log_pos:  # log compacted
+            self.load()
+            return
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(self._log_pos)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1  # the last line may be being written
+        self._log_pos += end
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            rec = parse_log_line(line)
+            if rec is None:
+                continue
+            t, kind, rel = rec
+            e = self._entries.get(rel, None)
+            if e is not None and kind != 'miss':
+                e.atime = max(e.atime, t)
+                continue
+            if e is not None:
+                self.total -= self._entries.pop(rel).size
+            if os.path.isdir(os.path.join(self.cache_dir, rel)):
+                e = self._get_entry(rel, t)
+                self._entries[rel] = e
+                self.total += e.size
+
+    def entries(self):
+        self.refresh()
+        return list(self._entries.values())
+
+    def remove(self, entry):
+        try:
+            shutil.rmtree(entry.path)
+        except OSError as e:
+            logger.warning(f'failed to remove {entry.path}: {e}')
+            return False
+        self._prune(os.path.dirname(entry.path))
+        if self._entries is not None:
+            e = self._entries.pop(os.path.relpath(entry.path, self.cache_dir), None)
+            if e is not None:
+                self.total -= e.size
+        return True
+
+    def _prune(self, d):
+        top = os.path.abspath(self.cache_dir)
+        d = os.path.abspath(d)
+        while d != top and d.startswith(top):
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+
+    def evict(self, budget, entries=None):
+        if entries is None:
+            entries = self.entries()
+            total = self.total
+        else:
+            total = sum(e.size for e in entries)
+        nremoved = 0
+        freed = 0
+        if total <= budget:
+            return nremoved, freed
+        for e in sorted(entries, key=lambda e: e.atime):
+            if total <= budget:
+                break
+            if self.remove(e):
+                total -= e.size
+                freed += e.size
+                nremoved += 1
+        if nremoved:
+            logger.info(f'evicted {nremoved} entries ({fmt_size(freed)}),'
+                        f' {fmt_size(total)} in use')
+        return nremoved, freed
+
+    def compact(self):
+        self.load_layout()
+        if self.name_index is None:
+            logger.warning(f'layout of {self.cache_dir} unknown, no entries are compacted')
+        entries = self.entries()
+        tbl = {}
+        for e in entries:
+            tbl.setdefault(e.key, []).append(e)
+        kept = []
+        nremoved = 0
+        freed = 0
+        for el in tbl.values():
+            el.sort(key=lambda e: e.atime, reverse=True)
+            kept.append(el[0])
+            for e in el[1:]:
+                if self.remove(e):
+                    nremoved += 1
+                    freed += e.size
+        self._compact_log(kept)
+        self._set_entries(kept, self._get_log_size())
+        if nremoved:
+            logger.info(f'removed {nremoved} duplicate entries ({fmt_size(freed)})')
+        return nremoved, freed
+
+    def _compact_log(self, entries):
+        lines = []
+        for e in sorted(entries, key=lambda e: e.atime):
+            rel = os.path.relpath(e.path, self.cache_dir)
+            lines.append(f'{e.atime:.3f}\taccess\t{rel}\n')
+        tmp = self.log_path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            os.replace(tmp, self.log_path)
+        except OSError as e:
+            logger.warning(f'failed to compact {self.log_path}: {e}')
+
+    def stats(self, since=None):
+        nhits = 0
+        nmisses = 0
+        for _, kind, _ in self.read_log(since=since):
+            if kind == 'hit':
+                nhits += 1
+            elif kind == 'miss':
+                nmisses += 1
+        return nhits, nmisses
+
+    def report(self, since=None):
+        self.load_layout()
+        entries = self.entries()
+        usage_tbl = {}
+        for e in entries:
+            name = self.get_local_name(os.path.relpath(e.path, self.cache_dir)) or '-'
+            n, sz = usage_tbl.get(name, (0, 0))
+            usage_tbl[name] = (n + 1, sz + e.size)
+        total = sum(e.size for e in entries)
+        nkeys = len(set(e.key for e in entries))
+        lines = [f'{self.cache_dir}: {len(entries)} entries ({nkeys} distinct),'
+                 f' {fmt_size(total)}']
+        for name, (n, sz) in sorted(usage_tbl.items()):
+            lines.append(f'  {name}: {n} entries, {fmt_size(sz)}')
+        nhits, nmisses = self.stats(since=since)
+        n = nhits + nmisses
+        if n:
+            lines.append(f'hits={nhits} misses={nmisses} ({nhits*100/n:.1f}% hit)')
+        return '\n'.join(lines)
+
+
+_MANAGER_TBL = {}
+
+
+def get_cache_manager(cache_dir):
+    try:
+        m = _MANAGER_TBL[cache_dir]
+    except KeyError:
+        m = _MANAGER_TBL[cache_dir] = CacheManager(cache_dir)
+    return m
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='manage Diff/AST cache',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('command', choices=['report', 'evict', 'compact'],
+                        help='report usage and hit ratio, evict down to budget,'
+                        ' or remove entries duplicated across local caches')
+
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', metavar='DIR',
+                        default='CACHE', help='specify diffast cache dir')
+
+    parser.add_argument('-b', '--budget', dest='budget', metavar='SIZE', type=parse_size,
+                        default=None, help='specify cache size budget (e.g. 20G)')
+
+    parser.add_argument('--since', dest='since', metavar='SECS', type=float, default=None,
+                        help='count hits/misses of the last SECS seconds only')
+
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
+                        help='enable verbose printing')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    m = CacheManager(args.cache_dir)
+
+    if args.command == 'evict':
+        if args.budget is None:
+            parser.error('evict requires --budget')
+        n, sz = m.evict(args.budget)
+        print(f'evicted {n} entries ({fmt_size(sz)})')
+
+    elif args.command == 'compact':
+        n, sz = m.compact()
+        print(f'removed {n} duplicate entries ({fmt_size(sz)})')
+        if args.budget is not None:
+            n, sz = m.evict(args.budget)
+            print(f'evicted {n} entries ({fmt_size(sz)})')
+
+    since = None
+    if args.since is not None:
+        since = time.time() - args.since
+    print(m.report(since=since))
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# Measures the fixed per-pair overhead of the differencing tools so that the
+# timing figures can be corrected for JVM/process startup
+
+import os
+import json
+import math
+import time
+import shutil
+import tempfile
+import logging
+
+import common
+from common import get_time, run_cmd
+
+logger = logging.getLogger()
+
+CALIBRATION_FILE = 'calibration.json'
+
+CONFIDENCE = 0.95
+
+# two-sided 95% quantiles of Student's t distribution by degrees of freedom
+T_TBL = [(1, 12.706), (2, 4.303), (3, 3.182), (4, 2.776), (5, 2.571), (6, 2.447),
+         (7, 2.365), (8, 2.306), (9, 2.262), (10, 2.228), (12, 2.179), (15, 2.131),
+         (20, 2.086), (25, 2.060), (30, 2.042), (40, 2.021), (60, 2.000), (120, 1.980)]
+
+SRC0 = 'class A {\n  int x;\n}\n'
+SRC1 = 'class A {\n  int y;\n  void m() {}\n}\n'
+
+NRUNS = 10
+NWARMUPS = 2
+NSTEADY_RUNS = 50
+NSTEADY_WARMUPS = 20
+
+
+def get_t(df):
+    # the nearest tabulated df below keeps the interval conservative
+    t = T_TBL[0][1]
+    for d, v in T_TBL:
+        if d > df:
+            break
+        t = v
+    return t
+
+
+def summarize(samples):
+    n = len(samples)
+    mean = sum(samples) / n
+    sd = .0
+    half = .0
+    if n > 1:
+        sd = math.sqrt(sum((x - mean) ** 2 for x in samples) / (n - 1))
+        half = get_t(n - 1) * sd / math.sqrt(n)
+    ss = sorted(samples)
+    median = ss[n // 2] if n % 2 else (ss[n // 2 - 1] + ss[n // 2]) / 2
+    return {'n': n, 'mean': mean, 'sd': sd, 'ci': [mean - half, mean + half],
+            'median': median, 'min': ss[0], 'max': ss[-1]}
+
+
+def measure(f, nruns, nwarmups):
+    for _ in range(nwarmups):
+        f()
+    samples = []
+    for _ in range(nruns):
+        st = get_time()
+        f()
+        samples.append(get_time() - st)
+    return summarize(samples)
+
+
+def check(p, cmd):
+    if p.returncode != 0:
+        raise RuntimeError(f'failed to run {" ".join(cmd)}: {p.stderr}')
+
+
+def calibrate_gumtree(path0, path1, nruns=NRUNS, nwarmups=NWARMUPS,
+                      nsteady_runs=NSTEADY_RUNS, nsteady_warmups=NSTEADY_WARMUPS,
+                      use_session=True):
+    cmd = common.gumtree_parse_cmd(path0)
+
+    def launch():
+        check(run_cmd(cmd), cmd)
+
+    print('measuring gumtree startup...')
+    startup = measure(launch, nruns, nwarmups)
+
+    print('measuring gumtree steady state...')
+    with common.GumtreeSession() as session:
+        def request():
+            session.parse(path0)
+            session.parse(path1)
+            session.diff(path0, path1)
+        steady = measure(request, nsteady_runs, nsteady_warmups)
+
+    # a pair costs two parses and a diff, i.e. three launches without a server
+    if use_session:
+        overhead = steady['mean']
+    else:
+        overhead = 3 * startup['mean']
+
+    return {'startup': startup, 'steady': steady, 'pair_overhead': overhead}
+
+
+def calibrate_diffast(path0, path1, nruns=NRUNS, nwarmups=NWARMUPS):
+    cache_dir = tempfile.mkdtemp(prefix='calibrate-')
+    cmd = common.diffast_cmd(path0, path1, keep_going=True, weak=True, use_cache=False,
+                             cache_dir=cache_dir)
+
+    def launch():
+        check(run_cmd(cmd), cmd)
+
+    try:
+        print('measuring diffast startup...')
+        startup = measure(launch, nruns, nwarmups)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    # simast_.exe has no resident mode: every pair pays for exactly one launch
+    return {'startup': startup, 'steady': startup, 'pair_overhead': startup['mean']}
+
+
+def calibrate(tools=('gumtree', 'diffast'), nruns=NRUNS, nwarmups=NWARMUPS,
+              nsteady_runs=NSTEADY_RUNS, nsteady_warmups=NSTEADY_WARMUPS,
+              use_gumtree_session=True):
+    d = tempfile.mkdtemp(prefix='calibrate-')
+    try:
+        path0 = os.path.join(d, 'A0.java')
+        path1 = os.path.join(d, 'A1.java')
+        with open(path0, 'w') as f:
+            f.write(SRC0)
+        with open(path1, 'w') as f:
+            f.write(SRC1)
+
+        cal = {'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'confidence': CONFIDENCE,
+               'gumtree_session': use_gumtree_session}
+
+        if 'gumtree' in tools:
+            cal['gumtree'] = calibrate_gumtree(path0, path1, nruns=nruns, nwarmups=nwarmups,
+                                               nsteady_runs=nsteady_runs,
+                                               nsteady_warmups=nsteady_warmups,
+                                               use_session=use_gumtree_session)
+        if 'diffast' in tools:
+            cal['diffast'] = calibrate_diffast(path0, path1, nruns=nruns, nwarmups=nwarmups)
+    finally:
+        shutil.rmtree(d, ignore_errors=True)
+
+    return cal
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def get_pair_overhead(cal, tool):
+    if cal is None or tool not in cal:
+        return .0
+    return cal[tool]['pair_overhead']
+
+
+def correct_time(cal, tool, t):
+    return max(t - get_pair_overhead(cal, tool), .0)
+
+
+def fmt_stats(s):
+    lo, hi = s['ci']
+    return (f'{s["mean"]*1000:.1f}ms [{lo*1000:.1f}, {hi*1000:.1f}]'
+            f' (median={s["median"]*1000:.1f}ms, n={s["n"]})')
+
+
+def report(cal):
+    lines = []
+    for tool in ('gumtree', 'diffast'):
+        if tool not in cal:
+            continue
+        c = cal[tool]
+        lines.append(f'{tool}:')
+        lines.append(f'  startup:       {fmt_stats(c["startup"])}')
+        lines.append(f'  steady (pair): {fmt_stats(c["steady"])}')
+        lines.append(f'  pair overhead: {c["pair_overhead"]*1000:.1f}ms')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='measure startup and per-invocation overhead of the'
+                            ' differencing tools',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-o', '--output', dest='out_file', default=CALIBRATION_FILE,
+                        help='specify output file')
+
+    parser.add_argument('-n', '--nruns', dest='nruns', metavar='N', type=int, default=NRUNS,
+                        help='specify number of measured launches')
+
+    parser.add_argument('-w', '--nwarmups', dest='nwarmups', metavar='N', type=int,
+                        default=NWARMUPS, help='specify number of launches discarded first')
+
+    parser.add_argument('--steady-runs', dest='nsteady_runs', metavar='N', type=int,
+                        default=NSTEADY_RUNS,
+                        help='specify number of pairs measured on a warm gumtree server')
+
+    parser.add_argument('--steady-warmups', dest='nsteady_warmups', metavar='N', type=int,
+                        default=NSTEADY_WARMUPS,
+                        help='specify number of pairs discarded to warm up the JVM')
+
+    parser.add_argument('--no-gumtree-session', dest='use_gumtree_session',
+                        action='store_false',
+                        help='calibrate for shootout.py --no-gumtree-session')
+
+    parser.add_argument('--gumtree', action='store_true', help='calibrate gumtree only')
+
+    parser.add_argument('--diffast', action='store_true', help='calibrate diffast only')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    tools = []
+    if args.gumtree or not args.diffast:
+        tools.append('gumtree')
+    if args.diffast or not args.gumtree:
+        tools.append('diffast')
+
+    cal = calibrate(tools, nruns=args.nruns, nwarmups=args.nwarmups,
+                    nsteady_runs=args.nsteady_runs, nsteady_warmups=args.nsteady_warmups,
+                    use_gumtree_session=args.use_gumtree_session)
+
+    print(report(cal))
+
+    with open(args.out_file, 'w') as f:
+        json.dump(cal, f, indent=2)
+
+    print(f'calibration dumped into {args.out_file}')
@@ -3,37 +3,66 @@
 import sys
 import os
 import re
+import select
+import hashlib
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
 # import json
 import simplejson as json
-from subprocess import run
+from subprocess import Popen, PIPE, DEVNULL, CompletedProcess
 
 import time
 import multiprocessing as mp
 import math
 import psutil
 
+import sloccount
 from sloccount import escape
+from region import Region
+from memo import MemoCache, MEMO_CACHE_SIZE, MEMO_CACHE_BYTES, file_digest
+from gt_cache import GumtreeCache, GUMTREE_CACHE_NAME, get_gumtree_version
+from tool_archive import ToolArchive
+from cache_manager import get_cache_manager
 
 logger = mp.get_logger()
 
 GUMTREE_DIR = '/root/direct/GumTreeDiff'
 GUMTREE_CMD = os.path.join(GUMTREE_DIR, 'run.sh')
+GUMTREE_SERVER_CMD = os.path.join(GUMTREE_DIR, 'server.sh')
+
+GUMTREE_MATCHER = 'gumtree-simple'
+
+# seconds to wait for the reply of the gumtree server to a request, after which
+# the server is killed and restarted for the next request
+GUMTREE_SERVER_TIMEOUT = 600
 
 SIMAST_CMD = '/opt/cca/bin/simast_.exe'
 
 SLOCCOUNT_CACHE_NAME = 'CACHE-sloccount'
 
+MEMO_CACHE_NAME = 'CACHE-memo'
+
 EXCLUDED_TYPES_TBL = {
     'java': ['Javadoc', 'TagElement', 'TextElement'],
     'python': [],  # ['comment']
 }
 
-MAX_NRETRIES = 3
+COMPLETE_MARKER = '.complete'
+
+POLL_INTERVAL = 0.01
+POLL_MAX_INTERVAL = 0.5
+POLL_TIMEOUT = 15.0
 
 MAX_CPU_COUNT = 128
 
 IGNORE_MOVE = True
 
+USAGE_KEYS = ('utime', 'stime', 'maxrss')
+
+TRACING = False
+
 
 try:
     NPROCS = min(psutil.cpu_count(logical=False), MAX_CPU_COUNT)
@@ -41,6 +70,82 @@ except Exception:
     NPROCS = os.cpu_count()
 
 
+MEMO = None
+
+
+def get_memo_versions():
+    # the results persisted are computed here (token regions, normalized digests,
+    # node counts from GumTree outputs) or by sloccount.py
+    version = file_digest(__file__)[:12]
+    return {'token_regions': version,
+            'norm_digest': version,
+            'nnodes': version + '-' + get_gumtree_version(GUMTREE_DIR),
+            'sloc': file_digest(sloccount.__file__)[:12]}
+
+
+def set_memo_cache(maxsize=MEMO_CACHE_SIZE, cache_dir=None, maxbytes=MEMO_CACHE_BYTES):
+    global MEMO
+    MEMO = None
+    if maxsize > 0:
+        versions = get_memo_versions() if cache_dir is not None else None
+        MEMO = MemoCache(maxsize=maxsize, cache_dir=cache_dir, maxbytes=maxbytes,
+                         versions=versions)
+    return MEMO
+
+
+def file_digest_memo(path):
+    if MEMO is not None:
+        return MEMO.digest(path)
+    return file_digest(path)
+
+
+GUMTREE_CACHE = None
+
+
+def set_gumtree_cache(cache_dir=GUMTREE_CACHE_NAME):
+    global GUMTREE_CACHE
+    GUMTREE_CACHE = None
+    if cache_dir is not None:
+        version = get_gumtree_version(GUMTREE_DIR)
+        GUMTREE_CACHE = GumtreeCache(cache_dir, version, digest=file_digest_memo)
+    return GUMTREE_CACHE
+
+
+TOOL_ARCHIVE = None
+
+
+def set_tool_archive(root=None, replay=False):
+    global TOOL_ARCHIVE
+    TOOL_ARCHIVE = None
+    if root is not None:
+        TOOL_ARCHIVE = ToolArchive(root, replay=replay, digest=file_digest_memo)
+    return TOOL_ARCHIVE
+
+
+def replaying():
+    return TOOL_ARCHIVE is not None and TOOL_ARCHIVE.replay
+
+
+def recording():
+    return TOOL_ARCHIVE is not None and not TOOL_ARCHIVE.replay
+
+
+def archive_run(kind, paths, opts, cmd, stdout, returncode=0, files_dir=None, files=()):
+    if recording():
+        TOOL_ARCHIVE.put(kind, paths, opts, cmd, stdout, returncode=returncode,
+                         files_dir=files_dir, files=files)
+
+
+def get_archived_run(kind, paths, opts):
+    return TOOL_ARCHIVE.get(kind, paths, opts)
+
+
+def memoize(kind, path, f, *args):
+    if MEMO is None:
+        return f(path)
+    return MEMO.memoize(kind, path, f, *args)
+
+
 def get_lang(fn):
     lang = '?'
     if fn.endswith('.py'):
@@ -58,6 +163,179 @@ def get_time():
     return time.monotonic()
 
 
+_SPANS = None
+
+
+def set_tracing(enabled=True):
+    global TRACING
+    TRACING = enabled
+
+
+def add_span(phase, t, spans=None):
+    if spans is None:
+        spans = _SPANS
+    if spans is not None:
+        spans[phase] = spans.get(phase, .0) + t
+
+
+@contextmanager
+def span(phase):
+    if _SPANS is None:
+        yield
+        return
+    st = get_time()
+    try:
+        yield
+    finally:
+        add_span(phase, get_time() - st)
+
+
+def traced(f, *args, **kwargs):
+    # the phases f goes through are timed and their durations are added to its
+    # result as 'spans', along with the peak of Python allocations made on top of
+    # what was already allocated as 'py_peak' while tracemalloc is tracing
+    global _SPANS
+    if not TRACING:
+        return f(*args, **kwargs)
+    outer = _SPANS
+    _SPANS = spans = {}
+    base = 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    try:
+        r = f(*args, **kwargs)
+    finally:
+        _SPANS = outer
+    if isinstance(r, dict):
+        for phase, t in r.get('spans', {}).items():
+            add_span(phase, t, spans)
+        r['spans'] = spans
+        if tracemalloc.is_tracing():
+            r['py_peak'] = max(r.get('py_peak', 0), tracemalloc.get_traced_memory()[1] - base)
+    return r
+
+
+def merge_spans(r, spans):
+    if TRACING and isinstance(r, dict):
+        for phase, t in spans.items():
+            add_span(phase, t, r.setdefault('spans', {}))
+    return r
+
+
+def new_usage():
+    return {'utime': .0, 'stime': .0, 'maxrss': 0}
+
+
+def add_usage(usage, utime, stime, maxrss):
+    if usage is not None:
+        usage['utime'] += utime
+        usage['stime'] += stime
+        usage['maxrss'] = max(usage['maxrss'], maxrss)
+
+
+def add_rusage(usage, ru):
+    add_usage(usage, ru.ru_utime, ru.ru_stime, ru.ru_maxrss)
+
+
+def get_peak_rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return psutil.Process(pid).memory_info().rss // 1024
+
+
+def get_proc_usage(pid):
+    # CPU times and peak RSS (KiB) so far of a live process such as a tool server
+    try:
+        t = psutil.Process(pid).cpu_times()
+        return (t.user + t.children_user, t.system + t.children_system, get_peak_rss(pid))
+    except Exception as e:
+        logger.debug(f'failed to get usage of {pid}: {e}')
+        return None
+
+
+def add_proc_usage(usage, pid, before):
+    if usage is None or before is None:
+        return
+    after = get_proc_usage(pid)
+    if after is not None:
+        add_usage(usage, after[0] - before[0], after[1] - before[1], after[2])
+
+
+def run_cmd(cmd, usage=None, shell=False, text=False):
+    # run(cmd, capture_output=True) that reaps the child with wait4 so that its CPU
+    # times and peak RSS, including those of the descendants it waited for, can be
+    # charged to usage
+    with Popen(cmd, shell=shell, stdout=PIPE, stderr=PIPE, text=text) as p:
+        err = []
+        th = threading.Thread(target=lambda: err.append(p.stderr.read()))
+        th.start()
+        out = p.stdout.read()
+        th.join()
+        _, status, ru = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    add_rusage(usage, ru)
+    return CompletedProcess(cmd, p.returncode, out, err[0] if err else None)
+
+
+def poll(timeout=POLL_TIMEOUT):
+    deadline = get_time() + timeout
+    interval = POLL_INTERVAL
+    yield 0
+    count = 1
+    while get_time() < deadline:
+        time.sleep(min(interval, max(deadline - get_time(), 0)))
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
+        yield count
+        count += 1
+
+
+def atomic_write(path, data):
+    d = os.path.dirname(path) or '.'
+    (fd, tmp) = tempfile.mkstemp(dir=d)
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def mark_complete(dpath):
+    try:
+        atomic_write(os.path.join(dpath, COMPLETE_MARKER), '')
+    except Exception as e:
+        logger.warning(f'failed to mark {dpath} complete: {e}')
+
+
+def wait_complete(dpath, names, timeout=POLL_TIMEOUT):
+    # the marker is written by the driver that ran the tool to produce the entry,
+    # once the tool exited successfully; without it (e.g. results cached by an
+    # older run) outputs are waited for until their sizes stop changing between
+    # two polls
+    marker = os.path.join(dpath, COMPLETE_MARKER)
+    paths = [os.path.join(dpath, n) for n in names]
+    last = None
+    for _ in poll(timeout):
+        if os.path.exists(marker):
+            return True
+        try:
+            sizes = [os.path.getsize(p) for p in paths]
+        except OSError:
+            sizes = None
+        if sizes is not None and sizes == last:
+            return True
+        last = sizes
+    logger.warning(f'timed out waiting for {dpath}')
+    return False
+
+
 def load_json(path):
     d = None
     with open(path) as f:
@@ -68,10 +346,94 @@ def load_json(path):
 PAT = re.compile(r'^(?P<type>.*)\[(?P<start>[0-9]+),(?P<end>[0-9]+)\]$', flags=re.DOTALL)
 
 
+def get_node_key(nd):
+    x = nd['type']
+    lab = nd.get('label', None)
+    if lab is not None:
+        x += ': '+lab
+    return x
+
+
+class TreeIndex(object):
+    def __init__(self, tree, excluded_types):
+        self.excluded_types = excluded_types
+        self.tbl = {}
+        self.count_tbl = {}
+        self.start_tbl = {}
+        self.infos = []  # preorder, excluded subtrees skipped
+
+        root = tree['root']
+
+        postorder = []
+        stack = [(root, False)]
+        while stack:
+            nd, excluded = stack.pop()
+            key = (get_node_key(nd), int(nd['pos']))
+            try:
+                self.tbl[key].append(nd)
+            except KeyError:
+                self.tbl[key] = [nd]
+            excluded = excluded or nd['type'] in self.excluded_types
+            if not excluded:
+                self.start_tbl[id(nd)] = len(self.infos)
+                self.infos.append((key[0], key[1], key[1] + int(nd['length'])))
+            postorder.append(nd)
+            stack.extend([(c, excluded) for c in reversed(nd['children'])])
+
+        postorder.reverse()
+        for nd in postorder:
+            count = 0
+            if nd['type'] not in self.excluded_types:
+                count = 1
+                for c in nd['children']:
+                    count += self.count_tbl[id(c)]
+            self.count_tbl[id(nd)] = count
+
+        self.root = root
+        self.size = self.count_tbl[id(root)]
+
+    def find(self, ty_st_ed):
+        ty, st, ed = ty_st_ed
+        for nd in self.tbl.get((ty, st), []):
+            if ed <= st + int(nd['length']):
+                return nd
+        return None
+
+    def count_nodes(self, nd):
+        return self.count_tbl[id(nd)]
+
+    def get_nodes(self, nd):
+        # the nodes of a subtree occupy a contiguous range of the preorder
+        try:
+            st = self.start_tbl[id(nd)]
+            return set(self.infos[st:st + self.count_tbl[id(nd)]])
+        except KeyError:  # excluded or below an excluded node
+            pass
+
+        infos = set()
+        stack = [nd]
+        while stack:
+            x = stack.pop()
+            if x['type'] not in self.excluded_types:
+                st = int(x['pos'])
+                infos.add((get_node_key(x), st, st + int(x['length'])))
+                stack.extend(x['children'])
+        return infos
+
+
 class GtHandler(object):
     def __init__(self, path):
         self.lang = get_lang(path)
         self.excluded_types = get_excluded_types(self.lang)
+        self._index_tbl = {}
+
+    def get_index(self, tree):
+        try:
+            return self._index_tbl[id(tree)][1]
+        except KeyError:
+            idx = TreeIndex(tree, self.excluded_types)
+            self._index_tbl[id(tree)] = (tree, idx)
+            return idx
 
     def check_tree(self, tree, ty_st_ed):
         ty, st, ed = ty_st_ed
@@ -111,9 +473,7 @@ class GtHandler(object):
         return count
 
     def count_tree_nodes(self, tree):
-        root = tree['root']
-        c = self.count_nodes(root)
-        return c
+        return self.get_index(tree).size
 
     def get_info(self, lab):
         res = None
@@ -130,12 +490,13 @@ class GtHandler(object):
         return res
 
     def get_node_region(self, nd):
-        r = set()
-        st = int(nd['pos'])
-        ed = st + int(nd['length'])
-        r = set(range(st, ed))
-        for c in nd['children']:
-            r.update(self.get_node_region(c))
+        r = Region()
+        stack = [nd]
+        while stack:
+            x = stack.pop()
+            st = int(x['pos'])
+            r.add(st, st + int(x['length']))
+            stack.extend(x['children'])
         return r
 
     def get_tree_region(self, tree):
@@ -151,7 +512,7 @@ class GtHandler(object):
         if m:
             st = int(m.group('start'))
             ed = int(m.group('end'))
-            r = set(range(st, ed))
+            r = Region([(st, ed)])
         return r
 
     def get_matches(self, diff):
@@ -186,8 +547,10 @@ class GtHandler(object):
         return infos
 
     def similarity(self, src_tree, dst_tree, diff):
-        src_sz = self.count_tree_nodes(src_tree)
-        dst_sz = self.count_tree_nodes(dst_tree)
+        src_idx = self.get_index(src_tree)
+        dst_idx = self.get_index(dst_tree)
+        src_sz = src_idx.size
+        dst_sz = dst_idx.size
 
         matches = self.get_matches(diff)
 
@@ -212,18 +575,18 @@ class GtHandler(object):
             elif act == 'delete-tree':
                 info = self.get_info(a['tree'])
                 if info is not None:
-                    subtree = self.find_subtree(src_tree['root'], info)
+                    subtree = src_idx.find(info)
                     if subtree is not None:
-                        deleted_nodes.update(self.get_nodes(subtree))
+                        deleted_nodes.update(src_idx.get_nodes(subtree))
                     else:
                         logger.debug('not found: {} {} {}'.format(*info))
 
             elif act == 'move-tree':
                 info = self.get_info(a['tree'])
                 if info is not None:
-                    subtree = self.find_subtree(src_tree['root'], info)
+                    subtree = src_idx.find(info)
                     if subtree is not None:
-                        moved_nodes.update(self.get_nodes(subtree))
+                        moved_nodes.update(src_idx.get_nodes(subtree))
                     else:
                         logger.debug('not found: {} {} {}'.format(*info))
 
@@ -235,6 +598,8 @@ class GtHandler(object):
         return sim
 
     def delta(self, src_tree, dst_tree, diff):
+        src_idx = self.get_index(src_tree)
+        dst_idx = self.get_index(dst_tree)
         matches = self.get_matches(diff)
         cost = 0
         nrelabels = 0
@@ -254,9 +619,9 @@ class GtHandler(object):
             elif act == 'delete-tree':
                 info = self.get_info(a['tree'])
                 if info is not None:
-                    subtree = self.find_subtree(src_tree['root'], info)
+                    subtree = src_idx.find(info)
                     if subtree is not None:
-                        cost += len(self.get_nodes(subtree))
+                        cost += len(src_idx.get_nodes(subtree))
                     else:
                         logger.debug('not found: {} {} {}'.format(*info))
 
@@ -268,9 +633,9 @@ class GtHandler(object):
             elif act == 'insert-tree':
                 info = self.get_info(a['tree'])
                 if info is not None:
-                    subtree = self.find_subtree(dst_tree['root'], info)
+                    subtree = dst_idx.find(info)
                     if subtree is not None:
-                        nnl = len(self.get_nodes(subtree))
+                        nnl = len(dst_idx.get_nodes(subtree))
                         logger.debug(f'intert-tree: nnl={nnl}')
                         cost += nnl
                     else:
@@ -316,7 +681,7 @@ class GtHandler(object):
         src_reg = self.get_reg(lab)
         dst_reg = mapping[src_reg]
         # logger.debug(f'{src_reg} --> {dst_reg}')
-        r = set(range(*dst_reg))
+        r = Region([dst_reg])
         return r
 
     def text_similarity(self,
@@ -335,8 +700,8 @@ class GtHandler(object):
             # dst_region_sz = len(dst_region)
             dst_region_sz = len(align1)
 
-        src_colored_region = set()
-        dst_colored_region = set()
+        src_colored_region = Region()
+        dst_colored_region = Region()
 
         mapping = self.get_region_mapping(diff)
 
@@ -397,41 +762,436 @@ class GtHandler(object):
 
         return d
 
+    def is_excluded(self, lab):
+        return any([lab.startswith(t) for t in self.excluded_types])
 
-def gumtree_diff(path0, path1, matcher='gumtree-simple'):
-    opts = f' -m {matcher}'
-    if path0.endswith('.py'):
-        opts += ' -g python-treesitter-ng'
-    cmd = f'{GUMTREE_CMD} textdiff{opts} -f json {escape(path0)} {escape(path1)}'
-    logger.debug(f'cmd={cmd}')
+    def parse_label(self, lab):
+        m = PAT.match(lab)
+        if m:
+            return (m.group('type').rstrip(), int(m.group('start')), int(m.group('end')))
+        return None
+
+    def analyze(self,
+                src_tree, dst_tree, diff,
+                align0, align1,
+                src_region_sz=None, dst_region_sz=None,
+                ignore_move=IGNORE_MOVE, node_sim=False):
+
+        st_time = get_time()
+
+        src_idx = self.get_index(src_tree)
+        dst_idx = self.get_index(dst_tree)
+
+        if src_region_sz is None:
+            src_region_sz = len(align0)
+
+        if dst_region_sz is None:
+            dst_region_sz = len(align1)
+
+        matches = set()
+        mapping = {}
+
+        for x in diff['matches']:
+            src_lab = x['src']
+            dst_lab = x['dest']
+            if self.is_excluded(src_lab) or self.is_excluded(dst_lab):
+                logger.debug(f'excluded: {x}')
+                continue
+            src = self.parse_label(src_lab)
+            dst = self.parse_label(dst_lab)
+            matches.add(src)
+            if src is None or dst is None:
+                logger.warning(f'failed to get region: {x}')
+            else:
+                mapping[src[1:]] = dst[1:]
+
+        src_colored_region = Region()
+        dst_colored_region = Region()
+
+        moved_nodes = set()
+        updated_nodes = set()
+        deleted_nodes = set()
+
+        cost = 0
+        nrelabels = 0
+
+        for a in diff['actions']:
+            lab = a['tree']
+            if self.is_excluded(lab):
+                continue
+            info = self.parse_label(lab)
+            if info is None:
+                continue
+
+            act = a['action']
+            ty, st, ed = info
+
+            if act == 'update-node':
+                cost += 1
+                nrelabels += 1
+                src_colored_region.add(st, ed)
+                dst_colored_region.add(*mapping[(st, ed)])
+                if node_sim:
+                    updated_nodes.add(info)
+
+            elif act == 'delete-node':
+                cost += 1
+                src_colored_region.add(st, ed)
+                if node_sim:
+                    deleted_nodes.add(info)
+
+            elif act == 'delete-tree':
+                src_colored_region.add(st, ed)
+                subtree = src_idx.find(info)
+                if subtree is not None:
+                    nodes = src_idx.get_nodes(subtree)
+                    cost += len(nodes)
+                    if node_sim:
+                        deleted_nodes.update(nodes)
+                else:
+                    logger.debug('not found: {} {} {}'.format(*info))
+
+            elif act == 'insert-node':
+                cost += 1
+                dst_colored_region.add(st, ed)
+
+            elif act == 'insert-tree':
+                dst_colored_region.add(st, ed)
+                subtree = dst_idx.find(info)
+                if subtree is not None:
+                    cost += len(dst_idx.get_nodes(subtree))
+                else:
+                    logger.debug('not found: {} {} {}'.format(*info))
+
+            elif act == 'move-tree':
+                cost += 1
+                if not ignore_move:
+                    src_colored_region.add(st, ed)
+                    dst_colored_region.add(*mapping[(st, ed)])
+                if node_sim:
+                    subtree = src_idx.find(info)
+                    if subtree is not None:
+                        moved_nodes.update(src_idx.get_nodes(subtree))
+                    else:
+                        logger.debug('not found: {} {} {}'.format(*info))
+
+        nmatches = len(matches)
+
+        add_span('analysis', get_time() - st_time)
+
+        with span('intersect'):
+            src_colored_region &= align0
+            dst_colored_region &= align1
+
+            src_colored_region_sz = len(src_colored_region)
+            dst_colored_region_sz = len(dst_colored_region)
+
+        colored = src_colored_region_sz + dst_colored_region_sz
+        region_sz = src_region_sz + dst_region_sz
+
+        sim = (region_sz - colored) / region_sz
+
+        logger.debug(f'file:{src_region_sz}->{dst_region_sz}'
+                     f', colored:{src_colored_region_sz}->{dst_colored_region_sz}'
+                     f', sim={sim} cost={cost} nmatches={nmatches}')
+
+        d = {'similarity': sim, 'colored': colored,
+             'src_colored_region': src_colored_region,
+             'dst_colored_region': dst_colored_region,
+             'cost': cost, 'nmappings': nmatches, 'nrelabels': nrelabels}
+
+        if node_sim:
+            matches.difference_update(moved_nodes | updated_nodes | deleted_nodes)
+            d['node_similarity'] = 2.0 * len(matches) / (src_idx.size + dst_idx.size)
+
+        return d
+
+
+def get_gumtree_generator(path):
+    gen = None
+    if path.endswith('.py'):
+        gen = 'python-treesitter-ng'
+    return gen
+
+
+def gumtree_session_safe(*paths):
+    # requests to the server are lines of tab separated fields
+    return not any([c in p for p in paths for c in '\t\n\r'])
+
+
+class GumtreeSession(object):
+    def __init__(self, cmd=GUMTREE_SERVER_CMD, timeout=GUMTREE_SERVER_TIMEOUT):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._proc = None
+        self._buf = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        logger.debug(f'starting {self.cmd}')
+        self._proc = Popen([self.cmd], stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        self._buf.clear()
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=10)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+
+    def kill(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+    def alive(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def recv(self, deadline, n=None):
+        # a line (n is None) or n bytes of the reply, read from the pipe directly
+        # so that waiting for them can time out
+        fd = self._proc.stdout.fileno()
+        while True:
+            if n is None:
+                i = self._buf.find(b'\n')
+                if i >= 0:
+                    data = bytes(self._buf[:i+1])
+                    del self._buf[:i+1]
+                    return data
+            elif len(self._buf) >= n:
+                data = bytes(self._buf[:n])
+                del self._buf[:n]
+                return data
+            timeout = deadline - get_time()
+            if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                raise TimeoutError(f'no reply within {self.timeout}s')
+            b = os.read(fd, 1 << 16)
+            if not b:
+                raise EOFError('server exited')
+            self._buf.extend(b)
+
+    def request(self, *fields, usage=None):
+        if not gumtree_session_safe(*fields):
+            raise ValueError(f'tab or newline in request: {fields}')
+        if not self.alive():
+            self.start()
+        pid = self._proc.pid
+        before = get_proc_usage(pid) if usage is not None else None
+        line = '\t'.join(fields) + '\n'
+        try:
+            self._proc.stdin.write(line.encode('utf-8'))
+            self._proc.stdin.flush()
+            deadline = get_time() + self.timeout
+            status, n = self.recv(deadline).split()
+            data = self.recv(deadline, int(n))
+        except Exception as e:
+            self.kill()
+            raise RuntimeError(f'gumtree server failed: {e}')
+        add_proc_usage(usage, pid, before)
+        if status != b'OK':
+            raise RuntimeError(data.decode('utf-8', errors='replace'))
+        return data
+
+    def parse(self, path, usage=None):
+        gen = get_gumtree_generator(path) or '-'
+        return self.request('parse', gen, path, usage=usage)
+
+    def diff(self, path0, path1, matcher=GUMTREE_MATCHER, usage=None):
+        gen = get_gumtree_generator(path0) or '-'
+        return self.request('textdiff', matcher, gen, path0, path1, usage=usage)
+
+
+_GUMTREE_SESSION = None
+
+
+def get_gumtree_session():
+    global _GUMTREE_SESSION
+    if _GUMTREE_SESSION is None or _GUMTREE_SESSION.pid != os.getpid():
+        _GUMTREE_SESSION = GumtreeSession()
+    return _GUMTREE_SESSION
+
+
+def close_gumtree_session():
+    global _GUMTREE_SESSION
+    if _GUMTREE_SESSION is not None and _GUMTREE_SESSION.pid == os.getpid():
+        _GUMTREE_SESSION.close()
+    _GUMTREE_SESSION = None
+
+
+def gumtree_diff_cmd(path0, path1, matcher=GUMTREE_MATCHER):
+    cmd = [GUMTREE_CMD, 'textdiff', '-m', matcher]
+    gen = get_gumtree_generator(path0)
+    if gen is not None:
+        cmd.extend(['-g', gen])
+    cmd.extend(['-f', 'json', path0, path1])
+    return cmd
+
+
+def gumtree_parse_cmd(path):
+    cmd = [GUMTREE_CMD, 'parse']
+    gen = get_gumtree_generator(path)
+    if gen is not None:
+        cmd.extend(['-g', gen])
+    cmd.extend(['-f', 'json', path])
+    return cmd
+
+
+# while replaying, the archive stands in for the cache and gumtree is never run;
+# while recording, outputs are archived whether gumtree ran or they were cached
+
+def gumtree_cached_parse(path):
+    opts = [get_gumtree_generator(path)]
+    if replaying():
+        return TOOL_ARCHIVE.get_stdout('parse', [path], opts)
+    if GUMTREE_CACHE is None:
+        return None
+    data = GUMTREE_CACHE.get('parse', [path], opts)
+    if data is not None:
+        archive_run('parse', [path], opts, gumtree_parse_cmd(path), data)
+    return data
+
+
+def gumtree_store_parse(path, data):
+    opts = [get_gumtree_generator(path)]
+    if data:
+        archive_run('parse', [path], opts, gumtree_parse_cmd(path), data)
+    if GUMTREE_CACHE is not None and data:
+        GUMTREE_CACHE.put('parse', [path], opts, data)
+
+
+def gumtree_cached_diff(path0, path1, matcher=GUMTREE_MATCHER):
+    opts = [matcher, get_gumtree_generator(path0)]
+    if replaying():
+        return TOOL_ARCHIVE.get_stdout('diff', [path0, path1], opts)
+    if GUMTREE_CACHE is None:
+        return None
+    data = GUMTREE_CACHE.get('diff', [path0, path1], opts)
+    if data is not None:
+        archive_run('diff', [path0, path1], opts, gumtree_diff_cmd(path0, path1, matcher=matcher),
+                    data)
+    return data
+
+
+def gumtree_store_diff(path0, path1, matcher, data):
+    opts = [matcher, get_gumtree_generator(path0)]
+    if data:
+        archive_run('diff', [path0, path1], opts, gumtree_diff_cmd(path0, path1, matcher=matcher),
+                    data)
+    if GUMTREE_CACHE is not None and data:
+        GUMTREE_CACHE.put('diff', [path0, path1], opts, data)
+
+
+def gumtree_diff(path0, path1, matcher=GUMTREE_MATCHER, session=None, usage=None):
+    s = gumtree_cached_diff(path0, path1, matcher=matcher)
+    hit = s is not None
+    if not hit:
+        s = gumtree_diff_raw(path0, path1, matcher=matcher, session=session, usage=usage)
+        if s is None:
+            return None
     diff = None
-    s = None
     try:
-        p = run(cmd, shell=True, capture_output=True)
-        s = p.stdout
-        diff = json.loads(s)
+        with span('json_load'):
+            diff = json.loads(s)
     except Exception as e:
         logger.error(f'{path0} {path1}: {e}: {s}')
+        return None
+    if not hit:
+        gumtree_store_diff(path0, path1, matcher, s)
     return diff
 
 
-def gumtree_parse(path):
-    opts = ''
-    if path.endswith('.py'):
-        opts += ' -g python-treesitter-ng'
-    cmd = f'{GUMTREE_CMD} parse{opts} -f json {escape(path)}'
+def gumtree_diff_raw(path0, path1, matcher=GUMTREE_MATCHER, session=None, usage=None):
+    if replaying():
+        logger.error(f'{path0} {path1}: not found in tool archive')
+        return None
+
+    if session is not None and gumtree_session_safe(path0, path1):
+        try:
+            with span('ext_diff'):
+                return session.diff(path0, path1, matcher=matcher, usage=usage)
+        except Exception as e:
+            logger.error(f'{path0} {path1}: {e}')
+            return None
+
+    cmd = gumtree_diff_cmd(path0, path1, matcher=matcher)
+    logger.debug(f'cmd={cmd}')
+    try:
+        with span('ext_diff'):
+            p = run_cmd(cmd, usage=usage)
+        return p.stdout
+    except Exception as e:
+        logger.error(f'{path0} {path1}: {e}')
+        return None
+
+
+def gumtree_parse(path, session=None, usage=None):
+    if recording():  # a memoized tree would leave its parse out of the archive
+        return gumtree_parse_(path, session=session, usage=usage)
+    if GUMTREE_CACHE is not None:  # trees are too large to keep when they can be reloaded
+        return gumtree_parse_(path, session=session, usage=usage)
+    return memoize('tree', path, lambda p: gumtree_parse_(p, session=session, usage=usage),
+                   get_gumtree_generator(path))
+
+
+def gumtree_parse_(path, session=None, usage=None):
+    s = gumtree_cached_parse(path)
+    hit = s is not None
+    if not hit:
+        s = gumtree_parse_raw(path, session=session, usage=usage)
+        if s is None:
+            return None
     tree = None
     try:
-        p = run(cmd, shell=True, capture_output=True)
-        tree = json.loads(p.stdout)
+        with span('json_load'):
+            tree = json.loads(s)
     except Exception as e:
-        logger.error(f'{path}: {e} (opts="{opts}")')
+        logger.error(f'{path}: {e}')
+        return None
+    if not hit:
+        gumtree_store_parse(path, s)
     return tree
 
 
-def gumtree_node_count(path):
+def gumtree_parse_raw(path, session=None, usage=None):
+    if replaying():
+        logger.error(f'{path}: not found in tool archive')
+        return None
+
+    if session is not None and gumtree_session_safe(path):
+        try:
+            with span('ext_parse'):
+                return session.parse(path, usage=usage)
+        except Exception as e:
+            logger.error(f'{path}: {e}')
+            return None
+
+    cmd = gumtree_parse_cmd(path)
+    try:
+        with span('ext_parse'):
+            p = run_cmd(cmd, usage=usage)
+        return p.stdout
+    except Exception as e:
+        logger.error(f'{path}: {e} (cmd="{" ".join(cmd)}")')
+        return None
+
+
+def gumtree_node_count(path, session=None):
+    return memoize('nnodes', path, lambda p: gumtree_node_count_(p, session=session),
+                   get_lang(path))
+
+
+def gumtree_node_count_(path, session=None):
     c = None
-    t = gumtree_parse(path)
+    t = gumtree_parse(path, session=session)
     if t is not None:
         gt = GtHandler(path)
         c = gt.count_tree_nodes(t)
@@ -470,19 +1230,33 @@ def gumtree_delta(path0, path1):
     return r
 
 
-def text_gumtree_sim(path0, path1):
-    t0 = gumtree_parse(path0)
-    t1 = gumtree_parse(path1)
-    d = gumtree_diff(path0, path1)
+def text_gumtree_sim(path0, path1, session=None):
+    usage = new_usage()
+    t0 = gumtree_parse(path0, session=session, usage=usage)
+    t1 = gumtree_parse(path1, session=session, usage=usage)
+    d = gumtree_diff(path0, path1, session=session, usage=usage)
+    r = gumtree_result(path0, path1, t0, t1, d)
+    r.update(usage)
+    return r
+
+
+def gumtree_result(path0, path1, t0, t1, d):
     try:
-        align0 = get_token_regions(path0)
-        align1 = get_token_regions(path1)
+        with span('json_load'):
+            if isinstance(t0, bytes):
+                t0 = json.loads(t0)
+            if isinstance(t1, bytes):
+                t1 = json.loads(t1)
+            if isinstance(d, bytes):
+                d = json.loads(d)
+        with span('token_scan'):
+            align0 = get_token_regions(path0)
+            align1 = get_token_regions(path1)
         gt = GtHandler(path0)
-        r0 = gt.text_similarity(t0, t1, d, align0, align1)
-        sim = r0['similarity']
-        col = r0['colored']
-        r1 = gt.delta(t0, t1, d)
-        cost = r1['cost']
+        r = gt.analyze(t0, t1, d, align0, align1)
+        sim = r['similarity']
+        col = r['colored']
+        cost = r['cost']
     except Exception as e:
         logger.error(f'{path0} {path1}: {e}')
         raise
@@ -492,18 +1266,18 @@ def text_gumtree_sim(path0, path1):
 
 def diffast_sim(path0, path1):
     cmd = f'{SIMAST_CMD} -clearcache {escape(path0)} {escape(path1)}'
-    p = run(cmd, shell=True, capture_output=True)
+    p = run_cmd(cmd, shell=True)
     sim = float(p.stdout)
     return sim
 
 
 def get_seg_region0(h):
-    r = set()
+    r = Region()
     try:
         for seg in h['segments1']:
             st = seg['start']
             ed = seg['end']
-            r.update(set(range(st, ed+1)))
+            r.add(st, ed+1)
     except KeyError:
         pass
         # st = h['start1']
@@ -513,12 +1287,12 @@ def get_seg_region0(h):
 
 
 def get_seg_region1(h):
-    r = set()
+    r = Region()
     try:
         for seg in h['segments2']:
             st = seg['start']
             ed = seg['end']
-            r.update(set(range(st, ed+1)))
+            r.add(st, ed+1)
     except KeyError:
         pass
         # st = h['start2']
@@ -532,27 +1306,109 @@ def is_ws(c):
 
 
 def show_regions(r):
-    li = sorted(list(r))
-    head = True
-    end = False
-    for i, x in enumerate(li):
-        try:
-            next = li[i+1]
-        except IndexError:
-            end = True
-
-        if head:
-            sys.stdout.write(f'{x}')
-            head = False
-        elif not end and next == x + 1:
-            head = False
+    if not isinstance(r, Region):
+        r = Region.from_positions(r)
+    for st, ed in r.intervals():
+        sys.stdout.write(f'{st}-{ed-1}\n')
+
+
+TOKEN_PAT = re.compile(r'[^ \t\r\n/]+|/.?', flags=re.DOTALL)
+EOL_PAT = re.compile(r'[\r\n]')
+
+
+def scan_token_regions(s):
+    r = Region()
+    n = len(s)
+    pos = 0
+    # a block comment ending with "*/" leaves the scanner ready to close
+    # the next one at "/*/" (kept for compatibility with get_token_regions0)
+    end_head = False
+    search = TOKEN_PAT.search
+    while pos < n:
+        m = search(s, pos)
+        if m is None:
+            break
+        st, ed = m.span()
+        if s[st] != '/':
+            r.add(st, ed)
+            pos = ed
+        elif ed - st == 1:  # '/' at EOF
+            break
+        elif s[ed-1] == '/':
+            m = EOL_PAT.search(s, ed)
+            if m is None:
+                break
+            pos = m.start()
+        elif s[ed-1] == '*':
+            if end_head and s.startswith('/', ed):
+                pos = ed + 1
+                continue
+            k = s.find('*/', ed)
+            if k < 0:
+                break
+            end_head = True
+            pos = k + 2
         else:
-            sys.stdout.write(f'-{x}\n')
-            head = True
+            r.add(st, ed)
+            pos = ed
+    return r
+
+
+def read_source(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
 
 
 def get_token_regions(path):
-    r = set()
+    return memoize('token_regions', path, lambda p: scan_token_regions(read_source(p)))
+
+
+# string literals and Javadoc (a GumTree node) are kept verbatim
+NORM_TOKEN_PAT = re.compile(rb'"""(?:\\.|[^\\])*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+                            rb'|/\*\*(?!/).*?\*/|/\*.*?\*/|//[^\n]*|[^\s"\'/]+|\S', flags=re.DOTALL)
+
+
+def is_comment(tok):
+    if tok.startswith(b'//'):
+        return True
+    return tok.startswith(b'/*') and (not tok.startswith(b'/**') or tok == b'/**/')
+
+
+def scan_norm_tokens(b):
+    return [tok for tok in NORM_TOKEN_PAT.findall(b) if not is_comment(tok)]
+
+
+def norm_digest(path):
+    with open(path, 'rb') as f:
+        b = f.read()
+    return hashlib.sha1(b'\0'.join(scan_norm_tokens(b))).hexdigest()
+
+
+def get_norm_digest(path):
+    return memoize('norm_digest', path, norm_digest)
+
+
+SAME_RESULT = {'similarity': 1.0, 'colored': 0, 'cost': 0}
+
+FAILED_RESULT = {'similarity': 0.0, 'colored': math.nan, 'cost': math.nan}
+
+
+def quick_compare(path0, path1):
+    # 'identical' or 'trivial' (whitespace and comments only) when the pair
+    # needs no differ, None otherwise
+    try:
+        if file_digest_memo(path0) == file_digest_memo(path1):
+            return 'identical'
+        if get_lang(path0) == 'java' and get_lang(path1) == 'java':
+            if get_norm_digest(path0) == get_norm_digest(path1):
+                return 'trivial'
+    except OSError as e:
+        logger.warning(f'{path0} {path1}: {e}')
+    return None
+
+
+def get_token_regions0(path):
+    r = Region()
     comment_head_flag = False
     block_comment_flag = False
     block_comment_end_head_flag = False
@@ -565,8 +1421,7 @@ def get_token_regions(path):
                 elif c == '*':
                     block_comment_flag = True
                 else:
-                    r.add(i - 1)
-                    r.add(i)
+                    r.add(i - 1, i + 1)
 
                 comment_head_flag = False
 
@@ -592,7 +1447,7 @@ def get_token_regions(path):
             elif is_ws(c):
                 pass
             else:
-                r.add(i)
+                r.add(i, i + 1)
 
     return r
 
@@ -601,11 +1456,13 @@ def read_diff_json(diff_json, align0, align1, ignore_move=IGNORE_MOVE):
     with open(diff_json, 'r') as f:
         d = []
         try:
-            d = json.load(f)
+            with span('json_load'):
+                d = json.load(f)
         except Exception as e:
             logger.error(f'invalid JSON file: {diff_json}: {e}')
-        r0 = set()
-        r1 = set()
+        st_time = get_time()
+        r0 = Region()
+        r1 = Region()
         for h in d:
             if h is not None:
                 tag = h['tag']
@@ -623,12 +1480,14 @@ def read_diff_json(diff_json, align0, align1, ignore_move=IGNORE_MOVE):
                 elif tag == 'RELABEL':
                     r0.update(get_seg_region0(h))
                     r1.update(get_seg_region1(h))
+        add_span('analysis', get_time() - st_time)
 
-        r0 &= align0
-        r1 &= align1
+        with span('intersect'):
+            r0 &= align0
+            r1 &= align1
 
-        csz0 = len(r0)
-        csz1 = len(r1)
+            csz0 = len(r0)
+            csz1 = len(r1)
 
         return (csz0, csz1)
 
@@ -717,93 +1576,274 @@ def read_stat_json(stat_json):
             return None
 
 
-def text_diffast_sim(path0, path1,
-                     keep_going=False,
-                     scan_huge_arrays=False,
-                     no_rr=False,
-                     weak=False,
-                     use_cache=True, cache_dir=None):
-
-    worker_id = mp.current_process().name
-
-    opt = ''
+def diffast_cmd(path0, path1,
+                keep_going=False,
+                scan_huge_arrays=False,
+                no_rr=False,
+                weak=False,
+                use_cache=True, cache_dir=None,
+                local_cache_name=None):
+    cmd = [SIMAST_CMD]
     if keep_going:
-        opt += ' -k'
+        cmd.append('-k')
     if scan_huge_arrays:
-        opt += ' -scan-huge-arrays'
+        cmd.append('-scan-huge-arrays')
     if no_rr:
-        opt += ' -norr'
+        cmd.append('-norr')
     if weak:
-        opt += ' -weak'
+        cmd.append('-weak')
     if not use_cache:
-        opt += ' -clearcache'
+        cmd.append('-clearcache')
     if cache_dir is not None:
-        opt += f' -cache {cache_dir}'
+        cmd.extend(['-cache', cache_dir])
+    if local_cache_name is not None:
+        cmd.extend(['-localcachename', local_cache_name])
+    cmd.extend([path0, path1])
+    return cmd
+
+
+def diffast_getcache_cmd(path0, path1, cache_dir=None, local_cache_name=None, exe=SIMAST_CMD):
+    cmd = [exe]
+    if cache_dir is not None:
+        cmd.extend(['-cache', cache_dir])
+    cmd.append('-getcache')
+    if local_cache_name is not None:
+        cmd.extend(['-localcachename', local_cache_name])
+    cmd.extend([path0, path1])
+    return cmd
+
+
+def file_hexdigest(path, algo):
+    h = hashlib.new(algo)
+    with open(path, 'rb') as f:
+        for b in iter(lambda: f.read(1 << 20), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+class DiffastCacheLocator(object):
+    # Diff/AST names the cache dir of a pair after the digests of the two files.
+    # The layout is learned from a -getcache answer by replacing the digests and
+    # the local cache name with placeholders, so later pairs need no -getcache.
+    ALGOS = ('md5', 'sha1', 'sha256')
+
+    def __init__(self, exe=SIMAST_CMD, cache_dir=None):
+        self.exe = exe
+        self.cache_dir = cache_dir
+        self.algo = None
+        self.template = None
+        self.hits = 0
+        self.misses = 0
+
+    def learn(self, path0, path1, cache_path, local_cache_name=None):
+        if not cache_path:
+            return False
+        for algo in self.ALGOS:
+            try:
+                d0 = file_hexdigest(path0, algo)
+                d1 = file_hexdigest(path1, algo)
+            except OSError:
+                return False
+            if d0 == d1:  # ambiguous
+                return False
+            if d0 not in cache_path or d1 not in cache_path:
+                continue
+            comps = cache_path.split(os.sep)
+            for i, c in enumerate(comps):
+                rest = os.sep.join(comps[i+1:])
+                c = c.replace('{', '{{').replace('}', '}}')
+                if local_cache_name is not None and c == local_cache_name:
+                    c = '{name}'
+                else:
+                    c = c.replace(d0, '{d0}').replace(d1, '{d1}')
+                    # shard dirs named after a digest prefix
+                    for k, d in (('d0', d0), ('d1', d1)):
+                        if len(c) > 1 and d.startswith(c) and d in rest:
+                            c = f'{{{k}:.{len(c)}}}'
+                            break
+                comps[i] = c
+            template = os.sep.join(comps)
+            if template.format(d0=d0, d1=d1, name=local_cache_name) == cache_path:
+                if template != self.template:
+                    logger.info(f'cache path template: {template} ({algo})')
+                    if self.cache_dir is not None:
+                        get_cache_manager(self.cache_dir).set_layout(template)
+                self.algo = algo
+                self.template = template
+                return True
+        logger.debug(f'failed to learn cache path template from {cache_path}')
+        return False
+
+    def predict(self, path0, path1, local_cache_name=None):
+        if self.template is None:
+            return None
+        try:
+            d0 = file_hexdigest(path0, self.algo)
+            d1 = file_hexdigest(path1, self.algo)
+        except OSError:
+            return None
+        return self.template.format(d0=d0, d1=d1, name=local_cache_name)
+
+    def lookup(self, path0, path1, local_cache_name=None, marker='stat.json'):
+        cache_path = self.predict(path0, path1, local_cache_name=local_cache_name)
+        if cache_path is not None and os.path.exists(os.path.join(cache_path, marker)):
+            self.hits += 1
+            return cache_path
+        self.misses += 1
+        return None
 
-    opt += f' -localcachename {worker_id}'
+    def locate(self, path0, path1, local_cache_name=None, marker='stat.json', usage=None):
+        cache_path = self.lookup(path0, path1, local_cache_name=local_cache_name, marker=marker)
+        if cache_path is None:
+            cmd = diffast_getcache_cmd(path0, path1, cache_dir=self.cache_dir,
+                                       local_cache_name=local_cache_name, exe=self.exe)
+            p = run_cmd(cmd, usage=usage, text=True)
+            cache_path = p.stdout.strip()
+            self.learn(path0, path1, cache_path, local_cache_name=local_cache_name)
+        return cache_path
 
-    path0_ = escape(path0)
-    path1_ = escape(path1)
 
-    cmd0 = f'{SIMAST_CMD}{opt} {path0_} {path1_}'
-    p = run(cmd0, shell=True, capture_output=True)
+_DIFFAST_CACHE_LOCATOR_TBL = {}
 
-    if str(p.stdout).strip() == '1.0':
+
+def get_diffast_cache_locator(exe=SIMAST_CMD, cache_dir=None):
+    try:
+        locator = _DIFFAST_CACHE_LOCATOR_TBL[(exe, cache_dir)]
+    except KeyError:
+        locator = _DIFFAST_CACHE_LOCATOR_TBL[(exe, cache_dir)] = DiffastCacheLocator(exe, cache_dir)
+    return locator
+
+
+def diffast_cached(path0, path1, cache_dir, local_cache_name, use_cache, exe=SIMAST_CMD,
+                   marker='stat.json'):
+    if not use_cache or cache_dir is None:
+        return False
+    locator = get_diffast_cache_locator(exe=exe, cache_dir=cache_dir)
+    cache_path = locator.predict(path0, path1, local_cache_name=local_cache_name)
+    return cache_path is not None and os.path.exists(os.path.join(cache_path, marker))
+
+
+def record_diffast_access(cache_dir, cache_path, hit):
+    if cache_dir is not None and cache_path:
+        get_cache_manager(cache_dir).record(cache_path, hit)
+
+
+DIFFAST_FILES = ('stat.json', 'diff.json', COMPLETE_MARKER)
+
+
+def diffast_archive_opts(keep_going=False, scan_huge_arrays=False, no_rr=False, weak=False):
+    return [keep_going, scan_huge_arrays, no_rr, weak]
+
+
+def archive_diffast(path0, path1, opts, cmd, stdout, returncode, cache_path=None):
+    archive_run('simast', [path0, path1], opts, cmd, stdout, returncode=returncode,
+                files_dir=cache_path, files=DIFFAST_FILES if cache_path else ())
+
+
+def replay_diffast(path0, path1, opts):
+    cache_path, entry = get_archived_run('simast', [path0, path1], opts)
+    if entry is None:
+        logger.error(f'{path0} {path1}: not found in tool archive')
+        return dict(FAILED_RESULT)
+    if entry['stdout'].decode('utf-8', errors='replace').strip() == '1.0':
         return {'similarity': 1.0, 'colored': 0, 'cost': 0}
+    return diffast_result(path0, path1, cache_path, cmd=entry['cmd'], wait=False)
 
-    opt = ''
-    if cache_dir is not None:
-        opt += f' -cache {cache_dir}'
 
-    cmd1 = f'{SIMAST_CMD}{opt} -getcache -localcachename {worker_id} {path0_} {path1_}'
-    p = run(cmd1, shell=True, capture_output=True, text=True)
+def text_diffast_sim(path0, path1,
+                     keep_going=False,
+                     scan_huge_arrays=False,
+                     no_rr=False,
+                     weak=False,
+                     use_cache=True, cache_dir=None):
+
+    opts = diffast_archive_opts(keep_going=keep_going, scan_huge_arrays=scan_huge_arrays,
+                                no_rr=no_rr, weak=weak)
+    if replaying():
+        return replay_diffast(path0, path1, opts)
+
+    worker_id = mp.current_process().name
+
+    hit = diffast_cached(path0, path1, cache_dir, worker_id, use_cache)
+
+    cmd0 = diffast_cmd(path0, path1,
+                       keep_going=keep_going,
+                       scan_huge_arrays=scan_huge_arrays,
+                       no_rr=no_rr,
+                       weak=weak,
+                       use_cache=use_cache, cache_dir=cache_dir,
+                       local_cache_name=worker_id)
+    usage = new_usage()
+    with span('ext_diff'):
+        p = run_cmd(cmd0, usage=usage)
+
+    if p.stdout.decode('utf-8', errors='replace').strip() == '1.0':
+        archive_diffast(path0, path1, opts, cmd0, p.stdout, p.returncode)
+        return dict(similarity=1.0, colored=0, cost=0, **usage)
+
+    locator = get_diffast_cache_locator(cache_dir=cache_dir)
+    with span('ext_locate'):
+        cache_path = locator.locate(path0, path1, local_cache_name=worker_id, usage=usage)
+    if p.returncode == 0 and cache_path and not hit:
+        mark_complete(cache_path)
+    record_diffast_access(cache_dir, cache_path, hit)
+    archive_diffast(path0, path1, opts, cmd0, p.stdout, p.returncode, cache_path)
+
+    r = diffast_result(path0, path1, cache_path, cmd=cmd0, wait=hit)
+    r.update(usage)
+    return r
 
-    cache_dir = p.stdout.strip()
-    diff_json = os.path.join(cache_dir, 'diff.json')
+
+def diffast_result(path0, path1, cache_path, cmd=None, wait=True):
+    # wait: the entry may still be being written by another worker sharing the cache
+    # (a hit); an entry produced by the caller itself is complete once the tool exits
     stat = None
 
-    stat_path = os.path.join(cache_dir, 'stat.json')
-    if not os.path.exists(stat_path):
+    if cache_path and wait:
+        with span('wait_output'):
+            wait_complete(cache_path, ['stat.json'])
+
+    stat_path = os.path.join(cache_path or '', 'stat.json')
+    if not cache_path or not os.path.exists(stat_path):
         logger.warning(f'not found: {stat_path}')
         logger.warning(f'failed to compare: {path0} {path1}')
-        logger.warning(f'cmd: {cmd0}')
-        return {'similarity': 0.0, 'colored': math.nan, 'cost': math.nan}
+        if cmd is not None:
+            logger.warning(f'cmd: {" ".join(cmd)}')
+        return dict(FAILED_RESULT)
+
+    diff_json = os.path.join(cache_path, 'diff.json')
 
     cost = -1
-    stat = read_stat_json(stat_path)
+    with span('json_load'):
+        stat = read_stat_json(stat_path)
     if stat:
         cost = stat['cost']
         if cost == 0:
             return {'similarity': 1.0, 'colored': 0, 'cost': 0}
 
+    if wait:
+        with span('wait_output'):
+            wait_complete(cache_path, ['diff.json'])
+
     sz0 = 0
     sz1 = 0
     csz0 = 0
     csz1 = 0
     sim = 0
     colored = 0
-    nretries = 0
-    while nretries <= MAX_NRETRIES:
-        try:
-            if nretries > 0:
-                logger.warning(f'retrying to read {diff_json}...')
-
+    try:
+        with span('token_scan'):
             align0 = get_token_regions(path0)
             align1 = get_token_regions(path1)
-            sz0 = len(align0)
-            sz1 = len(align1)
-            csz0, csz1 = read_diff_json(diff_json, align0, align1)
-            sz = sz0 + sz1
-            colored = csz0 + csz1
-            m = sz - colored
-            sim = m / sz
-            break
-        except Exception as e:
-            nretries += 1
-            if nretries > MAX_NRETRIES:
-                logger.error(f'failed to read diff.json: {e}')
-            else:
-                time.sleep(2**nretries)
+        sz0 = len(align0)
+        sz1 = len(align1)
+        csz0, csz1 = read_diff_json(diff_json, align0, align1)
+        sz = sz0 + sz1
+        colored = csz0 + csz1
+        m = sz - colored
+        sim = m / sz
+    except Exception as e:
+        logger.error(f'failed to read {diff_json}: {e}')
 
     logger.debug(f'file:{sz0}->{sz1}, colored:{csz0}->{csz1}, sim={sim}')
 
@@ -3,6 +3,8 @@
 import os
 import csv
 
+from calibrate import load_calibration, correct_time
+
 
 PROJECTS = [
     'activemq',
@@ -21,11 +23,27 @@ HEADER = [
     'commit', 'path',
     'old', 'old_sloc',
     'new', 'new_sloc',
-    'sim', 'col', 'time', 'time_ratio', 'tool'
+    'sim', 'col', 'time', 'time_ratio', 'tool',
+    'utime', 'stime', 'cpu_time', 'maxrss', 'corrected_time', 'quick'
 ]
 
 
-def conv(in_path, out_path):
+def get_usage(row, prefix):
+    # empty when the results predate resource accounting
+    d = {}
+    try:
+        utime = float(row[f'{prefix}_utime'])
+        stime = float(row[f'{prefix}_stime'])
+        d['utime'] = utime
+        d['stime'] = stime
+        d['cpu_time'] = utime + stime
+        d['maxrss'] = int(float(row[f'{prefix}_maxrss']))
+    except (KeyError, TypeError, ValueError):
+        pass
+    return d
+
+
+def conv(in_path, out_path, cal=None):
 
     rows = []
 
@@ -60,6 +78,7 @@ def conv(in_path, out_path):
                 'new': new,
                 'old_sloc': old_sloc,
                 'new_sloc': new_sloc,
+                'quick': row.get('quick', ''),
             }
 
             gt_row = d.copy()
@@ -68,6 +87,9 @@ def conv(in_path, out_path):
             gt_row['col'] = gt_col
             gt_row['time'] = gt_time
             gt_row['time_ratio'] = gt_time / da_time
+            gt_row.update(get_usage(row, 'gt'))
+            if cal is not None:
+                gt_row['corrected_time'] = correct_time(cal, 'gumtree', gt_time)
             rows.append(gt_row)
 
             da_row = d.copy()
@@ -76,6 +98,9 @@ def conv(in_path, out_path):
             da_row['col'] = da_col
             da_row['time'] = da_time
             da_row['time_ratio'] = gt_time / da_time
+            da_row.update(get_usage(row, 'da'))
+            if cal is not None:
+                da_row['corrected_time'] = correct_time(cal, 'diffast', da_time)
             rows.append(da_row)
 
         nrows = len(rows)
@@ -95,13 +120,17 @@ def conv_all():
     in_path = 'out.merged.csv'
     out_path = 'out.converted.csv'
 
-    conv(in_path, out_path)
+    cal = load_calibration()
+    if cal is not None:
+        print(f'startup-corrected times by calibration of {cal["date"]}')
+
+    conv(in_path, out_path, cal=cal)
 
     for proj in PROJECTS:
         in_path = f'out.{proj}.merged.csv'
         if os.path.exists(in_path):
             out_path = f'out.{proj}.converted.csv'
-            conv(in_path, out_path)
+            conv(in_path, out_path, cal=cal)
 
 
 if __name__ == '__main__':
@@ -25,4 +25,4 @@ if __name__ == '__main__':
     logging.basicConfig(level=log_level, handlers=[fh])
     logger.addHandler(fh)
 
-    da_mp_main(use_cache=args.use_cache, nprocs=args.nprocs)
+    da_mp_main(use_cache=args.use_cache, nprocs=args.nprocs, resume=args.resume)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# Generates synthetic Java file pairs of controlled size and edit density in
+# the samples layout (PROJ/{0,1}/FILE and PROJ/index.csv)
+
+import os
+import re
+import csv
+import random
+import logging
+
+logger = logging.getLogger()
+
+SIZES = [100, 1000, 10000, 100000]
+
+EDIT_RATIOS = [0.01, 0.1]
+
+INDEX_HEADER = ['commit', 'path', 'old', 'new', 'sloc', 'edit_ratio', 'moves', 'renames']
+
+OPS = ['+', '-', '*']
+CMPS = ['<', '>', '<=', '>=', '==', '!=']
+
+
+class Method(object):
+    def __init__(self, name, params, body, local=None):
+        self.name = name
+        self.params = params
+        self.body = body  # statements, each a list of lines
+        self.local = local or []
+
+    def copy(self):
+        return Method(self.name, list(self.params), [list(s) for s in self.body],
+                      list(self.local))
+
+    def render(self):
+        params = ', '.join(f'int {p}' for p in self.params)
+        lines = [f'    public int {self.name}({params}) {{']
+        for s in self.body:
+            lines.extend('        ' + x for x in s)
+        lines.append(f'        return {self.params[0]};')
+        lines.append('    }')
+        return lines
+
+
+class Generator(object):
+    def __init__(self, rnd):
+        self.rnd = rnd
+        self.fields = []
+        self.methods = []
+        self.nnames = 0
+
+    def new_name(self, prefix):
+        self.nnames += 1
+        return f'{prefix}{self.nnames}'
+
+    def expr(self, names):
+        rnd = self.rnd
+        x = rnd.choice(names)
+        if rnd.random() < 0.5:
+            return f'{x} {rnd.choice(OPS)} {rnd.randint(1, 99)}'
+        return f'{x} {rnd.choice(OPS)} {rnd.choice(names)}'
+
+    def call(self, names):
+        m = self.rnd.choice(self.methods)
+        args = ', '.join(self.rnd.choice(names) for _ in m.params)
+        return f'{m.name}({args})'
+
+    def stmt(self, names, local):
+        rnd = self.rnd
+        k = rnd.random()
+        if k < 0.2:
+            v = self.new_name('v')
+            local.append(v)
+            return [f'int {v} = {self.expr(names + local)};']
+        names = names + local
+        x = rnd.choice(names)
+        if k < 0.45:
+            return [f'{x} = {self.expr(names)};']
+        if k < 0.6 and self.methods:
+            return [f'{x} += {self.call(names)};']
+        if k < 0.8:
+            return [f'if ({rnd.choice(names)} {rnd.choice(CMPS)} {rnd.randint(0, 99)}) {{',
+                    f'    {x} = {self.expr(names)};',
+                    '}']
+        i = self.new_name('i')
+        return [f'for (int {i} = 0; {i} < {rnd.randint(2, 16)}; {i}++) {{',
+                f'    {x} += {i} {rnd.choice(OPS)} {self.expr(names)};',
+                '}']
+
+    def method(self):
+        params = [self.new_name('p') for _ in range(self.rnd.randint(1, 3))]
+        local = []
+        body = [self.stmt(params + self.fields, local) for _ in range(self.rnd.randint(3, 12))]
+        return Method(self.new_name('m'), params, body, local)
+
+    def generate(self, sloc):
+        self.fields = [self.new_name('f') for _ in range(max(2, min(sloc // 50, 40)))]
+        n = 3 + len(self.fields)
+        while n < sloc:
+            m = self.method()
+            self.methods.append(m)
+            n += sum(len(s) for s in m.body) + 3
+
+    def edit(self, edit_ratio, nmoves, nrenames):
+        rnd = self.rnd
+        methods = [m.copy() for m in self.methods]
+        for m in methods:
+            names = m.params + self.fields + m.local
+            body = []
+            for s in m.body:
+                if rnd.random() >= edit_ratio:
+                    body.append(s)
+                    continue
+                k = rnd.randint(0, 2)
+                if k == 0:  # update
+                    body.append([re.sub(r'\b[0-9]+\b', lambda _: str(rnd.randint(100, 999)), x)
+                                 for x in s])
+                elif k == 1:  # insert
+                    body.append(s)
+                    body.append([f'{rnd.choice(names)} = {self.expr(names)};'])
+                # k == 2: delete
+            m.body = body
+
+        for _ in range(min(nmoves, len(methods))):
+            m = methods.pop(rnd.randrange(len(methods)))
+            methods.insert(rnd.randrange(len(methods) + 1), m)
+
+        renames = {}
+        for m in rnd.sample(methods, min(nrenames, len(methods))):
+            renames[m.name] = self.new_name('r')
+        if renames:
+            pat = re.compile(r'\b(' + '|'.join(renames.keys()) + r')\b')
+            for m in methods:
+                m.name = renames.get(m.name, m.name)
+                m.body = [[pat.sub(lambda x: renames[x.group(1)], x) for x in s]
+                          for s in m.body]
+        return methods
+
+    def render(self, cname, methods):
+        lines = ['package synth;', '', f'public class {cname} {{']
+        for f in self.fields:
+            lines.append(f'    private int {f};')
+        for m in methods:
+            lines.append('')
+            lines.extend(m.render())
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+
+def get_proj_name(sloc):
+    return f'sloc{sloc}'
+
+
+def gen_pair(rnd, sloc, edit_ratio, nmoves, nrenames, cname):
+    g = Generator(rnd)
+    g.generate(sloc)
+    src0 = g.render(cname, g.methods)
+    src1 = g.render(cname, g.edit(edit_ratio, nmoves, nrenames))
+    return src0, src1
+
+
+def generate(root, sizes=SIZES, edit_ratios=EDIT_RATIOS, npairs=1, nmoves=2, nrenames=2,
+             seed=0):
+    for sloc in sizes:
+        proj = get_proj_name(sloc)
+        d = os.path.join(root, proj)
+        for side in ('0', '1'):
+            os.makedirs(os.path.join(d, side), exist_ok=True)
+        rows = []
+        for edit_ratio in edit_ratios:
+            for i in range(npairs):
+                rnd = random.Random(f'{seed}-{sloc}-{edit_ratio}-{i}')
+                cname = f'S{sloc}E{round(edit_ratio * 1000)}N{i}'
+                fn = f'{cname}.java'
+                src0, src1 = gen_pair(rnd, sloc, edit_ratio, nmoves, nrenames, cname)
+                with open(os.path.join(d, '0', fn), 'w') as f:
+                    f.write(src0)
+                with open(os.path.join(d, '1', fn), 'w') as f:
+                    f.write(src1)
+                rows.append({'commit': f'synth{seed}', 'path': f'synth/{fn}',
+                             'old': fn, 'new': fn, 'sloc': sloc, 'edit_ratio': edit_ratio,
+                             'moves': nmoves, 'renames': nrenames})
+        with open(os.path.join(d, 'index.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=INDEX_HEADER)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+        logger.info(f'{len(rows)} pairs generated in {d}')
+        print(f'{len(rows)} pairs generated in {d}')
+
+
+def parse_list(f):
+    return lambda s: [f(x) for x in s.split(',') if x]
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='generate synthetic Java file pairs',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('-o', '--outdir', dest='outdir', metavar='DIR', default='synth',
+                        help='specify output samples dir')
+
+    parser.add_argument('-s', '--sizes', dest='sizes', metavar='N,...', type=parse_list(int),
+                        default=SIZES, help='specify approximate SLOC of the old files')
+
+    parser.add_argument('-e', '--edit-ratios', dest='edit_ratios', metavar='R,...',
+                        type=parse_list(float), default=EDIT_RATIOS,
+                        help='specify fractions of statements updated, inserted after or deleted')
+
+    parser.add_argument('-n', '--npairs', dest='npairs', metavar='N', type=int, default=1,
+                        help='specify number of pairs for each size and edit ratio')
+
+    parser.add_argument('-m', '--moves', dest='nmoves', metavar='N', type=int, default=2,
+                        help='specify number of methods moved')
+
+    parser.add_argument('-r', '--renames', dest='nrenames', metavar='N', type=int, default=2,
+                        help='specify number of methods renamed along with their call sites')
+
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='specify random seed')
+
+    args = parser.parse_args()
+
+    generate(args.outdir, sizes=args.sizes, edit_ratios=args.edit_ratios, npairs=args.npairs,
+             nmoves=args.nmoves, nrenames=args.nrenames, seed=args.seed)
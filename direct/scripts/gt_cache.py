@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# A persistent cache of GumTree parse/diff outputs keyed by file content
+
+import os
+import gzip
+import hashlib
+import tempfile
+import logging
+
+from memo import file_digest
+
+logger = logging.getLogger()
+
+GUMTREE_CACHE_NAME = 'CACHE-gumtree'
+
+VERSION_FILES = ('GtServer.java',)
+
+
+def get_gumtree_version(gumtree_dir):
+    h = hashlib.sha1()
+    found = False
+    for dpath, dns, fns in os.walk(gumtree_dir):
+        dns.sort()
+        for fn in sorted(fns):
+            if not fn.endswith('.jar') and fn not in VERSION_FILES:
+                continue
+            path = os.path.join(dpath, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = os.path.relpath(path, gumtree_dir)
+            h.update(f'{rel}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8'))
+            found = True
+    if not found:
+        logger.warning(f'no GumTree distribution found in {gumtree_dir}')
+        return 'unknown'
+    return h.hexdigest()[:12]
+
+
+class GumtreeCache(object):
+    def __init__(self, cache_dir, version, digest=file_digest):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.digest = digest
+        self.hits = 0
+        self.misses = 0
+
+    def _get_path(self, kind, paths, opts):
+        fields = [kind, self.version] + [self.digest(p) for p in paths] + [str(o) for o in opts]
+        key = hashlib.sha1('\0'.join(fields).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, kind, key[:2], key + '.json.gz')
+
+    def get(self, kind, paths, opts):
+        data = None
+        try:
+            path = self._get_path(kind, paths, opts)
+            with gzip.open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f'failed to read cached {kind} of {paths}: {e}')
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, kind, paths, opts, data):
+        try:
+            path = self._get_path(kind, paths, opts)
+            d = os.path.dirname(path)
+            os.makedirs(d, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=d)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=6))
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f'failed to cache {kind} of {paths}: {e}')
@@ -25,4 +25,5 @@ if __name__ == '__main__':
     logging.basicConfig(level=log_level, handlers=[fh])
     logger.addHandler(fh)
 
-    gt_mp_main(use_cache=args.use_cache, nprocs=args.nprocs)
+    gt_mp_main(use_cache=args.use_cache, nprocs=args.nprocs, resume=args.resume,
+               gumtree_cache_dir=args.gumtree_cache_dir)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+# A manifest kept alongside an output CSV recording what each row was computed
+# from (digests of the input files, tool versions and options), so that rows
+# still valid can be reused by a later run
+
+import os
+import json
+import logging
+
+logger = logging.getLogger()
+
+MANIFEST_SUFFIX = '.manifest.jsonl'
+
+
+def get_manifest_path(outfile):
+    return os.path.splitext(outfile)[0] + MANIFEST_SUFFIX
+
+
+def load_manifest(path, key_fields):
+    tbl = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    d = json.loads(line)
+                    key = tuple([d.pop(k) for k in key_fields])
+                except (ValueError, KeyError):  # interrupted while writing
+                    logger.warning(f'broken entry ignored: {line}')
+                    continue
+                tbl[key] = d
+    except FileNotFoundError:
+        pass
+    return tbl
+
+
+class Manifest(object):
+    def __init__(self, path, key_fields, entries=None):
+        self.path = path
+        self.key_fields = key_fields
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for key, entry in (entries or {}).items():
+                f.write(self._dumps(key, entry))
+        os.replace(tmp, path)
+
+        self._f = open(path, 'a', encoding='utf-8')
+
+    def _dumps(self, key, entry):
+        d = dict(zip(self.key_fields, key))
+        d.update(entry)
+        return json.dumps(d) + '\n'
+
+    def write(self, key, entry):
+        self._f.write(self._dumps(key, entry))
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
@@ -9,6 +9,12 @@ import simplejson as json
 from subprocess import run
 import logging
 
+from common import get_diffast_cache_locator, mark_complete, wait_complete, poll
+from common import diffast_cached, record_diffast_access, COMPLETE_MARKER, POLL_TIMEOUT
+from common import set_tool_archive, replaying, archive_run, get_archived_run
+from cache_manager import get_cache_manager
+import samples
+
 logger = logging.getLogger()
 
 
@@ -58,31 +64,44 @@ def diffast(path0, path1, keep_going=False, use_cache=False, cache_dir=None):
         opts += f' -cache {cache_dir}'
 
     d = []
-    cmd = f'{DIFFAST_CMD}{opts} {path0} {path1}'
-    p = run(cmd, shell=True, capture_output=True)
-    if p.returncode == 0:
-        opts = ''
-        if cache_dir is not None:
-            opts += f' -cache {cache_dir}'
-        cmd = f'{DIFFAST_CMD}{opts} -getcache {path0} {path1}'
-        p = run(cmd, shell=True, capture_output=True, text=True)
-        json_path = os.path.join(p.stdout.strip(), 'map.json.gz')
-        logger.debug('  json_path={}'.format(json_path))
-        count = 1
-        while True:
-            try:
-                with gzip.open(json_path, 'r') as f:
-                    d = json.load(f)
-                    break
-            except Exception:
-                if count < 3:
-                    logger.error(f'failed to load {json_path}, retrying ({count})...')
-                    time.sleep(2*count)
-                else:
-                    raise
-                count += 1
+    if replaying():
+        cache_path, entry = get_archived_run('diffast', [path0, path1], [keep_going])
+        if entry is None:
+            logger.error(f'not found in tool archive: {path0} {path1}')
+            return d
     else:
-        logger.error(f'failed to execute {cmd}')
+        hit = diffast_cached(path0, path1, cache_dir, None, use_cache, exe=DIFFAST_CMD,
+                             marker='map.json.gz')
+        cmd = f'{DIFFAST_CMD}{opts} {path0} {path1}'
+        p = run(cmd, shell=True, capture_output=True)
+        if p.returncode != 0:
+            logger.error(f'failed to execute {cmd}')
+            return d
+        locator = get_diffast_cache_locator(exe=DIFFAST_CMD, cache_dir=cache_dir)
+        cache_path = locator.locate(path0, path1, marker='map.json.gz')
+        if not cache_path:
+            logger.error(f'cache not found: {path0} {path1}')
+            return d
+        if not hit:
+            mark_complete(cache_path)
+        record_diffast_access(cache_dir, cache_path, hit)
+        archive_run('diffast', [path0, path1], [keep_going], cmd, p.stdout,
+                    returncode=p.returncode, files_dir=cache_path,
+                    files=('map.json.gz', COMPLETE_MARKER))
+    json_path = os.path.join(cache_path, 'map.json.gz')
+    logger.debug('  json_path={}'.format(json_path))
+    wait_complete(cache_path, ['map.json.gz'])
+    err = None
+    for count in poll():
+        try:
+            with gzip.open(json_path, 'r') as f:
+                d = json.load(f)
+                break
+        except Exception as e:
+            err = e
+    else:
+        logger.error(f'failed to load {json_path} within {POLL_TIMEOUT}s: {err}')
+        raise err
     return d
 
 
@@ -95,6 +114,15 @@ def get_field(d, k):
     return x
 
 
+def get_sample_paths(store, entries):
+    # the pairs are staged at once as the records do not follow the archive order
+    paths = []
+    for proj, fn0, fn1 in sorted(entries):
+        paths.append(store.get_path(proj, '0', fn0))
+        paths.append(store.get_path(proj, '1', fn1))
+    return paths
+
+
 class Evaluator(object):
 
     def __init__(self, records_path, samples_path, cache_dir=None):
@@ -108,12 +136,11 @@ class Evaluator(object):
 
         logger.info('creating index table...')
 
-        for proj in os.listdir(samples_path):
-            idx_path = os.path.join(samples_path, proj, 'index.csv')
-            with open(idx_path, newline='') as f:
-                for row in csv.DictReader(f):
-                    key = (row['commit'], row['path'])
-                    self.index_tbl[key] = (proj, row['old'], row['new'])
+        self.store = samples.get_store(samples_path)
+        for proj in self.store.projects():
+            for row in self.store.read_index(proj):
+                key = (row['commit'], row['path'])
+                self.index_tbl[key] = (proj, row['old'], row['new'])
 
         logger.info('done.')
 
@@ -186,6 +213,15 @@ class Evaluator(object):
         print(mes)
 
     def eval(self, use_cache=False):
+        keys = set((d[1], d[2]) for d in self.record_tbl.keys())
+        paths = get_sample_paths(self.store, [self.index_tbl[k] for k in keys])
+        self.store.stage(paths)
+        try:
+            self._eval(use_cache=use_cache)
+        finally:
+            self.store.release(paths)
+
+    def _eval(self, use_cache=False):
         count = 0
         missing_annot_count_tbl = {'gt': 0, 'mtdiff': 0, 'ijm': 0, 'da': 0}
         extra_annot_count_tbl = {'gt': 0, 'mtdiff': 0, 'ijm': 0, 'da': 0}
@@ -207,8 +243,8 @@ class Evaluator(object):
 
             self.pr(f'[{count}] {proj}:{commitId}:{filePath}:{startPos}:{stmtType}')
 
-            path0 = os.path.join(self.samples_path, proj, '0', fn0)
-            path1 = os.path.join(self.samples_path, proj, '1', fn1)
+            path0 = self.store.get_path(proj, '0', fn0)
+            path1 = self.store.get_path(proj, '1', fn1)
 
             self.pr(f'  {path0} {path1}')
 
@@ -369,12 +405,11 @@ class Evaluator2(object):
         self.cache_dir = cache_dir
 
         logger.info('creating index table...')
-        for proj in os.listdir(samples_path):
-            idx_path = os.path.join(samples_path, proj, 'index.csv')
-            with open(idx_path, newline='') as f:
-                for row in csv.DictReader(f):
-                    key = (row['commit'], row['path'])
-                    self.index_tbl[key] = (proj, row['old'], row['new'])
+        self.store = samples.get_store(samples_path)
+        for proj in self.store.projects():
+            for row in self.store.read_index(proj):
+                key = (row['commit'], row['path'])
+                self.index_tbl[key] = (proj, row['old'], row['new'])
         logger.info('done.')
 
         logger.info('loading experts\' results summary')
@@ -383,6 +418,19 @@ class Evaluator2(object):
         logger.info('done.')
 
     def eval(self, use_cache=True):
+        keys = set()
+        for proj, t0 in self.proj_tbl.items():
+            for commit, t1 in t0.items():
+                for fpath in t1.keys():
+                    keys.add((commit, fpath))
+        paths = get_sample_paths(self.store, [self.index_tbl[k] for k in keys])
+        self.store.stage(paths)
+        try:
+            self._eval(use_cache=use_cache)
+        finally:
+            self.store.release(paths)
+
+    def _eval(self, use_cache=True):
         count = 0
 
         count_tbl = {'gt': 0, 'mtdiff': 0, 'ijm': 0, 'da': 0}
@@ -417,8 +465,8 @@ class Evaluator2(object):
 
                             proj, fn0, fn1 = self.index_tbl[(commit, fpath)]
 
-                            path0 = os.path.join(self.samples_path, proj, '0', fn0)
-                            path1 = os.path.join(self.samples_path, proj, '1', fn1)
+                            path0 = self.store.get_path(proj, '0', fn0)
+                            path1 = self.store.get_path(proj, '1', fn1)
 
                             diffast_map = diffast(path0, path1,
                                                   use_cache=use_cache,
@@ -459,19 +507,43 @@ class Evaluator2(object):
 
 def main():
     logging.basicConfig(level=logging.INFO, format='[%(levelname)s] %(message)s')
+    start_time = time.time()
     e = Evaluator('DifferentialTesting/expert-results', 'samples', 'CACHE')
     e.load_records()
     e.eval(use_cache=True)
     # e.eval(use_cache=False)
+    if e.cache_dir is not None:
+        print(get_cache_manager(e.cache_dir).report(since=start_time))
 
 
 def main2():
+    start_time = time.time()
     e = Evaluator2('DifferentialTesting/expert-results/summary.json',
                    'samples', 'CACHE')
     # e.eval(use_cache=True)
     e.eval(use_cache=False)
+    if e.cache_dir is not None:
+        print(get_cache_manager(e.cache_dir).report(since=start_time))
 
 
 if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='evaluate mappings against the experts\' judgments',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--record', dest='record_dir', metavar='DIR', default=None,
+                        help='archive diffast runs into DIR')
+
+    parser.add_argument('--replay', dest='replay_dir', metavar='DIR', default=None,
+                        help='read diffast runs archived in DIR instead of running diffast')
+
+    args = parser.parse_args()
+
+    if args.record_dir and args.replay_dir:
+        parser.error('--record and --replay are exclusive')
+
+    set_tool_archive(args.replay_dir or args.record_dir, replay=args.replay_dir is not None)
+
     main()
     # main2()
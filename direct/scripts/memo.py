@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# A cache of per-file analysis results keyed by file content
+
+import os
+import hashlib
+import pickle
+import tempfile
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+MEMO_CACHE_SIZE = 256
+
+# bound on the estimated memory taken by the results kept in memory
+MEMO_CACHE_BYTES = 128 * 1024 * 1024
+
+PERSISTENT_KINDS = ['token_regions', 'nnodes', 'sloc', 'norm_digest']
+
+# estimated bytes of a result in memory per byte of source (others are negligible)
+WEIGHT_TBL = {
+    'tree': 64,
+    'token_regions': 8,
+}
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for b in iter(lambda: f.read(1 << 20), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+class MemoCache(object):
+    # versions: a stamp per kind of the code computing its results, so that results
+    # persisted by an older version are not served
+    def __init__(self, maxsize=MEMO_CACHE_SIZE, cache_dir=None,
+                 persistent_kinds=PERSISTENT_KINDS, maxbytes=MEMO_CACHE_BYTES, versions=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.cache_dir = cache_dir
+        self.persistent_kinds = persistent_kinds
+        self.versions = versions or {}
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._tbl = OrderedDict()
+        self._digest_tbl = {}
+
+    def digest(self, path):
+        st = os.stat(path)
+        k = (path, st.st_mtime_ns, st.st_size)
+        try:
+            return self._digest_tbl[k]
+        except KeyError:
+            d = file_digest(path)
+            if len(self._digest_tbl) >= self.maxsize * 4:
+                self._digest_tbl.clear()
+            self._digest_tbl[k] = d
+            return d
+
+    def _get_path(self, kind, key):
+        d = kind
+        version = self.versions.get(kind, None)
+        if version is not None:
+            d += '-' + version
+        return os.path.join(self.cache_dir, d, key[:2], key + '.pickle')
+
+    def _load(self, kind, key):
+        if self.cache_dir is None or kind not in self.persistent_kinds:
+            raise KeyError(key)
+        path = self._get_path(kind, key)
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(key)
+        except Exception as e:
+            logger.warning(f'failed to load {path}: {e}')
+            raise KeyError(key)
+
+    def _dump(self, kind, key, value):
+        if self.cache_dir is None or kind not in self.persistent_kinds:
+            return
+        path = self._get_path(kind, key)
+        d = os.path.dirname(path)
+        try:
+            os.makedirs(d, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=d)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f'failed to dump {path}: {e}')
+
+    def get(self, kind, key, weight=0):
+        k = (kind, key)
+        try:
+            value, _ = self._tbl[k]
+            self._tbl.move_to_end(k)
+        except KeyError:
+            value = self._load(kind, key)
+            self._put(k, value, weight)
+        return value
+
+    def _put(self, k, value, weight=0):
+        if k in self._tbl:
+            self.nbytes -= self._tbl.pop(k)[1]
+        if weight > self.maxbytes:
+            return
+        self._tbl[k] = (value, weight)
+        self.nbytes += weight
+        while len(self._tbl) > self.maxsize or self.nbytes > self.maxbytes:
+            _, (_, w) = self._tbl.popitem(last=False)
+            self.nbytes -= w
+
+    def put(self, kind, key, value, weight=0):
+        self._put((kind, key), value, weight)
+        self._dump(kind, key, value)
+
+    def memoize(self, kind, path, f, *args):
+        key = '-'.join([self.digest(path)] + [str(a) for a in args])
+        weight = 0
+        if kind in WEIGHT_TBL:
+            weight = os.path.getsize(path) * WEIGHT_TBL[kind]
+        try:
+            value = self.get(kind, key, weight)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            value = f(path)
+            if value is not None:
+                self.put(kind, key, value, weight)
+        return value
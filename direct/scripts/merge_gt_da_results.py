@@ -20,7 +20,11 @@ PROJECTS = [
 HEADER = ['commit', 'path', 'old', 'old_sloc', 'new', 'new_sloc',
           'gt_time', 'gt_sim', 'gt_col', 'gt_cost',
           'da_time', 'da_sim', 'da_col', 'da_cost',
-          'd_sim', 'd_col', 'd_cost']
+          'd_sim', 'd_col', 'd_cost',
+          'gt_utime', 'gt_stime', 'gt_maxrss',
+          'da_utime', 'da_stime', 'da_maxrss', 'quick']
+
+DA_USAGE_FIELDS = ['da_utime', 'da_stime', 'da_maxrss']
 
 
 if __name__ == '__main__':
@@ -77,6 +81,11 @@ if __name__ == '__main__':
 
                 d = {'da_time': da_time, 'da_sim': da_sim, 'da_col': da_col, 'da_cost': da_cost}
 
+                for k in DA_USAGE_FIELDS:
+                    d[k] = row.get(k, '')
+
+                d['quick'] = row.get('quick', '')
+
                 da_tbl[(commit, path, old, new)] = d
 
         rows = []
@@ -105,6 +114,11 @@ if __name__ == '__main__':
                 row['da_col'] = int(d['da_col'])
                 row['da_cost'] = int(d['da_cost'])
 
+                for k in DA_USAGE_FIELDS:
+                    row[k] = d[k]
+
+                row['quick'] = row.get('quick', '') or d['quick']
+
                 gt_sim = float(row['gt_sim'])
                 gt_col = int(row['gt_col'])
                 gt_cost = int(row['gt_cost'])
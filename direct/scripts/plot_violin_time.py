@@ -6,46 +6,37 @@ import seaborn as sns
 from matplotlib import pyplot as plt
 from matplotlib.ticker import FormatStrFormatter
 
-import os
-from subprocess import run
-import time
+from calibrate import CALIBRATION_FILE, load_calibration, get_pair_overhead
 
-from common import GUMTREE_CMD
+LABEL_TBL = {
+    'time': 'Time',
+    'cpu_time': 'CPU time',
+    'utime': 'User CPU time',
+    'stime': 'System CPU time',
+    'maxrss': 'Peak RSS (KiB)',
+}
 
-NULL_JAVA = 'null.java'
 
-
-def get_gumtree_init_time(ntimes=10):
-    with open(NULL_JAVA, 'w') as f:
-        f.write('')
-    cmd = f'{GUMTREE_CMD} textdiff null.java null.java'
-    print('measuring gumtree init time', end='', flush=True)
-
-    t = .0
-    for i in range(ntimes):
-        st = time.time()
-        run(cmd, shell=True, capture_output=True)
-        t += (time.time() - st) * 3  # for differencing and parsing programs
-        print('.', end='', flush=True)
-    t /= float(ntimes)
-    print('')
-
-    print(f't={t}')
-    os.unlink(NULL_JAVA)
-    return t
-
-
-def plot(in_csv, out_file, linear=False):
+def plot(in_csv, out_file, linear=False, column='time', cal=None, include_quick=False):
 
     df = pd.read_csv(in_csv)
 
-    if False:
-        GUMTREE_INIT_TIME = get_gumtree_init_time()
-    else:
-        GUMTREE_INIT_TIME = 0
+    # pairs short-circuited without running the tools
+    if not include_quick and 'quick' in df.columns:
+        nquick = df['quick'].notna().sum()
+        if nquick:
+            print(f'{nquick} rows of short-circuited pairs excluded')
+        df = df[df['quick'].isna()]
+
+    if column == 'time' and cal is not None:
+        for tool in ('gumtree', 'diffast'):
+            overhead = get_pair_overhead(cal, tool)
+            print(f'{tool}: {overhead:.3f}s subtracted for startup')
+            df['time'] = df['time'].where(df['tool'] != tool,
+                                          (df['time'] - overhead).clip(lower=0))
 
-    df['time'] = df['time'].where(df['tool'] == 'diffast',
-                                  df['time']-GUMTREE_INIT_TIME)
+    # rows from results without resource accounting
+    df = df.dropna(subset=[column])
 
     # df = df.query('(old_sloc + new_sloc) / 2.0 > 100.0')
 
@@ -66,22 +57,22 @@ def plot(in_csv, out_file, linear=False):
     # ax.yaxis.set_minor_formatter(FormatStrFormatter("%.1f"))
     ax.yaxis.set_major_formatter(FormatStrFormatter("%d"))
 
-    sns.violinplot(data=df, x='tool', y='time', inner=None,
+    sns.violinplot(data=df, x='tool', y=column, inner=None,
                    gridsize=2000,
                    linewidth=0, width=0.95, ax=ax)
 
     boxprops = {'facecolor': 'none', 'zorder': 3}
     meanprops = {'marker': 'x', 'markeredgecolor': 'black'}
 
-    bp = sns.boxplot(data=df, x='tool', y='time', boxprops=boxprops,
+    bp = sns.boxplot(data=df, x='tool', y=column, boxprops=boxprops,
                      fliersize=2, palette='Dark2', hue='tool', legend=False,
                      showmeans=True,
                      meanprops=meanprops,
                      # showfliers=False,
                      width=0.1, linewidth=1, ax=ax)
 
-    means = df.groupby(['tool'])['time'].mean()
-    quantiles = df.groupby(['tool'])['time'].quantile([.0, .25, .5, .75, 1.0])
+    means = df.groupby(['tool'])[column].mean()
+    quantiles = df.groupby(['tool'])[column].quantile([.0, .25, .5, .75, 1.0])
 
     _tools = sorted(bp.get_xticklabels(), key=lambda x: x.get_position()[0])
     tools = [t.get_text() for t in _tools]
@@ -128,7 +119,10 @@ def plot(in_csv, out_file, linear=False):
                   **fontdict)
 
     ax.set_xlabel(None)
-    ax.set_ylabel('Time', fontdict=fontdict)
+    ylabel = LABEL_TBL.get(column, column)
+    if column == 'time' and cal is not None:
+        ylabel += ' (startup corrected)'
+    ax.set_ylabel(ylabel, fontdict=fontdict)
 
     # f.tight_layout()
 
@@ -140,7 +134,7 @@ def plot(in_csv, out_file, linear=False):
 if __name__ == '__main__':
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-    parser = ArgumentParser(description='generate violin plot for execution time',
+    parser = ArgumentParser(description='generate violin plot for execution time or resource usage',
                             formatter_class=ArgumentDefaultsHelpFormatter)
 
     parser.add_argument('-i', '--input', dest='in_csv', type=str,
@@ -148,12 +142,33 @@ if __name__ == '__main__':
                         help='specify input CSV file')
 
     parser.add_argument('-o', '--output', dest='out_file', type=str,
-                        default='violin_time.png',
-                        help='specify output file')
+                        default=None,
+                        help='specify output file (violin_COLUMN.png by default)')
+
+    parser.add_argument('--corrected', action='store_true',
+                        help='subtract the per-pair startup overhead measured by calibrate.py')
+
+    parser.add_argument('--calibration', dest='cal_file', metavar='FILE',
+                        default=CALIBRATION_FILE, help='specify calibration file')
+
+    parser.add_argument('-c', '--column', dest='column', choices=list(LABEL_TBL.keys()),
+                        default='time', help='specify column to plot')
 
     parser.add_argument('--linear', action='store_true',
                         help='use linear scale instead of log scale')
 
+    parser.add_argument('--include-quick', action='store_true',
+                        help='include pairs short-circuited without running the tools')
+
     args = parser.parse_args()
 
-    plot(args.in_csv, args.out_file, linear=args.linear)
+    out_file = args.out_file or f'violin_{args.column}.png'
+
+    cal = None
+    if args.corrected:
+        cal = load_calibration(args.cal_file)
+        if cal is None:
+            parser.error(f'not found: {args.cal_file} (run calibrate.py first)')
+
+    plot(args.in_csv, out_file, linear=args.linear, column=args.column, cal=cal,
+         include_quick=args.include_quick)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Sets of character positions represented by sorted disjoint intervals
+
+from bisect import bisect_right
+
+
+class Region(object):
+    __slots__ = ('_ivs', '_dirty')
+
+    def __init__(self, intervals=None):
+        self._ivs = []
+        self._dirty = False
+        if intervals is not None:
+            for st, ed in intervals:
+                self.add(st, ed)
+
+    @classmethod
+    def from_positions(cls, positions):
+        r = cls()
+        ivs = r._ivs
+        st = ed = None
+        for x in sorted(positions):
+            if ed is not None and x <= ed:
+                if x == ed:
+                    ed += 1
+            else:
+                if st is not None:
+                    ivs.append((st, ed))
+                st = x
+                ed = x + 1
+        if st is not None:
+            ivs.append((st, ed))
+        return r
+
+    def add(self, st, ed):
+        if st < ed:
+            ivs = self._ivs
+            if ivs and not self._dirty:
+                last_st, last_ed = ivs[-1]
+                if last_ed < st:
+                    ivs.append((st, ed))
+                elif last_st <= st:
+                    if last_ed < ed:
+                        ivs[-1] = (last_st, ed)
+                else:
+                    ivs.append((st, ed))
+                    self._dirty = True
+            else:
+                ivs.append((st, ed))
+
+    def update(self, other):
+        if isinstance(other, Region):
+            for st, ed in other._ivs:
+                self.add(st, ed)
+        else:
+            for st, ed in Region.from_positions(other)._ivs:
+                self.add(st, ed)
+
+    def intervals(self):
+        if self._dirty:
+            self._ivs.sort()
+            ivs = []
+            for st, ed in self._ivs:
+                if ivs and st <= ivs[-1][1]:
+                    if ivs[-1][1] < ed:
+                        ivs[-1] = (ivs[-1][0], ed)
+                else:
+                    ivs.append((st, ed))
+            self._ivs = ivs
+            self._dirty = False
+        return self._ivs
+
+    def __len__(self):
+        return sum(ed - st for st, ed in self.intervals())
+
+    def __bool__(self):
+        return len(self._ivs) > 0
+
+    def __iter__(self):
+        for st, ed in self.intervals():
+            yield from range(st, ed)
+
+    def __contains__(self, x):
+        ivs = self.intervals()
+        i = bisect_right(ivs, (x, float('inf'))) - 1
+        return i >= 0 and ivs[i][0] <= x < ivs[i][1]
+
+    def __eq__(self, other):
+        if not isinstance(other, Region):
+            other = Region.from_positions(other)
+        return self.intervals() == other.intervals()
+
+    def __or__(self, other):
+        r = Region(self.intervals())
+        r.update(other)
+        return r
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __and__(self, other):
+        if not isinstance(other, Region):
+            other = Region.from_positions(other)
+        ivs0 = self.intervals()
+        ivs1 = other.intervals()
+        r = Region()
+        ivs = r._ivs
+        i = j = 0
+        n0 = len(ivs0)
+        n1 = len(ivs1)
+        while i < n0 and j < n1:
+            st0, ed0 = ivs0[i]
+            st1, ed1 = ivs1[j]
+            st = max(st0, st1)
+            ed = min(ed0, ed1)
+            if st < ed:
+                ivs.append((st, ed))
+            if ed0 < ed1:
+                i += 1
+            else:
+                j += 1
+        return r
+
+    def __iand__(self, other):
+        r = self & other
+        self._ivs = r._ivs
+        self._dirty = False
+        return self
+
+    def __repr__(self):
+        return 'Region({})'.format(self.intervals())
+
+    def __getstate__(self):
+        return (self.intervals(),)
+
+    def __setstate__(self, state):
+        self._ivs = list(state[0])
+        self._dirty = False
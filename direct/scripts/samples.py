@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+# Access to the samples (PROJ/index.csv and PROJ/{0,1}/FILE) either in an
+# extracted directory or in place in samples.txz. Members of the archive are
+# staged on a scratch area (tmpfs where available) until they are released,
+# at most STAGE_BUDGET bytes at a time.
+
+import os
+import io
+import csv
+import errno
+import json
+import lzma
+import hashlib
+import atexit
+import shutil
+import tarfile
+import tempfile
+import threading
+import logging
+
+from memo import file_digest
+
+logger = logging.getLogger()
+
+ARCHIVE_EXTS = ['.txz', '.tar.xz']
+
+INDEX_SUFFIX = '.idx.json'
+
+INDEX_VERSION = 2
+
+SCRATCH_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+STAGE_BUDGET = 256 * 1024 * 1024
+
+
+def get_task_paths(task):
+    return [task['path0'], task['path1']]
+
+
+def read_index_csv(text):
+    return list(csv.DictReader(io.StringIO(text, newline='')))
+
+
+def get_scratch_dir(scratch_dir, budget):
+    # tmpfs is often smaller than the budget (64MiB in a default container), in
+    # which case the default temporary dir on disk is used instead
+    for d in [scratch_dir, tempfile.gettempdir()]:
+        if d is None:
+            continue
+        free = shutil.disk_usage(d).free
+        if free >= budget:
+            return d
+        logger.warning(f'{d} has only {free} bytes free (< {budget})')
+    raise OSError(errno.ENOSPC, f'no scratch area with {budget} bytes free')
+
+
+class DirStore(object):
+    def __init__(self, root):
+        self.root = root
+        self._digest_tbl = {}
+
+    def projects(self):
+        projs = []
+        for proj in sorted(os.listdir(self.root)):
+            if os.path.exists(os.path.join(self.root, proj, 'index.csv')):
+                projs.append(proj)
+        return projs
+
+    def read_index(self, proj):
+        with open(os.path.join(self.root, proj, 'index.csv'), newline='') as f:
+            return list(csv.DictReader(f))
+
+    def get_dir(self, proj):
+        return os.path.join(self.root, proj)
+
+    def get_path(self, proj, side, fn):
+        return os.path.join(self.root, proj, side, fn)
+
+    def size(self, path):
+        return os.path.getsize(path)
+
+    def digest(self, path):
+        st = os.stat(path)
+        k = (path, st.st_mtime_ns, st.st_size)
+        try:
+            return self._digest_tbl[k]
+        except KeyError:
+            d = file_digest(path)
+            self._digest_tbl[k] = d
+            return d
+
+    def staged(self, items, paths_of=get_task_paths):
+        return items
+
+    def stage(self, paths):
+        pass
+
+    def release(self, paths):
+        pass
+
+    def close(self):
+        pass
+
+
+class ArchiveStore(object):
+    # xz streams only decompress forwards (seeking backwards restarts from the
+    # beginning), so the members needed by a window of items are staged in a
+    # single pass in archive order rather than in the order they are processed
+    def __init__(self, path, scratch_dir=SCRATCH_DIR, budget=STAGE_BUDGET):
+        self.path = path
+        # a missing or broken archive (e.g. a Git LFS pointer) fails here, before
+        # anything is left on the scratch area
+        self.prefix, self.members, self.indexes = self.load_index()
+        self.budget = budget
+        self.scratch = tempfile.mkdtemp(prefix='samples-',
+                                        dir=get_scratch_dir(scratch_dir, budget))
+        self.nreads = 0
+        self.nbytes = 0
+        self._f = None
+        self._refs = {}
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+
+    def get_index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    def build_index(self):
+        logger.info(f'indexing {self.path}...')
+        members = {}
+        indexes = {}
+        with tarfile.open(self.path, 'r|xz') as tar:
+            for m in tar:
+                if not m.isfile():
+                    continue
+                name = os.path.normpath(m.name)
+                data = tar.extractfile(m).read()
+                members[name] = [m.offset_data, m.size, hashlib.sha1(data).hexdigest()]
+                if os.path.basename(name) == 'index.csv':
+                    indexes[name] = data.decode('utf-8')
+        # samples.txz holds a single top dir (samples/)
+        tops = set(name.split(os.sep)[0] for name in members)
+        prefix = ''
+        if len(tops) == 1:
+            top = tops.pop()
+            if os.path.join(top, 'index.csv') not in members:
+                prefix = top + os.sep
+        st = os.stat(self.path)
+        return {'version': INDEX_VERSION, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                'prefix': prefix, 'members': members, 'indexes': indexes}
+
+    def load_index(self):
+        idx_path = self.get_index_path()
+        st = os.stat(self.path)
+        idx = None
+        try:
+            with open(idx_path) as f:
+                idx = json.load(f)
+            if idx.get('version') != INDEX_VERSION or \
+               idx['size'] != st.st_size or idx['mtime_ns'] != st.st_mtime_ns:
+                logger.info(f'{idx_path} is stale')
+                idx = None
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f'failed to load {idx_path}: {e}')
+        if idx is None:
+            idx = self.build_index()
+            try:
+                with open(idx_path, 'w') as f:
+                    json.dump(idx, f)
+            except OSError as e:
+                logger.warning(f'failed to dump {idx_path}: {e}')
+        prefix = idx['prefix']
+        members = {}
+        for name, v in idx['members'].items():
+            if name.startswith(prefix):
+                members[name[len(prefix):]] = v
+        indexes = {}
+        for name, text in idx['indexes'].items():
+            if name.startswith(prefix):
+                indexes[name[len(prefix):]] = text
+        return prefix, members, indexes
+
+    def projects(self):
+        projs = []
+        for name in sorted(self.indexes.keys()):
+            proj, fn = os.path.split(name)
+            if proj and os.sep not in proj:
+                projs.append(proj)
+        return projs
+
+    def read_index(self, proj):
+        return read_index_csv(self.indexes[os.path.join(proj, 'index.csv')])
+
+    def get_dir(self, proj):
+        return None
+
+    def get_path(self, proj, side, fn):
+        return os.path.join(self.scratch, proj, side, fn)
+
+    def get_name(self, path):
+        return os.path.relpath(path, self.scratch)
+
+    def size(self, path):
+        # available without staging
+        return self.members[self.get_name(path)][1]
+
+    def _get_size(self, path):
+        return self.members.get(self.get_name(path), [0, 0])[1]
+
+    def digest(self, path):
+        return self.members[self.get_name(path)][2]
+
+    def read(self, name):
+        offset, size, _ = self.members[name]
+        if self._f is None:
+            self._f = lzma.open(self.path)
+        self._f.seek(offset)
+        self.nreads += 1
+        return self._f.read(size)
+
+    def stage(self, paths):
+        with self._cond:
+            names = {}
+            for path in paths:
+                name = self.get_name(path)
+                if name in self._refs:
+                    self._refs[name] += 1
+                else:
+                    names[name] = names.get(name, 0) + 1
+            sz = sum([self.members[x][1] for x in names if x in self.members])
+            free = shutil.disk_usage(self.scratch).free
+            if sz > free:
+                raise OSError(errno.ENOSPC, f'{len(names)} files ({sz} bytes) to stage'
+                              f' exceed free space of {self.scratch} ({free} bytes)')
+            for name in sorted(names, key=lambda x: self.members.get(x, [0])[0]):
+                if name not in self.members:
+                    logger.warning(f'not found in {self.path}: {name}')
+                    continue
+                path = os.path.join(self.scratch, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(self.read(name))
+                self._refs[name] = names[name]
+                self.nbytes += self.members[name][1]
+
+    def release(self, paths):
+        with self._cond:
+            for path in paths:
+                name = self.get_name(path)
+                n = self._refs.get(name, 0) - 1
+                if n > 0:
+                    self._refs[name] = n
+                elif n == 0:
+                    del self._refs[name]
+                    self.nbytes -= self.members[name][1]
+                    try:
+                        os.unlink(os.path.join(self.scratch, name))
+                    except OSError as e:
+                        logger.warning(f'failed to remove {name}: {e}')
+            self._cond.notify_all()
+
+    def _stage_window(self, window, sz, paths_of):
+        # a window larger than the budget is staged once nothing else is
+        with self._cond:
+            self._cond.wait_for(lambda: self.nbytes == 0 or self.nbytes + sz <= self.budget)
+        self.stage([p for x in window for p in paths_of(x)])
+        yield from window
+
+    def staged(self, items, paths_of=get_task_paths):
+        # items are staged in windows of at most budget bytes when taken; each item
+        # is to be released by the consumer once done with, and taking the next
+        # window waits for enough of the previous ones to be released
+        window = []
+        sz = 0
+        for x in items:
+            x_sz = sum([self._get_size(p) for p in paths_of(x)])
+            if window and sz + x_sz > self.budget:
+                yield from self._stage_window(window, sz, paths_of)
+                window = []
+                sz = 0
+            window.append(x)
+            sz += x_sz
+        if window:
+            yield from self._stage_window(window, sz, paths_of)
+
+    def close(self):
+        # forked workers share the scratch area with the parent
+        if os.getpid() != self._pid:
+            return
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def find_samples(root):
+    if os.path.isdir(root):
+        return root
+    for ext in ARCHIVE_EXTS:
+        if os.path.isfile(root + ext):
+            return root + ext
+    if os.path.isfile(root) and any(root.endswith(ext) for ext in ARCHIVE_EXTS):
+        return root
+    return None
+
+
+_STORE_TBL = {}
+
+
+def get_store(root):
+    # root is a samples dir, an archive, or a samples dir not extracted from
+    # root.txz next to it
+    try:
+        return _STORE_TBL[root]
+    except KeyError:
+        path = find_samples(root)
+        if path is None:
+            raise FileNotFoundError(f'samples not found: {root}')
+        if os.path.isdir(path):
+            store = DirStore(path)
+        else:
+            store = ArchiveStore(path)
+            atexit.register(store.close)
+            logger.info(f'reading samples from {path} (scratch: {store.scratch})')
+        _STORE_TBL[root] = store
+        return store
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='index a samples archive',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('archive', metavar='ARCHIVE', nargs='?', default='samples.txz',
+                        help='specify samples archive')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    store = get_store(args.archive)
+    for proj in store.projects():
+        print(f'{proj}: {len(store.read_index(proj))} pairs')
+    if isinstance(store, ArchiveStore):
+        print(f'{len(store.members)} members indexed in {store.get_index_path()}')
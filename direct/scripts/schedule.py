@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Cost estimation and longest-first batching of shootout tasks
+
+import os
+import csv
+import heapq
+import logging
+
+logger = logging.getLogger()
+
+# (startup seconds, seconds per KiB of old+new source) used when no timing is available
+DEFAULT_RATE_TBL = {
+    'sloccount': (0.05, 0.0005),
+    'gumtree': (1.0, 0.02),
+    'diffast': (0.2, 0.01),
+}
+
+TIME_KEY_TBL = {
+    'gumtree': 'gt_time',
+    'diffast': 'da_time',
+}
+
+LIGHT_TASK_COST = 1.0
+
+LIGHT_CHUNKSIZE = 4
+
+
+def get_size(task, size=os.path.getsize):
+    sz = 0
+    for k in ('path0', 'path1'):
+        try:
+            sz += size(task[k])
+        except (OSError, KeyError):
+            pass
+    return sz / 1024
+
+
+def load_timings(path, tool, key_fields):
+    tbl = {}
+    time_key = TIME_KEY_TBL.get(tool, None)
+    if time_key is None or not os.path.exists(path):
+        return tbl
+    try:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                if row.get('quick', None):  # the tool was not run
+                    continue
+                try:
+                    tbl[tuple([row[k] for k in key_fields])] = float(row[time_key])
+                except (KeyError, TypeError, ValueError):
+                    pass
+    except Exception as e:
+        logger.warning(f'failed to read {path}: {e}')
+    return tbl
+
+
+def fit_rate(samples, default):
+    n = len(samples)
+    if n < 2:
+        return default
+    mx = sum(x for x, _ in samples) / n
+    my = sum(y for _, y in samples) / n
+    sxx = sum((x - mx) ** 2 for x, _ in samples)
+    if sxx == 0:
+        return default
+    sxy = sum((x - mx) * (y - my) for x, y in samples)
+    a = sxy / sxx
+    b = my - a * mx
+    if a <= 0:
+        return (my, 0.0)
+    return (max(b, 0.0), a)
+
+
+class CostModel(object):
+    # size(path) gives the size of an input, which may not be on disk yet
+    def __init__(self, tool, timings=None, size=os.path.getsize):
+        self.tool = tool
+        self.timings = timings or {}
+        self.size = size
+        self.rate = DEFAULT_RATE_TBL.get(tool, (1.0, 0.01))
+        self.fitted = False
+
+    def fit(self, tasks, key_fields):
+        samples = []
+        for task in tasks:
+            t = self.timings.get(tuple([task[k] for k in key_fields]), None)
+            if t is not None:
+                samples.append((get_size(task, self.size), t))
+        if len(samples) >= 2:
+            self.rate = fit_rate(samples, self.rate)
+            self.fitted = True
+            logger.info(f'{self.tool}: fitted startup={self.rate[0]:.3f}s'
+                        f' rate={self.rate[1]:.5f}s/KiB ({len(samples)} samples)')
+
+    def estimate(self, task, key_fields):
+        t = self.timings.get(tuple([task[k] for k in key_fields]), None)
+        if t is None:
+            startup, rate = self.rate
+            t = startup + rate * get_size(task, self.size)
+        return t
+
+
+def predict_makespan(costs, nprocs):
+    if not costs:
+        return .0
+    loads = [.0] * min(nprocs, len(costs))
+    for c in costs:
+        heapq.heappush(loads, heapq.heappop(loads) + c)
+    return max(loads)
+
+
+def make_batches(tasks, costs, light_cost=LIGHT_TASK_COST, chunksize=LIGHT_CHUNKSIZE):
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    batches = []
+    batch_costs = []
+    batch = []
+    batch_cost = .0
+    for i in order:
+        if costs[i] >= light_cost:
+            batches.append([tasks[i]])
+            batch_costs.append(costs[i])
+        else:
+            batch.append(tasks[i])
+            batch_cost += costs[i]
+            if len(batch) >= chunksize:
+                batches.append(batch)
+                batch_costs.append(batch_cost)
+                batch = []
+                batch_cost = .0
+    if batch:
+        batches.append(batch)
+        batch_costs.append(batch_cost)
+    return batches, batch_costs
@@ -5,14 +5,28 @@ import os
 import csv
 import multiprocessing as mp
 import logging
-
-from common import SLOCCOUNT_CACHE_NAME, NPROCS
+import asyncio
+import time
+import json
+import math
+
+from common import SLOCCOUNT_CACHE_NAME, MEMO_CACHE_NAME, MEMO_CACHE_SIZE, NPROCS
+from common import MEMO_CACHE_BYTES
+from common import GUMTREE_CACHE_NAME, SAME_RESULT, FAILED_RESULT, USAGE_KEYS, quick_compare
 from common import get_time, text_gumtree_sim, text_diffast_sim
+from common import get_gumtree_session, close_gumtree_session
 # from merge_results import merge_results
 # from merge_csvs import merge_csvs
 # from conv_csv import conv_all
 import common
+import samples
 import sloccount
+import schedule
+import trace_report
+import manifest
+from async_driver import AsyncDriver, NPOSTS
+from cache_manager import get_cache_manager, parse_size, EVICT_INTERVAL
+from memo import file_digest
 
 logger = mp.get_logger()
 
@@ -32,94 +46,437 @@ PROJECTS = [
 HEADER = ['commit', 'path', 'old', 'old_sloc', 'new', 'new_sloc',
           'gt_time', 'gt_sim', 'gt_col', 'gt_cost',
           'da_time', 'da_sim', 'da_col', 'da_cost',
-          'ok', 'agree']
+          'ok', 'agree',
+          'gt_utime', 'gt_stime', 'gt_maxrss',
+          'da_utime', 'da_stime', 'da_maxrss', 'quick']
+
+SLOC_HEADER = ['commit', 'path', 'old', 'old_sloc', 'new', 'new_sloc']
+
+GT_HEADER = ['commit', 'path', 'old', 'new', 'gt_time', 'gt_sim', 'gt_col', 'gt_cost',
+             'gt_utime', 'gt_stime', 'gt_maxrss', 'quick']
+
+DA_HEADER = ['commit', 'path', 'old', 'new', 'da_time', 'da_sim', 'da_col', 'da_cost',
+             'da_utime', 'da_stime', 'da_maxrss', 'quick']
+
+# user/sys CPU seconds and peak RSS (KiB) of the external tools, which may be
+# missing from results written before they were recorded
+USAGE_FIELDS = [f'{p}_{k}' for p in ('gt', 'da') for k in USAGE_KEYS]
+
+# 'identical' or 'trivial' for pairs not run through the tools, whose times are
+# those of the check; empty otherwise
+QUICK_FIELD = 'quick'
+
+KEY_FIELDS = ('commit', 'path', 'old', 'new')
+
+# phase timings of a row, written to the trace file instead of the CSV
+TRACE_KEY = '_trace'
+
+TRACE_PATHS = []
 
 
 DIFFAST_SCAN_HUGE_ARRAYS = False
 
+USE_GUMTREE_SESSION = True
 
-def sloccount_proj(root, proj):
-    logger.info(f'proj="{proj}"')
-    print(f'proj="{proj}"')
+USE_EXTERNAL_SLOCCOUNT = True
 
-    outfile = os.path.join(f'out-sloc.{proj}.csv')
+# run pairs with the same old and new contents once
+DEDUP_PAIRS = True
+
+# skip the tools for pairs whose contents are identical or differ only in
+# whitespace and comments
+QUICK_COMPARE = True
+
+
+def get_projects(samples_dir):
+    if samples.find_samples(samples_dir) is None:
+        return PROJECTS
+    return samples.get_store(samples_dir).projects()
+
+
+def gumtree_session():
+    session = None
+    if USE_GUMTREE_SESSION:
+        session = get_gumtree_session()
+    return session
+
+
+# keys of the pairs short-circuited by kind, counted once for all tools
+QUICK_TBL = {}
+
+
+def quick_result(path0, path1):
+    if not QUICK_COMPARE:
+        return None
+    kind = quick_compare(path0, path1)
+    if kind is None:
+        return None
+    logger.info(f'{kind}: {path0} {path1}')
+    return dict(SAME_RESULT, quick=kind)
+
+
+def note_quick(row):
+    kind = row.get(QUICK_FIELD, None)
+    if kind:
+        QUICK_TBL.setdefault(kind, set()).add(get_key(row))
+
+
+def set_usage(row, prefix, r):
+    for k in USAGE_KEYS:
+        row[f'{prefix}_{k}'] = round(r.get(k, 0), 6)
 
-    with open(outfile, 'w', newline='') as outf:
-        header = ['commit', 'path', 'old', 'old_sloc', 'new', 'new_sloc']
 
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
+def set_trace(row, tool, r, tm):
+    if common.TRACING:
+        rec = {'tool': tool, 'time': tm, 'spans': r.get('spans', {})}
+        if 'py_peak' in r:
+            rec['py_peak'] = r['py_peak']
+        row.setdefault(TRACE_KEY, []).append(rec)
 
-        d = os.path.join(root, proj)
-        d0 = os.path.join(d, '0')
-        d1 = os.path.join(d, '1')
 
-        with open(os.path.join(d, 'index.csv'), newline='') as idxf:
-            for ex in csv.DictReader(idxf):
-                commit = ex['commit']
-                path = ex['path']
-                fn0 = ex['old']
-                fn1 = ex['new']
+def report_stats(tbl=QUICK_TBL):
+    nidentical = len(tbl.get('identical', ()))
+    ntrivial = len(tbl.get('trivial', ()))
+    n = nidentical + ntrivial
+    if n:
+        mes = f'{n} pairs short-circuited (identical={nidentical} trivial={ntrivial})'
+        logger.info(mes)
+        print(mes)
 
-                path0 = os.path.join(d0, fn0)
-                path1 = os.path.join(d1, fn1)
 
-                old_sloc = sloccount.sloccount_for_lang('java', path0)
-                new_sloc = sloccount.sloccount_for_lang('java', path1)
+def get_sloc(path, datadir=None):
+    if USE_EXTERNAL_SLOCCOUNT:
+        return common.memoize('sloc', path,
+                              lambda p: sloccount.sloccount_for_lang('java', p, datadir=datadir),
+                              'java')
+    return common.memoize('sloc', path, lambda p: sloccount.count_sloc(p, 'java'),
+                          'java', 'native')
 
-                row = {'commit': commit, 'path': path,
-                       'old': fn0, 'old_sloc': old_sloc,
-                       'new': fn1, 'new_sloc': new_sloc}
 
+def get_key(row):
+    return tuple([row[k] for k in KEY_FIELDS])
+
+
+TOOL_STAMP_TBL = {}
+
+
+def get_binary_version(path):
+    try:
+        return file_digest(path)[:12]
+    except OSError:
+        return 'unknown'
+
+
+def get_tool_stamp(tool, no_rr=False):
+    # versions and options of a tool that its results depend on
+    key = (tool, no_rr)
+    try:
+        return TOOL_STAMP_TBL[key]
+    except KeyError:
+        pass
+    if tool == 'sloccount':
+        if USE_EXTERNAL_SLOCCOUNT:
+            stamp = {'sloccount': 'external'}
+        else:
+            stamp = {'sloccount': 'native-' + get_binary_version(sloccount.__file__)}
+    elif tool == 'gumtree':
+        stamp = {'gumtree': common.get_gumtree_version(common.GUMTREE_DIR),
+                 'gt_matcher': common.GUMTREE_MATCHER}
+    else:
+        opts = common.diffast_archive_opts(keep_going=True,
+                                           scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
+                                           no_rr=no_rr, weak=True)
+        stamp = {'diffast': get_binary_version(common.SIMAST_CMD), 'da_opts': opts}
+    TOOL_STAMP_TBL[key] = stamp
+    return stamp
+
+
+def get_fingerprint(root, proj, tools, no_rr=False):
+    # returns a function giving the manifest entry of a row of proj
+    store = samples.get_store(root)
+    keys = set([get_key(ex) for ex in store.read_index(proj)])
+    stamp = {}
+    for tool in tools:
+        stamp.update(get_tool_stamp(tool, no_rr=no_rr))
+
+    def fingerprint(row):
+        if get_key(row) not in keys:  # removed from index.csv
+            return None
+        if not QUICK_COMPARE and row.get(QUICK_FIELD, None):
+            return None
+        entry = {'old_digest': store.digest(store.get_path(proj, '0', row['old'])),
+                 'new_digest': store.digest(store.get_path(proj, '1', row['new']))}
+        entry.update(stamp)
+        return entry
+
+    return fingerprint
+
+
+def dedup_tasks(store, tasks, key_of=get_key):
+    # returns the tasks to run and a table of the tasks with the same contents
+    # as each of them, keyed by key_of
+    if not DEDUP_PAIRS:
+        return tasks, {}
+    rep_tbl = {}
+    dups_tbl = {}
+    uniq = []
+    for task in tasks:
+        try:
+            d = (store.digest(task['path0']), store.digest(task['path1']))
+        except Exception as e:
+            logger.warning(f'failed to hash {task["path0"]} {task["path1"]}: {e}')
+            uniq.append(task)
+            continue
+        rep = rep_tbl.get(d, None)
+        if rep is None:
+            rep_tbl[d] = task
+            uniq.append(task)
+        else:
+            dups_tbl.setdefault(key_of(rep), []).append(task)
+    ndups = len(tasks) - len(uniq)
+    if ndups:
+        mes = f'{ndups} duplicate pairs (same contents as another pair) to be reused'
+        logger.info(mes)
+        print(mes)
+    return uniq, dups_tbl
+
+
+def fan_out(row, dups):
+    # rows of the duplicates of the pair of row
+    rows = []
+    for task in dups:
+        r = dict(row)
+        r.pop(TRACE_KEY, None)
+        for k in KEY_FIELDS:
+            r[k] = task[k]
+        rows.append(r)
+    return rows
+
+
+def load_rows(path, header):
+    rows = []
+    with open(path, newline='') as f:
+        lines = f.readlines()
+    if lines and not lines[-1].endswith('\n'):  # interrupted while writing
+        logger.warning(f'incomplete line ignored: {lines[-1]}')
+        del lines[-1]
+    for row in csv.DictReader(lines):
+        for k in USAGE_FIELDS + [QUICK_FIELD]:
+            if k in header and k not in row:
+                row[k] = ''
+        if None in row or any([row.get(k, None) is None for k in header]):
+            logger.warning(f'incomplete row ignored: {row}')
+            continue
+        rows.append(row)
+    return rows
+
+
+class ResultWriter(object):
+    # fingerprint(row) returns the manifest entry of row. With incremental, rows of
+    # the previous run are kept only if their entries are unchanged
+    def __init__(self, outfile, header, resume=False, trace=False, fingerprint=None,
+                 incremental=False):
+        self.outfile = outfile
+        self.header = header
+        self.fingerprint = fingerprint
+        self.done = set()
+
+        rows = []
+        if (resume or incremental) and os.path.exists(outfile):
+            rows = load_rows(outfile, header)
+            logger.info(f'{len(rows)} rows found in {outfile}')
+            print(f'{len(rows)} rows found in {outfile}')
+
+        self._manifest = None
+        if fingerprint is not None:
+            manifest_path = manifest.get_manifest_path(outfile)
+            entries = {}
+            if resume or incremental:
+                entries = manifest.load_manifest(manifest_path, KEY_FIELDS)
+            if incremental:
+                rows = [row for row in rows if self.is_fresh(row, entries)]
+                mes = f'{len(rows)} rows up to date in {outfile}'
+                logger.info(mes)
+                print(mes)
+            keys = set([get_key(row) for row in rows])
+            entries = dict([(k, e) for k, e in entries.items() if k in keys])
+            self._manifest = manifest.Manifest(manifest_path, KEY_FIELDS, entries)
+
+        self.done = set([get_key(row) for row in rows])
+
+        tmp = outfile + '.tmp'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=header)
+            writer.writeheader()
+            for row in rows:
                 writer.writerow(row)
+        os.replace(tmp, outfile)
+
+        self._f = open(outfile, 'a', newline='')
+        self._writer = csv.DictWriter(self._f, fieldnames=header)
+
+        self._trace_f = None
+        if trace:
+            trace_path = trace_report.get_trace_path(outfile)
+            self._trace_f = open(trace_path, 'a' if resume or incremental else 'w',
+                                 encoding='utf-8')
+            if trace_path not in TRACE_PATHS:
+                TRACE_PATHS.append(trace_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_done(self, task):
+        return get_key(task) in self.done
+
+    def get_entry(self, row):
+        try:
+            return self.fingerprint(row)
+        except Exception as e:
+            logger.warning(f'failed to fingerprint {get_key(row)}: {e}')
+            return None
+
+    def is_fresh(self, row, entries):
+        entry = entries.get(get_key(row), None)
+        return entry is not None and entry == self.get_entry(row)
+
+    def writerows(self, row, dups=()):
+        rows = fan_out(row, dups)
+        note_quick(row)
+        self.writerow(row)
+        for r in rows:
+            self.writerow(r)
+
+    def writerow(self, row):
+        recs = row.pop(TRACE_KEY, [])
+        self._writer.writerow(row)
+        self._f.flush()
+        self.done.add(get_key(row))
+        if self._manifest is not None:
+            entry = self.get_entry(row)
+            if entry is not None:
+                self._manifest.write(get_key(row), entry)
+        if self._trace_f is not None:
+            for rec in recs:
+                d = dict([(k, row[k]) for k in KEY_FIELDS])
+                d.update(rec)
+                self._trace_f.write(json.dumps(d) + '\n')
+            self._trace_f.flush()
+
+    def close(self):
+        self._f.close()
+        if self._trace_f is not None:
+            self._trace_f.close()
+        if self._manifest is not None:
+            self._manifest.close()
+        logger.info(f'results dumped into {self.outfile}')
+
+
+def sloccount_proj(root, proj, resume=False, incremental=False):
+    logger.info(f'proj="{proj}"')
+    print(f'proj="{proj}"')
+
+    outfile = os.path.join(f'out-sloc.{proj}.csv')
+
+    store = samples.get_store(root)
+
+    sloc_tbl = {}
+    if not USE_EXTERNAL_SLOCCOUNT and store.get_dir(proj) is not None:
+        for path, (_, sloc) in sloccount.sloccount_dir(store.get_dir(proj),
+                                                       langs=['java']).items():
+            sloc_tbl[os.path.normpath(path)] = sloc
 
-        logger.info(f'results dumped into {outfile}')
+    with ResultWriter(outfile, SLOC_HEADER, resume=resume,
+                      fingerprint=get_fingerprint(root, proj, ['sloccount']),
+                      incremental=incremental) as writer:
+
+        tasks = [t for t in get_tasks(root, proj) if not writer.is_done(t)]
+        tasks, dups_tbl = dedup_tasks(store, tasks)
+
+        for task in store.staged(tasks):
+            old_sloc = sloc_tbl.get(os.path.normpath(task['path0']), None)
+            if old_sloc is None:
+                old_sloc = get_sloc(task['path0'])
+            new_sloc = sloc_tbl.get(os.path.normpath(task['path1']), None)
+            if new_sloc is None:
+                new_sloc = get_sloc(task['path1'])
+
+            row = {'commit': task['commit'], 'path': task['path'],
+                   'old': task['old'], 'old_sloc': old_sloc,
+                   'new': task['new'], 'new_sloc': new_sloc}
+
+            writer.writerows(row, dups_tbl.get(get_key(task), []))
+            store.release(samples.get_task_paths(task))
 
 
 def get_tasks(root, proj, no_rr=False, use_cache=False, cache_dir=None):
 
     tasks = []
 
-    d = os.path.join(root, proj)
-    d0 = os.path.join(d, '0')
-    d1 = os.path.join(d, '1')
+    # files of an archived store only exist while staged
+    store = samples.get_store(root)
 
-    with open(os.path.join(d, 'index.csv'), newline='') as idxf:
-        for ex in csv.DictReader(idxf):
-            commit = ex['commit']
-            path = ex['path']
-            fn0 = ex['old']
-            fn1 = ex['new']
-            logger.info(f'{fn0}')
-            logger.info(f' --> {fn1}')
-            path0 = os.path.join(d0, fn0)
-            path1 = os.path.join(d1, fn1)
+    for ex in store.read_index(proj):
+        commit = ex['commit']
+        path = ex['path']
+        fn0 = ex['old']
+        fn1 = ex['new']
+        logger.info(f'{fn0}')
+        logger.info(f' --> {fn1}')
+        path0 = store.get_path(proj, '0', fn0)
+        path1 = store.get_path(proj, '1', fn1)
 
-            task = {'commit': commit, 'path': path, 'old': fn0, 'new': fn1,
-                    'path0': path0, 'path1': path1}
+        task = {'commit': commit, 'path': path, 'old': fn0, 'new': fn1,
+                'path0': path0, 'path1': path1}
 
-            if no_rr:
-                task['no_rr'] = True
+        if no_rr:
+            task['no_rr'] = True
 
-            if use_cache:
-                task['use_cache'] = True
+        if use_cache:
+            task['use_cache'] = True
 
-            if cache_dir:
-                task['cache_dir'] = cache_dir
+        if cache_dir:
+            task['cache_dir'] = cache_dir
 
-            tasks.append(task)
+        tasks.append(task)
 
     return tasks
 
 
+def run_tasks_mp(wrapper, tasks, writer, store, nprocs=1):
+    tasks = [t for t in tasks if not writer.is_done(t)]
+    tasks, dups_tbl = dedup_tasks(store, tasks)
+    ntasks = len(tasks)
+
+    print(f'{ntasks} tasks to run')
+
+    if ntasks == 0:
+        return
+
+    paths_tbl = dict([(get_key(t), samples.get_task_paths(t)) for t in tasks])
+
+    nrows = 0
+
+    with mp.Pool(nprocs) as pool:
+        for row in pool.imap_unordered(wrapper, store.staged(tasks), 4):
+            key = get_key(row)
+            writer.writerows(row, dups_tbl.get(key, []))
+            store.release(paths_tbl[key])
+            nrows += 1
+            sys.stdout.write(' {:2.2f}%\r'.format(nrows*100/ntasks))
+
+
 def sloccount_wrapper(task):
     path0 = task['path0']
     path1 = task['path1']
     pid = os.getpid()
     datadir0 = os.path.join(SLOCCOUNT_CACHE_NAME, f'{pid}-0')
     datadir1 = os.path.join(SLOCCOUNT_CACHE_NAME, f'{pid}-1')
-    sloc0 = sloccount.sloccount_for_lang('java', path0, datadir=datadir0)
-    sloc1 = sloccount.sloccount_for_lang('java', path1, datadir=datadir1)
+    sloc0 = get_sloc(path0, datadir=datadir0)
+    sloc1 = get_sloc(path1, datadir=datadir1)
     row = dict(task)
     del row['path0']
     del row['path1']
@@ -128,7 +485,7 @@ def sloccount_wrapper(task):
     return row
 
 
-def sloccount_proj_mp(root, proj, nprocs=1):
+def sloccount_proj_mp(root, proj, nprocs=1, resume=False):
     logger.info(f'proj="{proj}" nprocs={nprocs}')
     print(f'proj="{proj}" nprocs={nprocs}')
 
@@ -140,192 +497,128 @@ def sloccount_proj_mp(root, proj, nprocs=1):
 
     print(f'{ntasks} tasks found')
 
-    rows = []
-
-    with mp.Pool(nprocs) as pool:
-        for row in pool.imap(sloccount_wrapper, tasks, 4):
-            rows.append(row)
-            nrows = len(rows)
-            sys.stdout.write(' {:2.2f}%\r'.format(nrows*100/ntasks))
-
     outfile = os.path.join(f'out-sloc.{proj}.csv')
     print(f'dumping into {outfile}...')
-    with open(outfile, 'w', newline='') as outf:
-
-        header = ['commit', 'path', 'old', 'old_sloc', 'new', 'new_sloc']
-
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
 
-        for row in rows:
-            writer.writerow(row)
+    with ResultWriter(outfile, SLOC_HEADER, resume=resume,
+                      fingerprint=get_fingerprint(root, proj, ['sloccount'])) as writer:
+        run_tasks_mp(sloccount_wrapper, tasks, writer, samples.get_store(root), nprocs=nprocs)
 
-        logger.info(f'results dumped into {outfile}')
 
-
-def shootout1(root, proj, no_rr=False, use_cache=True, cache_dir='CACHE'):
+def shootout1(root, proj, no_rr=False, use_cache=True, cache_dir='CACHE', resume=False,
+              incremental=False):
     logger.info(f'proj="{proj}"')
     print(f'proj="{proj}"')
 
     outfile = os.path.join(f'out-{proj}.csv')
 
-    with open(outfile, 'w', newline='') as outf:
-
-        header = HEADER
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
-
-        d = os.path.join(root, proj)
-        d0 = os.path.join(d, '0')
-        d1 = os.path.join(d, '1')
-
-        with open(os.path.join(d, 'index.csv'), newline='') as idxf:
-            for ex in csv.DictReader(idxf):
-                commit = ex['commit']
-                path = ex['path']
-                fn0 = ex['old']
-                fn1 = ex['new']
-                logger.info(f'{fn0}')
-                logger.info(f' --> {fn1}')
-                path0 = os.path.join(d0, fn0)
-                path1 = os.path.join(d1, fn1)
-
-                old_sloc = sloccount.sloccount_for_lang('java', path0)
-                new_sloc = sloccount.sloccount_for_lang('java', path1)
-
-                st_time = get_time()
-                r = text_gumtree_sim(path0, path1)
-                gt_sim = r['similarity']
-                gt_col = r['colored']
-                gt_cost = r['cost']
-                gt_time = get_time() - st_time
-                logger.info(f'gt_time={gt_time}')
-
-                st_time = get_time()
-                r = text_diffast_sim(path0, path1, keep_going=True,
-                                     scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
-                                     no_rr=no_rr,
-                                     weak=True,
-                                     use_cache=use_cache, cache_dir=cache_dir)
-                da_sim = r['similarity']
-                da_col = r['colored']
-                da_cost = r['cost']
-                da_time = get_time() - st_time
-                logger.info(f'da_time={da_time}')
-
-                ok = gt_sim <= da_sim and gt_col >= da_col
-                agree = gt_sim == da_sim and gt_col == da_col
-                row = {'commit': commit, 'path': path,
-                       'old': fn0, 'old_sloc': old_sloc,
-                       'new': fn1, 'new_sloc': new_sloc,
-                       'gt_time': gt_time, 'gt_sim': gt_sim, 'gt_col': gt_col,
-                       'gt_cost': gt_cost,
-                       'da_time': da_time, 'da_sim': da_sim, 'da_col': da_col,
-                       'da_cost': da_cost,
-                       'ok': ok, 'agree': agree}
-                writer.writerow(row)
-
-        logger.info(f'results dumped into {outfile}')
-
-
-def gt_proj(root, proj):
+    store = samples.get_store(root)
+
+    fingerprint = get_fingerprint(root, proj, ['sloccount', 'gumtree', 'diffast'], no_rr=no_rr)
+
+    with ResultWriter(outfile, HEADER, resume=resume, trace=common.TRACING,
+                      fingerprint=fingerprint, incremental=incremental) as writer:
+
+        tasks = [t for t in get_tasks(root, proj) if not writer.is_done(t)]
+        tasks, dups_tbl = dedup_tasks(store, tasks)
+
+        for task in store.staged(tasks):
+            path0 = task['path0']
+            path1 = task['path1']
+
+            old_sloc = get_sloc(path0)
+            new_sloc = get_sloc(path1)
+
+            # checked once for both tools, whose times include that of the check
+            st_time = get_time()
+            quick_r = quick_result(path0, path1)
+            quick_time = get_time() - st_time
+
+            st_time = get_time()
+            r = quick_r
+            if r is None:
+                r = common.traced(text_gumtree_sim, path0, path1, session=gumtree_session())
+            gt_sim = r['similarity']
+            gt_col = r['colored']
+            gt_cost = r['cost']
+            gt_r = r
+            gt_time = quick_time + get_time() - st_time
+            logger.info(f'gt_time={gt_time}')
+
+            st_time = get_time()
+            r = quick_r
+            if r is None:
+                r = common.traced(text_diffast_sim, path0, path1, keep_going=True,
+                                  scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
+                                  no_rr=no_rr,
+                                  weak=True,
+                                  use_cache=use_cache, cache_dir=cache_dir)
+            da_sim = r['similarity']
+            da_col = r['colored']
+            da_cost = r['cost']
+            da_time = quick_time + get_time() - st_time
+            logger.info(f'da_time={da_time}')
+
+            ok = gt_sim <= da_sim and gt_col >= da_col
+            agree = gt_sim == da_sim and gt_col == da_col
+            row = {'commit': task['commit'], 'path': task['path'],
+                   'old': task['old'], 'old_sloc': old_sloc,
+                   'new': task['new'], 'new_sloc': new_sloc,
+                   'gt_time': gt_time, 'gt_sim': gt_sim, 'gt_col': gt_col,
+                   'gt_cost': gt_cost,
+                   'da_time': da_time, 'da_sim': da_sim, 'da_col': da_col,
+                   'da_cost': da_cost,
+                   'ok': ok, 'agree': agree,
+                   QUICK_FIELD: r.get('quick', '')}
+            set_usage(row, 'gt', gt_r)
+            set_usage(row, 'da', r)
+            set_trace(row, 'gumtree', gt_r, gt_time)
+            set_trace(row, 'diffast', r, da_time)
+            writer.writerows(row, dups_tbl.get(get_key(task), []))
+            store.release(samples.get_task_paths(task))
+
+
+def gt_proj(root, proj, resume=False, incremental=False):
     logger.info(f'proj="{proj}"')
     print(f'proj="{proj}"')
 
     outfile = os.path.join(f'out-gumtree.{proj}.csv')
 
-    with open(outfile, 'w', newline='') as outf:
-
-        header = ['commit', 'path', 'old', 'new',
-                  'gt_time', 'gt_sim', 'gt_col', 'gt_cost']
-
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
-
-        d = os.path.join(root, proj)
-        d0 = os.path.join(d, '0')
-        d1 = os.path.join(d, '1')
-
-        with open(os.path.join(d, 'index.csv'), newline='') as idxf:
-            for ex in csv.DictReader(idxf):
-                commit = ex['commit']
-                path = ex['path']
-                fn0 = ex['old']
-                fn1 = ex['new']
-                logger.info(f'{fn0}')
-                logger.info(f' --> {fn1}')
-                path0 = os.path.join(d0, fn0)
-                path1 = os.path.join(d1, fn1)
-
-                st_time = get_time()
-                r = text_gumtree_sim(path0, path1)
-                gt_sim = r['similarity']
-                gt_col = r['colored']
-                gt_cost = r['cost']
-                gt_time = get_time() - st_time
-                logger.info(f'gt_time={gt_time}')
-
-                row = {'commit': commit, 'path': path,
-                       'old': fn0, 'new': fn1,
-                       'gt_time': gt_time, 'gt_sim': gt_sim, 'gt_col': gt_col,
-                       'gt_cost': gt_cost
-                       }
+    store = samples.get_store(root)
 
-                writer.writerow(row)
+    with ResultWriter(outfile, GT_HEADER, resume=resume, trace=common.TRACING,
+                      fingerprint=get_fingerprint(root, proj, ['gumtree']),
+                      incremental=incremental) as writer:
 
-        logger.info(f'results dumped into {outfile}')
+        tasks = [t for t in get_tasks(root, proj) if not writer.is_done(t)]
+        tasks, dups_tbl = dedup_tasks(store, tasks)
 
+        for task in store.staged(tasks):
+            writer.writerows(gt_wrapper(task), dups_tbl.get(get_key(task), []))
+            store.release(samples.get_task_paths(task))
 
-def diffast_proj(root, proj, no_rr=False, use_cache=True, cache_dir=None):
+
+def diffast_proj(root, proj, no_rr=False, use_cache=True, cache_dir=None, resume=False,
+                 incremental=False):
     logger.info(f'proj="{proj}"')
     print(f'proj="{proj}"')
 
     outfile = os.path.join(f'out-diffast.{proj}.csv')
 
-    with open(outfile, 'w', newline='') as outf:
-
-        header = ['commit', 'path', 'old', 'new',
-                  'da_time', 'da_sim', 'da_col', 'da_cost']
-
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
-
-        d = os.path.join(root, proj)
-        d0 = os.path.join(d, '0')
-        d1 = os.path.join(d, '1')
-
-        with open(os.path.join(d, 'index.csv'), newline='') as idxf:
-            for ex in csv.DictReader(idxf):
-                commit = ex['commit']
-                path = ex['path']
-                fn0 = ex['old']
-                fn1 = ex['new']
-                logger.info(f'{fn0}')
-                logger.info(f' --> {fn1}')
-                path0 = os.path.join(d0, fn0)
-                path1 = os.path.join(d1, fn1)
-
-                st_time = get_time()
-                r = text_diffast_sim(path0, path1, keep_going=True,
-                                     scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
-                                     no_rr=no_rr,
-                                     weak=True,
-                                     use_cache=use_cache, cache_dir=cache_dir)
-                da_sim = r['similarity']
-                da_col = r['colored']
-                da_cost = r['cost']
-                da_time = get_time() - st_time
-                logger.info(f'da_time={da_time}')
-
-                row = {'commit': commit, 'path': path,
-                       'old': fn0, 'new': fn1,
-                       'da_time': da_time, 'da_sim': da_sim, 'da_col': da_col,
-                       'da_cost': da_cost,
-                       }
+    store = samples.get_store(root)
 
-                writer.writerow(row)
+    with ResultWriter(outfile, DA_HEADER, resume=resume, trace=common.TRACING,
+                      fingerprint=get_fingerprint(root, proj, ['diffast'], no_rr=no_rr),
+                      incremental=incremental) as writer:
+
+        tasks = [t for t in get_tasks(root, proj, no_rr=no_rr, use_cache=use_cache,
+                                      cache_dir=cache_dir)
+                 if not writer.is_done(t)]
+        tasks, dups_tbl = dedup_tasks(store, tasks)
 
-        logger.info(f'results dumped into {outfile}')
+        for task in store.staged(tasks):
+            writer.writerows(simast_wrapper(task), dups_tbl.get(get_key(task), []))
+            store.release(samples.get_task_paths(task))
 
 
 def simast_wrapper(task):
@@ -335,15 +628,22 @@ def simast_wrapper(task):
     use_cache = task.get('use_cache', False)
     cache_dir = task.get('cache_dir', None)
     st_time = get_time()
-    r = text_diffast_sim(path0, path1, keep_going=True,
-                         scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
-                         no_rr=no_rr,
-                         weak=True,
-                         use_cache=use_cache, cache_dir=cache_dir)
+    r = quick_result(path0, path1)
+    if r is None:
+        r = common.traced(text_diffast_sim, path0, path1, keep_going=True,
+                          scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
+                          no_rr=no_rr,
+                          weak=True,
+                          use_cache=use_cache, cache_dir=cache_dir)
+    da_time = get_time() - st_time
+    logger.info(f'da_time={da_time}')
+    return simast_row(task, r, da_time)
+
+
+def simast_row(task, r, da_time):
     da_sim = r['similarity']
     da_col = r['colored']
     da_cost = r['cost']
-    da_time = get_time() - st_time
     row = dict(task)
     del row['path0']
     del row['path1']
@@ -351,6 +651,9 @@ def simast_wrapper(task):
     row['da_sim'] = da_sim
     row['da_col'] = da_col
     row['da_cost'] = da_cost
+    row[QUICK_FIELD] = r.get('quick', '')
+    set_usage(row, 'da', r)
+    set_trace(row, 'diffast', r, da_time)
     try:
         del row['no_rr']
     except Exception:
@@ -366,7 +669,8 @@ def simast_wrapper(task):
     return row
 
 
-def diffast_proj_mp(root, proj, no_rr=False, use_cache=False, nprocs=1, cache_dir=None):
+def diffast_proj_mp(root, proj, no_rr=False, use_cache=False, nprocs=1, cache_dir=None,
+                    resume=False):
     logger.info(f'proj="{proj}" nprocs={nprocs}')
     print(f'proj="{proj}" nprocs={nprocs}')
 
@@ -375,42 +679,36 @@ def diffast_proj_mp(root, proj, no_rr=False, use_cache=False, nprocs=1, cache_di
     ntasks = len(tasks)
     print(f'{ntasks} tasks found')
 
-    rows = []
-
     st_time = get_time()
 
-    with mp.Pool(nprocs) as pool:
-        for row in pool.imap(simast_wrapper, tasks, 4):
-            rows.append(row)
-            nrows = len(rows)
-            sys.stdout.write(' {:2.2f}%\r'.format(nrows*100/ntasks))
-
-    tm = get_time() - st_time
-
-    print(f'processed in {tm/60:.2f} min.')
-
     outfile = os.path.join(f'out-diffast.{proj}.csv')
     print(f'dumping into {outfile}...')
-    with open(outfile, 'w', newline='') as outf:
 
-        header = ['commit', 'path', 'old', 'new', 'da_time', 'da_sim', 'da_col', 'da_cost']
+    with ResultWriter(outfile, DA_HEADER, resume=resume, trace=common.TRACING,
+                      fingerprint=get_fingerprint(root, proj, ['diffast'], no_rr=no_rr)) as writer:
+        run_tasks_mp(simast_wrapper, tasks, writer, samples.get_store(root), nprocs=nprocs)
 
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
+    tm = get_time() - st_time
 
-        for row in rows:
-            writer.writerow(row)
+    print(f'processed in {tm/60:.2f} min.')
 
 
 def gt_wrapper(task):
     path0 = task['path0']
     path1 = task['path1']
     st_time = get_time()
-    r = text_gumtree_sim(path0, path1)
+    r = quick_result(path0, path1)
+    if r is None:
+        r = common.traced(text_gumtree_sim, path0, path1, session=gumtree_session())
+    gt_time = get_time() - st_time
+    logger.info(f'gt_time={gt_time}')
+    return gt_row(task, r, gt_time)
+
+
+def gt_row(task, r, gt_time):
     gt_sim = r['similarity']
     gt_col = r['colored']
     gt_cost = r['cost']
-    gt_time = get_time() - st_time
     row = dict(task)
     del row['path0']
     del row['path1']
@@ -418,10 +716,13 @@ def gt_wrapper(task):
     row['gt_sim'] = gt_sim
     row['gt_col'] = gt_col
     row['gt_cost'] = gt_cost
+    row[QUICK_FIELD] = r.get('quick', '')
+    set_usage(row, 'gt', r)
+    set_trace(row, 'gumtree', r, gt_time)
     return row
 
 
-def gt_proj_mp(root, proj, nprocs=1):
+def gt_proj_mp(root, proj, nprocs=1, resume=False):
     logger.info(f'proj="{proj}" nprocs={nprocs}')
     print(f'proj="{proj}" nprocs={nprocs}')
 
@@ -430,25 +731,311 @@ def gt_proj_mp(root, proj, nprocs=1):
     ntasks = len(tasks)
     print(f'{ntasks} tasks found')
 
-    rows = []
+    outfile = os.path.join(f'out-gumtree.{proj}.csv')
+    print(f'dumping into {outfile}...')
 
-    with mp.Pool(nprocs) as pool:
-        for row in pool.imap(gt_wrapper, tasks, 4):
-            rows.append(row)
-            nrows = len(rows)
+    with ResultWriter(outfile, GT_HEADER, resume=resume, trace=common.TRACING,
+                      fingerprint=get_fingerprint(root, proj, ['gumtree'])) as writer:
+        run_tasks_mp(gt_wrapper, tasks, writer, samples.get_store(root), nprocs=nprocs)
+
+
+OUTFILE_FMT_TBL = {
+    'sloccount': 'out-sloc.{}.csv',
+    'gumtree': 'out-gumtree.{}.csv',
+    'diffast': 'out-diffast.{}.csv',
+}
+
+HEADER_TBL = {
+    'sloccount': SLOC_HEADER,
+    'gumtree': GT_HEADER,
+    'diffast': DA_HEADER,
+}
+
+
+def get_wrapper(tool):
+    return {'sloccount': sloccount_wrapper,
+            'gumtree': gt_wrapper,
+            'diffast': simast_wrapper}[tool]
+
+
+def run_task(task):
+    task = dict(task)
+    tool = task.pop('tool')
+    proj = task.pop('proj')
+    row = get_wrapper(tool)(task)
+    return {'tool': tool, 'proj': proj, 'row': row}
+
+
+def run_batch(tasks):
+    return [run_task(task) for task in tasks]
+
+
+def evict_diffast_cache(cache_dir, cache_budget, compact=False):
+    if cache_dir is None or cache_budget is None:
+        return
+    manager = get_cache_manager(cache_dir)
+    if compact:
+        manager.compact()
+    manager.evict(cache_budget)
+
+
+def collect_tasks(root, projs, tools, writer_tbl, remaining_tbl, dups_tbl, no_rr=False,
+                  use_cache=False, cache_dir=None, resume=False, incremental=False,
+                  cost_order=True):
+    tasks = []
+    costs = []
+
+    store = samples.get_store(root)
+
+    for tool in tools:
+        tool_tasks = []
+        cost_tbl = {}
+
+        for proj in projs:
+            outfile = OUTFILE_FMT_TBL[tool].format(proj)
+
+            timings = {}
+            if cost_order:
+                timings = schedule.load_timings(outfile, tool, KEY_FIELDS)
+
+            writer = ResultWriter(outfile, HEADER_TBL[tool], resume=resume,
+                                  trace=common.TRACING and tool != 'sloccount',
+                                  fingerprint=get_fingerprint(root, proj, [tool], no_rr=no_rr),
+                                  incremental=incremental)
+            writer_tbl[(tool, proj)] = writer
+
+            if tool == 'diffast':
+                tl = get_tasks(root, proj,
+                               no_rr=no_rr, use_cache=use_cache, cache_dir=cache_dir)
+            else:
+                tl = get_tasks(root, proj)
+
+            model = schedule.CostModel(tool, timings, size=store.size)
+            if cost_order:
+                model.fit(tl, KEY_FIELDS)
+
+            count = 0
+            for task in tl:
+                if not writer.is_done(task):
+                    task['tool'] = tool
+                    task['proj'] = proj
+                    if cost_order:
+                        cost_tbl[get_task_key(task)] = model.estimate(task, KEY_FIELDS)
+                    tool_tasks.append(task)
+                    count += 1
+
+            remaining_tbl[(tool, proj)] = count
+            logger.info(f'{tool}: proj="{proj}": {count} tasks')
+
+        # duplicates may span projects
+        tool_tasks, tbl = dedup_tasks(store, tool_tasks, key_of=get_task_key)
+        dups_tbl.update(tbl)
+        tasks.extend(tool_tasks)
+        if cost_order:
+            tool_costs = [cost_tbl[get_task_key(t)] for t in tool_tasks]
+            if len(tool_costs) > 1 and len(set(tool_costs)) == 1:
+                logger.warning(f'{tool}: all {len(tool_costs)} tasks estimated at the same cost')
+            costs.extend(tool_costs)
+
+    return tasks, costs
+
+
+def get_task_key(task):
+    return (task['tool'], task['proj']) + get_key(task)
+
+
+def write_result(r, writer_tbl, remaining_tbl, dups_tbl):
+    # writes the row of a result and those of its duplicates
+    dups = dups_tbl.get((r['tool'], r['proj']) + get_key(r['row']), [])
+    note_quick(r['row'])
+    rows = [(r['proj'], r['row'])] + list(zip([t['proj'] for t in dups], fan_out(r['row'], dups)))
+    for proj, row in rows:
+        key = (r['tool'], proj)
+        writer_tbl[key].writerow(row)
+        remaining_tbl[key] -= 1
+        if remaining_tbl[key] == 0:
+            logger.info('{}: proj="{}": done'.format(*key))
+            sys.stdout.write('{}: proj="{}": done\n'.format(*key))
+
+
+def shootout_mp(root, projs, tools, no_rr=False, use_cache=False, nprocs=1, cache_dir=None,
+                resume=False, incremental=False, cost_order=True, cache_budget=None):
+    logger.info(f'projs={projs} tools={tools} nprocs={nprocs}')
+    print(f'{len(projs)} projects, tools: {", ".join(tools)}, nprocs={nprocs}')
+
+    if 'sloccount' in tools and USE_EXTERNAL_SLOCCOUNT and not os.path.exists(SLOCCOUNT_CACHE_NAME):
+        os.makedirs(SLOCCOUNT_CACHE_NAME)
+
+    writer_tbl = {}
+    remaining_tbl = {}
+    dups_tbl = {}
+
+    try:
+        tasks, costs = collect_tasks(root, projs, tools, writer_tbl, remaining_tbl, dups_tbl,
+                                     no_rr=no_rr, use_cache=use_cache, cache_dir=cache_dir,
+                                     resume=resume, incremental=incremental,
+                                     cost_order=cost_order)
+
+        ntasks = len(tasks)
+        print(f'{ntasks} tasks to run')
+
+        if ntasks == 0:
+            return
+
+        predicted = None
+        if cost_order:
+            batches, batch_costs = schedule.make_batches(tasks, costs)
+            predicted = schedule.predict_makespan(batch_costs, nprocs)
+            logger.info(f'{len(batches)} batches, predicted makespan: {predicted:.2f}s')
+        else:
+            batches = [tasks[i:i+4] for i in range(0, ntasks, 4)]
+
+        store = samples.get_store(root)
+        paths_tbl = dict([((t['proj'],) + get_key(t), samples.get_task_paths(t)) for t in tasks])
+
+        st_time = get_time()
+        nrows = 0
+
+        with mp.Pool(nprocs) as pool:
+            staged = store.staged(batches,
+                                  paths_of=lambda b: [p for t in b
+                                                      for p in samples.get_task_paths(t)])
+            for rl in pool.imap_unordered(run_batch, staged, 1):
+                for r in rl:
+                    write_result(r, writer_tbl, remaining_tbl, dups_tbl)
+                    store.release(paths_tbl[(r['proj'],) + get_key(r['row'])])
+                    nrows += 1
+                    if nrows % EVICT_INTERVAL == 0:
+                        evict_diffast_cache(cache_dir, cache_budget)
+                sys.stdout.write(' {:2.2f}%\r'.format(nrows*100/ntasks))
+
+        tm = get_time() - st_time
+
+        print(f'processed in {tm/60:.2f} min.')
+
+        if predicted is not None:
+            mes = f'makespan: predicted={predicted:.2f}s actual={tm:.2f}s'
+            logger.info(mes)
+            print(mes)
+
+    finally:
+        for writer in writer_tbl.values():
+            writer.close()
+
+
+async def run_task_async(driver, task):
+    task = dict(task)
+    tool = task.pop('tool')
+    proj = task.pop('proj')
+    path0 = task['path0']
+    path1 = task['path1']
+    st_time = get_time()
+    if tool == 'gumtree':
+        r = await driver.io(quick_result, path0, path1)
+        if r is None:
+            r = await driver.text_gumtree_sim(path0, path1)
+        gt_time = get_time() - st_time
+        logger.info(f'gt_time={gt_time}')
+        row = gt_row(task, r, gt_time)
+    elif tool == 'diffast':
+        r = await driver.io(quick_result, path0, path1)
+        if r is None:
+            r = await driver.text_diffast_sim(path0, path1, keep_going=True,
+                                              scan_huge_arrays=DIFFAST_SCAN_HUGE_ARRAYS,
+                                              no_rr=task.get('no_rr', False),
+                                              weak=True,
+                                              use_cache=task.get('use_cache', False),
+                                              cache_dir=task.get('cache_dir', None))
+        da_time = get_time() - st_time
+        logger.info(f'da_time={da_time}')
+        row = simast_row(task, r, da_time)
+    else:
+        row = await driver.post(get_wrapper(tool), task)
+    return {'tool': tool, 'proj': proj, 'row': row}
+
+
+def failed_result(task):
+    # the result of a task that raised, with NaN times
+    task = dict(task)
+    tool = task.pop('tool')
+    proj = task.pop('proj')
+    if tool == 'gumtree':
+        row = gt_row(task, dict(FAILED_RESULT), math.nan)
+    elif tool == 'diffast':
+        row = simast_row(task, dict(FAILED_RESULT), math.nan)
+    else:
+        row = dict([(k, task[k]) for k in KEY_FIELDS])
+        row['old_sloc'] = row['new_sloc'] = math.nan
+    return {'tool': tool, 'proj': proj, 'row': row}
+
+
+def shootout_async(root, projs, tools, no_rr=False, use_cache=False, nprocs=1, cache_dir=None,
+                   resume=False, incremental=False, cost_order=True, nposts=NPOSTS,
+                   cache_budget=None):
+    logger.info(f'projs={projs} tools={tools} nslots={nprocs} nposts={nposts}')
+    print(f'{len(projs)} projects, tools: {", ".join(tools)},'
+          f' nslots={nprocs}, nposts={nposts}')
+
+    if 'sloccount' in tools and USE_EXTERNAL_SLOCCOUNT and not os.path.exists(SLOCCOUNT_CACHE_NAME):
+        os.makedirs(SLOCCOUNT_CACHE_NAME)
+
+    writer_tbl = {}
+    remaining_tbl = {}
+    dups_tbl = {}
+
+    try:
+        tasks, costs = collect_tasks(root, projs, tools, writer_tbl, remaining_tbl, dups_tbl,
+                                     no_rr=no_rr, use_cache=use_cache, cache_dir=cache_dir,
+                                     resume=resume, incremental=incremental,
+                                     cost_order=cost_order)
+
+        ntasks = len(tasks)
+        print(f'{ntasks} tasks to run')
+
+        if ntasks == 0:
+            return
+
+        predicted = None
+        if cost_order:
+            order = sorted(range(ntasks), key=lambda i: costs[i], reverse=True)
+            tasks = [tasks[i] for i in order]
+            predicted = schedule.predict_makespan([costs[i] for i in order], nprocs)
+            logger.info(f'predicted makespan: {predicted:.2f}s')
+
+        store = samples.get_store(root)
+        paths_tbl = dict([((t['proj'],) + get_key(t), samples.get_task_paths(t)) for t in tasks])
+
+        st_time = get_time()
+        nrows = 0
+
+        def on_result(r):
+            nonlocal nrows
+            write_result(r, writer_tbl, remaining_tbl, dups_tbl)
+            store.release(paths_tbl[(r['proj'],) + get_key(r['row'])])
+            nrows += 1
+            if nrows % EVICT_INTERVAL == 0:
+                evict_diffast_cache(cache_dir, cache_budget)
             sys.stdout.write(' {:2.2f}%\r'.format(nrows*100/ntasks))
 
-    outfile = os.path.join(f'out-gumtree.{proj}.csv')
-    print(f'dumping into {outfile}...')
-    with open(outfile, 'w', newline='') as outf:
+        def on_error(task, e):
+            on_result(failed_result(task))
 
-        header = ['commit', 'path', 'old', 'new', 'gt_time', 'gt_sim', 'gt_col', 'gt_cost']
+        driver = AsyncDriver(nslots=nprocs, nposts=nposts,
+                             use_gumtree_session=USE_GUMTREE_SESSION)
+        asyncio.run(driver.run(store.staged(tasks), run_task_async, on_result, on_error))
 
-        writer = csv.DictWriter(outf, fieldnames=header)
-        writer.writeheader()
+        tm = get_time() - st_time
 
-        for row in rows:
-            writer.writerow(row)
+        print(f'processed in {tm/60:.2f} min.')
+
+        if predicted is not None:
+            mes = f'makespan: predicted={predicted:.2f}s actual={tm:.2f}s'
+            logger.info(mes)
+            print(mes)
+
+    finally:
+        for writer in writer_tbl.values():
+            writer.close()
 
 
 def shootout():
@@ -463,78 +1050,144 @@ def diffast_all(no_rr=False, use_cache=True, cache_dir=None):
         diffast_proj(root, proj, no_rr=no_rr, use_cache=use_cache, cache_dir=cache_dir)
 
 
-def diffast_all_mp(no_rr=False, use_cache=True, nprocs=1, cache_dir=None):
+def diffast_all_mp(no_rr=False, use_cache=True, nprocs=1, cache_dir=None, resume=False):
     root = 'samples'
     for proj in sorted(os.listdir(root)):
         diffast_proj_mp(root, proj,
-                        no_rr=no_rr, use_cache=use_cache, nprocs=nprocs, cache_dir=cache_dir)
+                        no_rr=no_rr, use_cache=use_cache, nprocs=nprocs, cache_dir=cache_dir,
+                        resume=resume)
 
 
-def gt_all_mp(nprocs=1):
+def gt_all_mp(nprocs=1, resume=False):
     root = 'samples'
     for proj in sorted(os.listdir(root)):
-        gt_proj_mp(root, proj, nprocs=nprocs)
+        gt_proj_mp(root, proj, nprocs=nprocs, resume=resume)
 
 
-def gt_mp_main(use_cache=True, nprocs=1):
+def gt_mp_main(use_cache=True, nprocs=1, resume=False, gumtree_cache_dir=GUMTREE_CACHE_NAME):
     mp.set_start_method('fork')
-    gt_all_mp(nprocs=nprocs)
+    common.set_gumtree_cache(cache_dir=gumtree_cache_dir)
+    gt_all_mp(nprocs=nprocs, resume=resume)
 
 
-def da_mp_main(no_rr=False, use_cache=True, nprocs=1, cache_dir=None):
+def da_mp_main(no_rr=False, use_cache=True, nprocs=1, cache_dir=None, resume=False):
     mp.set_start_method('fork')
-    diffast_all_mp(no_rr=no_rr, use_cache=use_cache, nprocs=nprocs, cache_dir=cache_dir)
+    diffast_all_mp(no_rr=no_rr, use_cache=use_cache, nprocs=nprocs, cache_dir=cache_dir,
+                   resume=resume)
 
 
 def main(projs, samples_dir='samples', no_rr=False, use_cache=True, nprocs=1, cache_dir=None,
-         run_sloccount=True, run_gumtree=True, run_diffast=True):
+         run_sloccount=True, run_gumtree=True, run_diffast=True, use_gumtree_session=True,
+         memo_size=MEMO_CACHE_SIZE, memo_bytes=MEMO_CACHE_BYTES, memo_dir=MEMO_CACHE_NAME,
+         resume=False, cost_order=True,
+         use_asyncio=False, nposts=NPOSTS, cache_budget=None,
+         gumtree_cache_dir=GUMTREE_CACHE_NAME, external_sloccount=True, trace=False,
+         record_dir=None, replay_dir=None, dedup=True, incremental=False, quick=True,
+         cache_report=False):
+
+    global USE_GUMTREE_SESSION, USE_EXTERNAL_SLOCCOUNT, DEDUP_PAIRS, QUICK_COMPARE
+    USE_GUMTREE_SESSION = use_gumtree_session
+    USE_EXTERNAL_SLOCCOUNT = external_sloccount
+    DEDUP_PAIRS = dedup
+    QUICK_COMPARE = quick
+
+    common.set_tracing(trace)
+
+    memo = common.set_memo_cache(maxsize=memo_size, cache_dir=memo_dir, maxbytes=memo_bytes)
+    gt_cache = common.set_gumtree_cache(cache_dir=gumtree_cache_dir)
+    archive = common.set_tool_archive(replay_dir or record_dir, replay=replay_dir is not None)
+
+    start_time = time.time()
+
+    if use_asyncio:
+        mp.set_start_method('fork')
+
+        tools = []
+        if run_sloccount:
+            tools.append('sloccount')
+        if run_gumtree:
+            tools.append('gumtree')
+        if run_diffast:
+            tools.append('diffast')
 
-    if nprocs == 1:  # single process
+        shootout_async(samples_dir, projs, tools, no_rr=no_rr, use_cache=use_cache,
+                       nprocs=nprocs, cache_dir=cache_dir, resume=resume,
+                       incremental=incremental, cost_order=cost_order,
+                       nposts=nposts, cache_budget=cache_budget)
+
+    elif nprocs == 1:  # single process
         if run_gumtree and run_diffast:
             for proj in projs:
                 shootout1(samples_dir, proj, no_rr=no_rr,
-                          use_cache=use_cache, cache_dir=cache_dir)
+                          use_cache=use_cache, cache_dir=cache_dir, resume=resume,
+                          incremental=incremental)
+                evict_diffast_cache(cache_dir, cache_budget)
+            close_gumtree_session()
         else:
             if run_sloccount:
                 logger.info('running sloccount...')
                 print('running sloccount...')
                 for proj in projs:
-                    sloccount_proj(samples_dir, proj)
+                    sloccount_proj(samples_dir, proj, resume=resume, incremental=incremental)
 
             if run_gumtree:
                 logger.info('running gumtree...')
                 print('running gumtree...')
                 for proj in projs:
-                    gt_proj(samples_dir, proj)
+                    gt_proj(samples_dir, proj, resume=resume, incremental=incremental)
+                close_gumtree_session()
 
             if run_diffast:
                 logger.info('running diffast...')
                 print('running diffast...')
                 for proj in projs:
                     diffast_proj(samples_dir, proj, no_rr=no_rr,
-                                 use_cache=use_cache, cache_dir=cache_dir)
+                                 use_cache=use_cache, cache_dir=cache_dir, resume=resume,
+                                 incremental=incremental)
+                    evict_diffast_cache(cache_dir, cache_budget)
 
     else:  # multiprocess
         mp.set_start_method('fork')
 
+        tools = []
         if run_sloccount:
-            logger.info('running sloccount...')
-            print('running sloccount...')
-            for proj in projs:
-                sloccount_proj_mp(samples_dir, proj, nprocs=nprocs)
-
+            tools.append('sloccount')
         if run_gumtree:
-            logger.info('running gumtree...')
-            print('running gumtree...')
-            for proj in projs:
-                gt_proj_mp(samples_dir, proj, nprocs=nprocs)
-
+            tools.append('gumtree')
         if run_diffast:
-            logger.info('running diffast...')
-            print('running diffast...')
-            for proj in projs:
-                diffast_proj_mp(samples_dir, proj, no_rr=no_rr, use_cache=use_cache,
-                                nprocs=nprocs, cache_dir=cache_dir)
+            tools.append('diffast')
+
+        shootout_mp(samples_dir, projs, tools, no_rr=no_rr, use_cache=use_cache,
+                    nprocs=nprocs, cache_dir=cache_dir, resume=resume,
+                    incremental=incremental, cost_order=cost_order,
+                    cache_budget=cache_budget)
+
+    report_stats()
+
+    if memo is not None and nprocs == 1 and not use_asyncio:
+        logger.info(f'memo cache: hits={memo.hits} misses={memo.misses}')
+
+    if gt_cache is not None and (nprocs == 1 or use_asyncio):
+        logger.info(f'gumtree cache: hits={gt_cache.hits} misses={gt_cache.misses}')
+
+    if archive is not None and archive.replay and nprocs == 1 and not use_asyncio:
+        logger.info(f'tool archive: hits={archive.hits} misses={archive.misses}')
+
+    if run_diffast and cache_dir is not None:
+        # the usage of the whole cache takes a scan, done only when asked for
+        manager = get_cache_manager(cache_dir)
+        nhits, nmisses = manager.stats(since=start_time)
+        report = f'{cache_dir}: this run: hits={nhits} misses={nmisses}'
+        if cache_budget is not None or cache_report:
+            evict_diffast_cache(cache_dir, cache_budget, compact=True)
+            report = manager.report(since=start_time) + f'\nthis run: hits={nhits} misses={nmisses}'
+        logger.info(report)
+        print(report)
+
+    if trace and TRACE_PATHS:
+        report = trace_report.report(trace_report.load_traces(TRACE_PATHS))
+        logger.info(report)
+        print(report)
 
     # if run_sloccount and run_gumtree and run_diffast:
     #     merge_results()
@@ -555,12 +1208,83 @@ def mkargparser():
     parser.add_argument('--diffast-cache-dir', dest='cache_dir', metavar='DIR',
                         default='CACHE', help='specify diffast cache dir')
 
+    parser.add_argument('--diffast-cache-budget', dest='cache_budget', metavar='SIZE',
+                        type=parse_size, default=None,
+                        help='evict least recently used diffast cache entries beyond SIZE'
+                        ' (e.g. 20G)')
+
+    parser.add_argument('--cache-report', dest='cache_report', action='store_true',
+                        help='report the usage of the whole diffast cache after the run')
+
+    parser.add_argument('--gumtree-cache-dir', dest='gumtree_cache_dir', metavar='DIR',
+                        default=GUMTREE_CACHE_NAME,
+                        help='specify dir for gumtree parse/diff outputs')
+
+    parser.add_argument('--no-gumtree-cache', dest='gumtree_cache_dir', action='store_const',
+                        const=None, help='always run gumtree')
+
+    parser.add_argument('--memo-dir', dest='memo_dir', metavar='DIR',
+                        default=MEMO_CACHE_NAME,
+                        help='specify dir for per-file results shared across tools')
+
+    parser.add_argument('--memo-size', dest='memo_size', metavar='N', type=int,
+                        default=MEMO_CACHE_SIZE,
+                        help='specify number of per-file results kept in memory (0 to disable)')
+
+    parser.add_argument('--memo-budget', dest='memo_bytes', metavar='SIZE', type=parse_size,
+                        default=MEMO_CACHE_BYTES,
+                        help='bound estimated memory taken by per-file results (per process)')
+
     parser.add_argument('--no-rr', dest='no_rr', action='store_true',
                         help='disable rename rectification')
 
+    parser.add_argument('--no-gumtree-session', dest='use_gumtree_session',
+                        action='store_false',
+                        help='launch gumtree for each parse/diff instead of a gumtree server')
+
+    parser.add_argument('--native-sloccount', dest='external_sloccount', action='store_false',
+                        help='count SLOC in-process instead of running sloccount for each file'
+                        ' (check with sloccount.py --validate first)')
+
     parser.add_argument('-c', '--use-cache', dest='use_cache',
                         action='store_true', help='use cache')
 
+    parser.add_argument('--resume', action='store_true',
+                        help='keep results already in output files and run the remaining pairs')
+
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep results whose inputs, tool versions and options are unchanged'
+                        f' (*{manifest.MANIFEST_SUFFIX} alongside the CSVs) and run the others')
+
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+                        help='run every pair even if its contents are identical to another\'s')
+
+    parser.add_argument('--no-quick', dest='quick', action='store_false',
+                        help='run the tools even on pairs whose contents are identical or differ'
+                        ' only in whitespace and comments')
+
+    parser.add_argument('--index-order', dest='cost_order', action='store_false',
+                        help='dispatch tasks in index order instead of estimated largest first')
+
+    parser.add_argument('--asyncio', dest='use_asyncio', action='store_true',
+                        help='drive external tools from an asyncio event loop'
+                        ' (NPROCS tools in flight)')
+
+    parser.add_argument('--post-procs', dest='nposts', metavar='N', type=int,
+                        default=NPOSTS,
+                        help='specify number of processes for post-processing with --asyncio')
+
+    parser.add_argument('--trace', action='store_true',
+                        help='record time spent in each phase of each pair'
+                        f' (*{trace_report.TRACE_SUFFIX} alongside the CSVs)')
+
+    parser.add_argument('--record', dest='record_dir', metavar='DIR', default=None,
+                        help='archive command lines, outputs and cache files of the tools'
+                        ' into DIR')
+
+    parser.add_argument('--replay', dest='replay_dir', metavar='DIR', default=None,
+                        help='read the tool outputs archived in DIR instead of running the tools')
+
     parser.add_argument('--gumtree', action='store_true',
                         help='run gumtree only')
 
@@ -570,9 +1294,12 @@ def mkargparser():
     parser.add_argument('--sloccount', action='store_true',
                         help='run sloccount only')
 
+    parser.add_argument('--samples-dir', dest='samples_dir', metavar='DIR', default='samples',
+                        help='specify samples dir (DIR.txz is read in place if DIR is missing)')
+
     parser.add_argument('--proj', dest='projs', metavar='PROJ', nargs='*',
-                        default=PROJECTS, choices=PROJECTS,
-                        help='specify project(s)')
+                        default=None,
+                        help='specify project(s) (all projects in the samples dir by default)')
 
     parser.add_argument('-d', '--debug', dest='debug', action='store_true',
                         help='enable debug printing')
@@ -633,7 +1360,23 @@ if __name__ == '__main__':
     if args.nprocs < 1:
         logger.error(f'invalid number of processes: {args.nprocs}')
 
-    main(args.projs,
+    if args.record_dir and args.replay_dir:
+        parser.error('--record and --replay are exclusive')
+
+    projs = args.projs or get_projects(args.samples_dir)
+    for proj in projs:
+        if proj not in get_projects(args.samples_dir):
+            parser.error(f'project not found in {args.samples_dir}: {proj}')
+
+    main(projs, samples_dir=args.samples_dir,
          no_rr=args.no_rr, use_cache=args.use_cache, nprocs=args.nprocs, cache_dir=args.cache_dir,
          run_sloccount=run_sloccount,
-         run_gumtree=run_gumtree, run_diffast=run_diffast)
+         run_gumtree=run_gumtree, run_diffast=run_diffast,
+         use_gumtree_session=args.use_gumtree_session,
+         memo_size=args.memo_size, memo_bytes=args.memo_bytes, memo_dir=args.memo_dir,
+         resume=args.resume,
+         cost_order=args.cost_order, use_asyncio=args.use_asyncio, nposts=args.nposts,
+         cache_budget=args.cache_budget, gumtree_cache_dir=args.gumtree_cache_dir,
+         external_sloccount=args.external_sloccount, trace=args.trace,
+         record_dir=args.record_dir, replay_dir=args.replay_dir, dedup=args.dedup,
+         incremental=args.incremental, quick=args.quick, cache_report=args.cache_report)
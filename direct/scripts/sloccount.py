@@ -4,6 +4,7 @@
 
 import os
 import re
+import shutil
 import tempfile
 import logging
 
@@ -24,6 +25,17 @@ LANG_TBL = {
     'fortran': ['fortran', 'f90'],
 }
 
+EXT_TBL = {
+    '.java': 'java',
+    '.py': 'python',
+}
+
+C_NORMAL_PAT = re.compile(rb'/\*|//|["\'\n]|[^\s"\'/]+|/')
+C_STRING_PAT = re.compile(rb'\\["\\\n]|["\n]|[^\s"\\]+|\\')
+PY_TRIPLE_PAT = re.compile(rb'^\s*(\'\'\'|""")')
+PY_COMMENT_PAT = re.compile(rb'#.*')
+NON_SPACE_PAT = re.compile(rb'\S')
+
 ###
 
 
@@ -157,7 +169,157 @@ def sloccount_for_lang(lang, path, datadir=None):
     return count
 
 
+def count_c(b):
+    # physical SLOC by the rules of sloccount's c_count (also used for Java):
+    # a line counts if it has a non-blank character outside comments
+    n = len(b)
+    sloc = 0
+    sawchar = False
+    pos = 0
+    while pos < n:
+        m = C_NORMAL_PAT.search(b, pos)
+        if m is None:
+            break
+        tok = m.group()
+        pos = m.end()
+        if tok == b'\n':
+            if sawchar:
+                sloc += 1
+            sawchar = False
+        elif tok == b'"':
+            sawchar = True
+            while pos < n:
+                m = C_STRING_PAT.search(b, pos)
+                if m is None:
+                    pos = n
+                    break
+                tok = m.group()
+                pos = m.end()
+                if tok == b'\n':
+                    if sawchar:
+                        sloc += 1
+                    sawchar = False
+                    continue
+                sawchar = True
+                if tok == b'"':
+                    break
+                if tok == b'\\\n':
+                    sloc += 1
+                    sawchar = False
+        elif tok == b"'":
+            # c_count skips a character constant without checking the first
+            # (or escaped) character for a newline
+            sawchar = True
+            c = b[pos:pos+1]
+            pos += 1
+            if c == b'\\':
+                pos += 1
+            while True:
+                c = b[pos:pos+1]
+                pos += 1
+                if c in (b"'", b'\n', b''):
+                    break
+            if c == b'\n':
+                sloc += 1
+                sawchar = False
+        elif tok == b'/*':
+            ed = b.find(b'*/', pos)
+            if ed < 0:
+                ed = n
+            if sawchar and b.find(b'\n', pos, ed) >= 0:
+                sloc += 1
+                sawchar = False
+            pos = ed + 2
+        elif tok == b'//':
+            ed = b.find(b'\n', pos)
+            pos = n if ed < 0 else ed
+        else:
+            sawchar = True
+    if sawchar:
+        sloc += 1
+    return sloc
+
+
+def count_python(b):
+    # follows sloccount's python_count: '#' comments are removed and
+    # triple-quoted strings starting a line are taken as comments
+    sloc = 0
+    closing = None
+    for line in b.splitlines():
+        if closing is not None:
+            i = line.find(closing)
+            if i < 0:
+                continue
+            line = line[i+3:]
+            closing = None
+        while True:
+            m = PY_TRIPLE_PAT.match(line)
+            if not m:
+                break
+            q = m.group(1)
+            i = line.find(q, m.end())
+            if i < 0:
+                closing = q
+                line = b''
+                break
+            line = line[i+3:]
+        line = PY_COMMENT_PAT.sub(b'', line)
+        if NON_SPACE_PAT.search(line):
+            sloc += 1
+    return sloc
+
+
+COUNTER_TBL = {
+    'java': count_c,
+    'python': count_python,
+}
+
+
+def get_lang(path):
+    return EXT_TBL.get(os.path.splitext(path)[1], None)
+
+
+def count_sloc(path, lang=None):
+    if lang is None:
+        lang = get_lang(path)
+    count = COUNTER_TBL[lang]
+    with open(path, 'rb') as f:
+        return count(f.read())
+
+
+def sloccount_dir(root, langs=None):
+    tbl = {}
+    for dpath, dns, fns in os.walk(root, followlinks=True):
+        dns.sort()
+        for fn in sorted(fns):
+            lang = get_lang(fn)
+            if lang is None or (langs is not None and lang not in langs):
+                continue
+            path = os.path.join(dpath, fn)
+            try:
+                tbl[path] = (lang, count_sloc(path, lang))
+            except OSError as e:
+                logger.warning(f'{path}: {e}')
+    return tbl
+
+
+def validate(root, langs=None):
+    if shutil.which(SLOCCOUNT) is None:
+        raise RuntimeError(f'{SLOCCOUNT} not found: cannot validate in-process counts')
+    tbl = sloccount_dir(root, langs=langs)
+    if not tbl:
+        raise RuntimeError(f'no source files found in {root}')
+    mismatches = []
+    for path, (lang, sloc) in tbl.items():
+        ext = sloccount_for_lang(lang, path)
+        if sloc != ext:
+            mismatches.append(path)
+            print(f'! {path}: {sloc} != {ext} ({lang})')
+    return mismatches
+
+
 if __name__ == '__main__':
+    import sys
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
     parser = ArgumentParser(description='SLOCCount Driver',
@@ -168,6 +330,12 @@ if __name__ == '__main__':
     parser.add_argument('-l', '--lang', dest='lang', type=str, default=None,
                         help='programming language to be handled')
 
+    parser.add_argument('-n', '--native', dest='native', action='store_true',
+                        help='count Java and Python files in-process instead of running sloccount')
+
+    parser.add_argument('--validate', dest='validate', action='store_true',
+                        help='compare in-process counts with sloccount for each file')
+
     parser.add_argument('-d', '--debug', dest='debug', action='store_true',
                         help='enable debug printing')
 
@@ -184,7 +352,30 @@ if __name__ == '__main__':
     logging.basicConfig(format='[%(levelname)s][%(funcName)s] %(message)s',
                         level=log_level)
 
-    if args.lang:
+    langs = [args.lang] if args.lang else None
+
+    if args.validate:
+        try:
+            mismatches = validate(args.path, langs=langs)
+        except RuntimeError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        print(f'{len(mismatches)} mismatches')
+        if mismatches:
+            sys.exit(1)
+
+    elif args.native:
+        if os.path.isdir(args.path):
+            tbl = {}
+            for lang, sloc in sloccount_dir(args.path, langs=langs).values():
+                tbl[lang] = tbl.get(lang, 0) + sloc
+            for x in tbl.items():
+                print('{}: {}'.format(*x))
+            print(f'total: {sum(tbl.values())}')
+        else:
+            print(f'{count_sloc(args.path, lang=args.lang)}')
+
+    elif args.lang:
         c = sloccount_for_lang(args.lang, args.path)
         print(f'{c}')
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# An archive of external tool runs (command line, stdout and the files left in
+# the tool's cache) keyed by the contents of the inputs and the options, so that
+# the analysis can be replayed without the tools
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import tempfile
+import logging
+
+from memo import file_digest
+
+logger = logging.getLogger()
+
+ENTRY_FILE = 'entry.json'
+STDOUT_FILE = 'stdout.gz'
+
+
+class ToolArchive(object):
+    def __init__(self, root, replay=False, digest=file_digest):
+        self.root = root
+        self.replay = replay
+        self.digest = digest
+        self.hits = 0
+        self.misses = 0
+
+    def _get_dir(self, kind, paths, opts):
+        fields = [kind] + [self.digest(p) for p in paths] + [str(o) for o in opts]
+        key = hashlib.sha1('\0'.join(fields).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, kind, key[:2], key)
+
+    def get(self, kind, paths, opts):
+        # returns the entry dir holding the archived files and the entry
+        try:
+            d = self._get_dir(kind, paths, opts)
+            with open(os.path.join(d, ENTRY_FILE)) as f:
+                entry = json.load(f)
+            with gzip.open(os.path.join(d, STDOUT_FILE), 'rb') as f:
+                entry['stdout'] = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None, None
+        self.hits += 1
+        return d, entry
+
+    def get_stdout(self, kind, paths, opts):
+        _, entry = self.get(kind, paths, opts)
+        if entry is None:
+            return None
+        return entry['stdout']
+
+    def put(self, kind, paths, opts, cmd, stdout, returncode=0, files_dir=None, files=()):
+        try:
+            d = self._get_dir(kind, paths, opts)
+        except OSError as e:
+            logger.warning(f'failed to archive {kind} of {paths}: {e}')
+            return
+        if os.path.exists(os.path.join(d, ENTRY_FILE)):
+            return
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(d), exist_ok=True)
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(d))
+            names = []
+            for fn in files:
+                src = os.path.join(files_dir, fn)
+                if os.path.exists(src):
+                    shutil.copyfile(src, os.path.join(tmp, fn))
+                    names.append(fn)
+            if isinstance(stdout, str):
+                stdout = stdout.encode('utf-8')
+            with gzip.open(os.path.join(tmp, STDOUT_FILE), 'wb', compresslevel=6) as f:
+                f.write(stdout or b'')
+            entry = {'kind': kind, 'inputs': paths, 'opts': [str(o) for o in opts],
+                     'cmd': cmd, 'returncode': returncode, 'files': names}
+            with open(os.path.join(tmp, ENTRY_FILE), 'w') as f:
+                json.dump(entry, f, indent=2)
+            # another process may have archived the same run meanwhile
+            os.rename(tmp, d)
+        except Exception as e:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(d, ENTRY_FILE)):
+                logger.warning(f'failed to archive {kind} of {paths}: {e}')
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+# Summarizes the per-pair phase traces written by shootout.py --trace
+
+import os
+import sys
+import json
+import logging
+
+logger = logging.getLogger()
+
+TRACE_SUFFIX = '.trace.jsonl'
+
+OTHER = 'other'
+
+
+def get_trace_path(outfile):
+    return os.path.splitext(outfile)[0] + TRACE_SUFFIX
+
+
+def load_traces(paths):
+    records = []
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f'invalid line in {path}: {line}')
+        except OSError as e:
+            logger.warning(f'failed to read {path}: {e}')
+    return records
+
+
+def get_other(rec):
+    return max(rec['time'] - sum(rec['spans'].values()), .0)
+
+
+def summarize(records):
+    tbl = {}
+    for rec in records:
+        tool = rec.get('tool', '?')
+        n, total, phases = tbl.get(tool, (0, .0, {}))
+        for phase, t in rec['spans'].items():
+            phases[phase] = phases.get(phase, .0) + t
+        phases[OTHER] = phases.get(OTHER, .0) + get_other(rec)
+        tbl[tool] = (n + 1, total + rec['time'], phases)
+    return tbl
+
+
+def get_top_phase(rec):
+    phases = dict(rec['spans'])
+    phases[OTHER] = get_other(rec)
+    return max(phases.items(), key=lambda x: x[1])
+
+
+def report(records, ntop=5):
+    lines = []
+    for tool, (n, total, phases) in sorted(summarize(records).items()):
+        lines.append(f'{tool}: {n} pairs, {total:.2f}s in total, {total/n:.3f}s per pair')
+        for phase, t in sorted(phases.items(), key=lambda x: x[1], reverse=True):
+            r = t * 100 / total if total else .0
+            lines.append(f'  {phase:<12} {t:10.2f}s {r:5.1f}%')
+        recs = [rec for rec in records if rec.get('tool', '?') == tool]
+        recs.sort(key=lambda rec: rec['time'], reverse=True)
+        if ntop and recs:
+            lines.append(f'  slowest {min(ntop, len(recs))}:')
+            for rec in recs[:ntop]:
+                phase, t = get_top_phase(rec)
+                lines.append(f'    {rec["time"]:8.3f}s {rec["commit"]} {rec["path"]}'
+                             f' ({phase}: {t:.3f}s)')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+    parser = ArgumentParser(description='report where the time of each tool went',
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('traces', nargs='*', metavar='TRACE',
+                        help=f'specify trace files (*{TRACE_SUFFIX} in the current dir by default)')
+
+    parser.add_argument('-n', '--top', dest='ntop', metavar='N', type=int, default=5,
+                        help='show N slowest pairs of each tool')
+
+    args = parser.parse_args()
+
+    paths = args.traces or sorted(fn for fn in os.listdir('.') if fn.endswith(TRACE_SUFFIX))
+
+    if not paths:
+        print('no trace found')
+        sys.exit(1)
+
+    print(report(load_traces(paths), ntop=args.ntop))